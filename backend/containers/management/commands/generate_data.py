@@ -0,0 +1,364 @@
+import bisect
+import math
+import random
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import DateField, DateTimeField, Q
+from django.utils import timezone
+
+from ports.models import Country, Port
+from containers.models import ContainerType, CargoType
+from quotes.models import ShippingRoute, BaseRate, Quote, QuoteItem
+from quotes.signals import PRICING_MODELS
+from quotes import distances, rate_matrix, rollups, search, snapshot
+from shipquote_backend import http_cache
+
+# Prefijos de los códigos generados (no chocan con los datos de ejemplo ni con SQYYYYMMDDNNNN)
+COUNTRY_PREFIX = 'Z'
+PORT_PREFIX = 'G'
+QUOTE_PREFIX = 'SG'
+BASE36 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+# Por unidad de --scale
+PORTS_PER_SCALE = 500
+QUOTES_PER_SCALE = 500_000
+CUSTOMERS_PER_SCALE = 20_000
+
+CONTINENTS = {
+    # continente: (latitud, longitud) mínimas y máximas
+    'América del Norte': ((15, 60), (-130, -60)),
+    'América del Sur': ((-45, 10), (-80, -35)),
+    'Europa': ((36, 65), (-10, 30)),
+    'Asia': ((-8, 45), (60, 145)),
+    'África': ((-35, 35), (-17, 50)),
+    'Oceanía': ((-45, -10), (113, 178)),
+}
+# Estados según si la cotización ya venció o sigue vigente
+EXPIRED_STATUSES = (('ACCEPTED', 30), ('REJECTED', 20), ('EXPIRED', 40), ('SENT', 6), ('DRAFT', 4))
+OPEN_STATUSES = (('DRAFT', 35), ('SENT', 50), ('ACCEPTED', 10), ('REJECTED', 5))
+ITEM_COUNTS = ((1, 50), (2, 30), (3, 15), (4, 5))
+ITEM_QUANTITIES = ((1, 55), (2, 25), (3, 10), (5, 7), (10, 3))
+VALIDITY_DAYS = (7, 15, 30)
+HANDLING_FEES = tuple(Decimal(fee) for fee in (75, 100, 150))
+INSURANCE_FEES = tuple(Decimal(fee) for fee in (0, 0, 25, 60))
+DOCUMENTATION_FEES = tuple(Decimal(fee) for fee in (35, 50, 75))
+# Recargo relativo por tipo de contenedor sobre la tarifa de un 20' seco
+CONTAINER_FACTORS = {('20', 'DRY'): 1.0, ('40', 'DRY'): 1.6, ('40HC', 'DRY'): 1.75, ('45', 'DRY'): 1.9}
+
+# Columnas en el orden de las tuplas que arman _crear_cotizaciones y _guardar_lote
+QUOTE_FIELDS = (
+    'quote_number', 'customer_name', 'customer_email', 'customer_company', 'origin_port', 'destination_port',
+    'status', 'currency', 'valid_until', 'created_at', 'updated_at',
+    'item_count', 'total_weight_kg', 'total_volume_cbm', 'documentation_fee', 'total_amount', 'notes',
+)
+ITEM_FIELDS = (
+    'quote', 'container_type', 'cargo_type', 'quantity', 'weight_kg', 'volume_cbm', 'base_rate',
+    'fuel_surcharge', 'handling_fee', 'documentation_fee', 'insurance_fee', 'subtotal',
+)
+ZERO = Decimal('0')
+CENT = Decimal('0.01')
+
+
+def _base36(value, width):
+    digits = ''
+    for _ in range(width):
+        value, digit = divmod(value, 36)
+        digits = BASE36[digit] + digits
+    return digits
+
+
+def _cumulative(weights):
+    total, result = 0, []
+    for weight in weights:
+        total += weight
+        result.append(total)
+    return result
+
+
+def _weighted(choices):
+    """(valores, pesos acumulados) para elegir con _pick."""
+    return [value for value, _ in choices], _cumulative(weight for _, weight in choices)
+
+
+class Command(BaseCommand):
+    help = ('Genera un conjunto de datos sintético del tamaño de producción (países, puertos, red de rutas, '
+            'historial de tarifas, cotizaciones e ítems) con bulk_create, determinístico según --seed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1,
+                            help=f'Factor de escala: {PORTS_PER_SCALE} puertos y {QUOTES_PER_SCALE} cotizaciones por unidad.')
+        parser.add_argument('--ports', type=int, help='Cantidad de puertos (reemplaza la escala).')
+        parser.add_argument('--quotes', type=int, help='Cantidad de cotizaciones (reemplaza la escala).')
+        parser.add_argument('--routes-per-port', type=int, default=20, help='Rutas salientes por puerto.')
+        parser.add_argument('--rate-history', type=int, default=8, help='Trimestres de tarifas por ruta y contenedor.')
+        parser.add_argument('--days', type=int, default=730, help='Días de historia de cotizaciones.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if Port.objects.filter(code__startswith=PORT_PREFIX).exists():
+            raise CommandError('Generated data already exists; run "manage.py flush" first.')
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        scale = options['scale']
+        ports = options['ports'] or max(2, int(PORTS_PER_SCALE * scale))
+        quotes = options['quotes'] if options['quotes'] is not None else int(QUOTES_PER_SCALE * scale)
+        started = time.perf_counter()
+
+        # Tipos de contenedor y carga de referencia (y los datos de ejemplo)
+        call_command('data', stdout=self.stdout)
+        self.container_types = [
+            (pk, size, type_, CONTAINER_FACTORS.get((size, type_), 2.2 if type_ == 'REEFER' else 1.8))
+            for pk, size, type_ in ContainerType.objects.order_by('id').values_list('id', 'size', 'type')
+        ]
+        self.cargo_types = list(CargoType.objects.order_by('id').values_list('id', flat=True))
+
+        with transaction.atomic():
+            self._crear_paises(max(20, min(36 * 36, int(60 + 10 * scale))))
+            self._crear_puertos(ports)
+            self._crear_rutas(options['routes_per_port'])
+            self._crear_tarifas(options['rate_history'])
+        self._crear_cotizaciones(quotes, options['days'], max(100, int(CUSTOMERS_PER_SCALE * scale)))
+
+        self.stdout.write('Indexando cotizaciones para la búsqueda...')
+        search.reindex(Q(quote_number__startswith=QUOTE_PREFIX))
+        self.stdout.write('Calculando los rollups de analytics...')
+        rollups.rebuild()
+        self.stdout.write('Calculando la matriz de distancias entre puertos...')
+        distances.build()
+
+        self.stdout.write('Actualizando snapshot de precios, grilla de tarifas y caché HTTP...')
+        snapshot.invalidate()
+        rate_matrix.rebuild()
+        http_cache.bump(*PRICING_MODELS)
+        self.stdout.write(self.style.SUCCESS(f'Datos generados en {time.perf_counter() - started:.0f}s.'))
+
+    def _pick(self, values, cumulative):
+        """Elección ponderada (más barata que random.choices); sin valores devuelve el índice."""
+        index = bisect.bisect(cumulative, self.random.random() * cumulative[-1])
+        return index if values is None else values[index]
+
+    def _crear_paises(self, count):
+        self.stdout.write(f'Creando {count} países...')
+        continents = list(CONTINENTS)
+        Country.objects.bulk_create([
+            Country(name=f'País {i}', code=f'{COUNTRY_PREFIX}{_base36(i, 2)}', continent=continents[i % len(continents)])
+            for i in range(count)
+        ], batch_size=self.batch_size)
+        self.countries = list(Country.objects.filter(code__startswith=COUNTRY_PREFIX).order_by('code')
+                              .values_list('id', 'continent'))
+
+    def _crear_puertos(self, count):
+        self.stdout.write(f'Creando {count} puertos...')
+        ports = []
+        for i in range(count):
+            country_id, continent = self.countries[i % len(self.countries)]
+            (lat_min, lat_max), (lon_min, lon_max) = CONTINENTS[continent]
+            ports.append(Port(
+                name=f'Puerto {i}', code=f'{PORT_PREFIX}{i:05d}', country_id=country_id, city=f'Ciudad {i}',
+                latitude=Decimal(f'{self.random.uniform(lat_min, lat_max):.7f}'),
+                longitude=Decimal(f'{self.random.uniform(lon_min, lon_max):.7f}'),
+                is_active=self.random.random() > 0.02,
+            ))
+        Port.objects.bulk_create(ports, batch_size=self.batch_size)
+        self.ports = list(Port.objects.filter(code__startswith=PORT_PREFIX).order_by('code')
+                          .values_list('id', 'latitude', 'longitude'))
+
+    def _crear_rutas(self, routes_per_port):
+        # Pocos puertos concentran la mayor parte del tráfico (distribución tipo Zipf)
+        hubs = _cumulative(1 / (rank + 1) ** 0.9 for rank in range(len(self.ports)))
+        pairs = []
+        for origin in range(len(self.ports)):
+            destinations = set()
+            target = min(routes_per_port, len(self.ports) - 1)
+            while len(destinations) < target:
+                destination = self._pick(None, hubs)
+                if destination != origin:
+                    destinations.add(destination)
+            pairs.extend((origin, destination) for destination in sorted(destinations))
+
+        self.stdout.write(f'Creando {len(pairs)} rutas...')
+        routes = []
+        for origin, destination in pairs:
+            (_, lat1, lon1), (_, lat2, lon2) = self.ports[origin], self.ports[destination]
+            great_circle = distances.great_circle_nm((float(lat1), float(lon1)), (float(lat2), float(lon2)))
+            distance = max(50, round(great_circle * distances.SEA_ROUTE_FACTOR))
+            routes.append(ShippingRoute(
+                origin_port_id=self.ports[origin][0], destination_port_id=self.ports[destination][0],
+                distance_nautical_miles=distance,
+                # 16-20 nudos de servicio más los días de puerto
+                estimated_transit_days=math.ceil(distance / (24 * self.random.uniform(16, 20))) + self.random.randint(1, 4),
+            ))
+        ShippingRoute.objects.bulk_create(routes, batch_size=self.batch_size)
+        ids = {
+            (origin, destination): pk for pk, origin, destination in ShippingRoute.objects.filter(
+                origin_port__code__startswith=PORT_PREFIX,
+            ).values_list('id', 'origin_port_id', 'destination_port_id').iterator()
+        }
+        # (id, distancia, origen, destino) en el orden de pairs
+        self.routes = [
+            (ids[(route.origin_port_id, route.destination_port_id)], route.distance_nautical_miles,
+             route.origin_port_id, route.destination_port_id)
+            for route in routes
+        ]
+        self.route_weights = _cumulative(1 / ((o + 1) * (d + 1)) ** 0.5 for o, d in pairs)
+
+    def _insertar(self, model, fields, rows):
+        """
+        INSERT con executemany de tuplas ya armadas: sin instancias de modelos
+        ni la compilación por fila de bulk_create, que en las tablas grandes
+        cuesta más que el insert. Los decimales ya vienen redondeados.
+        """
+        fields = [model._meta.get_field(name) for name in fields]
+        ops = connection.ops
+        converters = [
+            ops.adapt_datetimefield_value if isinstance(field, DateTimeField)
+            else ops.adapt_datefield_value if isinstance(field, DateField) else None
+            for field in fields
+        ]
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            ops.quote_name(model._meta.db_table),
+            ', '.join(ops.quote_name(field.column) for field in fields),
+            ', '.join(['%s'] * len(fields)),
+        )
+        if any(converters):
+            rows = [
+                [value if convert is None or value is None else convert(value)
+                 for value, convert in zip(row, converters)]
+                for row in rows
+            ]
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), self.batch_size):
+                cursor.executemany(sql, rows[start:start + self.batch_size])
+
+    def _crear_tarifas(self, history):
+        """
+        Tarifas trimestrales por ruta y contenedor. Algunas se cerraron tarde y
+        se superponen con la siguiente, y unas pocas están inactivas, como en
+        los datos reales.
+        """
+        self.stdout.write(f'Creando {len(self.routes) * len(self.container_types) * history} tarifas...')
+        fields = ('route', 'container_type', 'base_rate_usd', 'fuel_surcharge_percentage',
+                  'currency_adjustment_factor', 'effective_from', 'effective_to', 'is_active')
+        first_start = date.today() - timedelta(days=91 * (history - 1))
+        self.prices = []
+        rates = []
+        for route_id, distance, _, _ in self.routes:
+            base = 350 + distance * self.random.uniform(0.18, 0.32)
+            self.prices.append(base)
+            for container_type_id, _, _, factor in self.container_types:
+                for version in range(history):
+                    start = first_start + timedelta(days=91 * version)
+                    end = None if version == history - 1 else start + timedelta(days=90)
+                    if end and self.random.random() < 0.1:
+                        end += timedelta(days=self.random.randint(5, 30))
+                    rates.append((
+                        route_id, container_type_id,
+                        Decimal(f'{base * factor * self.random.uniform(0.85, 1.25):.2f}'),
+                        Decimal(self.random.randint(8, 22)),
+                        Decimal(f'{self.random.uniform(0.98, 1.05):.4f}'),
+                        start, end, self.random.random() > 0.03,
+                    ))
+            if len(rates) >= self.batch_size:
+                self._insertar(BaseRate, fields, rates)
+                rates = []
+        self._insertar(BaseRate, fields, rates)
+
+    def _dias(self, count, days):
+        """Cotizaciones por día: crecimiento a lo largo del período y menos actividad el fin de semana."""
+        today = timezone.localdate()
+        first = today - timedelta(days=days - 1)
+        weights = []
+        for offset in range(days):
+            day = first + timedelta(days=offset)
+            weights.append((0.5 + offset / days) * (0.3 if day.weekday() >= 5 else 1.0))
+        total = sum(weights)
+        carry = 0.0
+        for offset, weight in enumerate(weights):
+            exact = count * weight / total + carry
+            per_day = int(exact)
+            carry = exact - per_day
+            yield first + timedelta(days=offset), per_day + (1 if offset == days - 1 and carry > 0.5 else 0)
+
+    def _crear_cotizaciones(self, count, days, customers):
+        self.stdout.write(f'Creando {count} cotizaciones con sus ítems...')
+        now = timezone.now()
+        tz = timezone.get_current_timezone()
+        customer_weights = _cumulative(1 / (rank + 1) ** 0.7 for rank in range(customers))
+        expired_statuses, open_statuses = _weighted(EXPIRED_STATUSES), _weighted(OPEN_STATUSES)
+
+        number = 0
+        pending = []
+        started = time.perf_counter()
+        for day, per_day in self._dias(count, days):
+            # Horario de oficina, ordenado: los ids crecen con created_at como en producción
+            midnight = datetime.combine(day, dt_time(), tzinfo=tz)
+            # Hoy solo hasta la hora actual
+            last = max(0, min(20 * 3600, int((now - midnight).total_seconds()) - 60))
+            first = min(7 * 3600, last)
+            for second in sorted(self.random.randint(first, last) for _ in range(per_day)):
+                created = midnight + timedelta(seconds=second)
+                valid_until = created + timedelta(days=self.random.choice(VALIDITY_DAYS))
+                status = self._pick(*(expired_statuses if valid_until < now else open_statuses))
+                route = self._pick(None, self.route_weights)
+                customer = self._pick(None, customer_weights)
+                updated = created if status == 'DRAFT' else created + timedelta(hours=self.random.randint(1, 72))
+                pending.append([
+                    f'{QUOTE_PREFIX}{number:012d}', f'Cliente {customer}',
+                    f'compras{customer}@cliente{customer % 997}.example.com', f'Empresa {customer % 997}',
+                    self.routes[route][2], self.routes[route][3], status, 'USD',
+                    valid_until, created, min(updated, now), route,
+                ])
+                number += 1
+                if len(pending) >= self.batch_size:
+                    self._guardar_lote(pending)
+                    pending = []
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(f'  {number} cotizaciones ({number / elapsed:.0f}/s)')
+        if pending:
+            self._guardar_lote(pending)
+
+    def _guardar_lote(self, quotes):
+        """Cotizaciones e ítems de un lote en una transacción, con los totales ya calculados."""
+        item_counts, quantities = _weighted(ITEM_COUNTS), _weighted(ITEM_QUANTITIES)
+        items = []
+        for quote in quotes:
+            route = quote.pop()
+            count = self._pick(*item_counts)
+            weight = volume = subtotals = documentation_fee = ZERO
+            for _ in range(count):
+                container_type_id, _, _, factor = self.random.choice(self.container_types)
+                base_rate = Decimal(f'{self.prices[route] * factor * self.random.uniform(0.9, 1.2):.2f}')
+                quantity = self._pick(*quantities)
+                fuel_surcharge = (base_rate * self.random.randint(8, 22) / 100).quantize(CENT)
+                handling_fee = self.random.choice(HANDLING_FEES)
+                insurance_fee = self.random.choice(INSURANCE_FEES)
+                item_fee = self.random.choice(DOCUMENTATION_FEES)
+                # Mismo cálculo que QuoteItem.calculate_subtotal y totals.summarize
+                subtotal = (base_rate + fuel_surcharge + handling_fee + insurance_fee) * quantity
+                item_weight = Decimal(f'{quantity * self.random.uniform(4000, 24000):.2f}')
+                item_volume = Decimal(f'{quantity * self.random.uniform(15, 60):.2f}')
+                items.append([
+                    quote[0], container_type_id, self.random.choice(self.cargo_types), quantity, item_weight,
+                    item_volume, base_rate, fuel_surcharge, handling_fee, item_fee, insurance_fee, subtotal,
+                ])
+                weight += item_weight
+                volume += item_volume
+                subtotals += subtotal
+                documentation_fee = max(documentation_fee, item_fee)
+            quote += [count, weight, volume, documentation_fee, subtotals + documentation_fee, '']
+
+        with transaction.atomic():
+            self._insertar(Quote, QUOTE_FIELDS, quotes)
+            # executemany no devuelve los ids: se leen por número de cotización
+            ids = dict(Quote.objects.filter(
+                quote_number__gte=quotes[0][0], quote_number__lte=quotes[-1][0],
+            ).values_list('quote_number', 'id'))
+            for item in items:
+                item[0] = ids[item[0]]
+            self._insertar(QuoteItem, ITEM_FIELDS, items)
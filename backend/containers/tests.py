@@ -1,3 +1,60 @@
+import io
+
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from ports.models import Country, Port
+from quotes.models import BaseRate, Quote, QuoteItem
+from quotes import totals
+from .models import ContainerType, CargoType
+
+
+class QueryBudgetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        for size in ('20', '40', '40HC'):
+            ContainerType.objects.create(name=f'Contenedor {size}', size=size, type='DRY', max_weight=28000,
+                                         internal_length=5.89, internal_width=2.35, internal_height=2.39, volume=33.2)
+            CargoType.objects.create(name=f'Carga {size}')
+
+    def test_list_and_detail_budgets(self):
+        for url in ('/api/v1/container-types/', '/api/v1/cargo-types/'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(queries), 2, url)
+
+            pk = response.json()['results'][0]['id']
+            with self.assertNumQueries(1):
+                self.client.get(f'{url}{pk}/')
+
+
+class GenerateDataTests(TestCase):
+    def generate(self):
+        call_command('generate_data', ports=12, quotes=300, routes_per_port=4, rate_history=3, days=30, seed=7,
+                     batch_size=100, stdout=io.StringIO())
+        return list(Quote.objects.filter(quote_number__startswith='SG').order_by('quote_number').values_list(
+            'quote_number', 'origin_port__code', 'status', 'created_at', 'total_amount'))
+
+    def test_dataset_is_consistent_and_deterministic(self):
+        quotes = self.generate()
+        self.assertEqual(len(quotes), 300)
+        self.assertEqual(Port.objects.filter(code__startswith='G').count(), 12)
+        self.assertEqual(BaseRate.objects.filter(route__origin_port__code__startswith='G').count(),
+                         12 * 4 * ContainerType.objects.count() * 3)
+        self.assertTrue(QuoteItem.objects.filter(quote__quote_number__startswith='SG').exists())
+        # created_at crece con el número, como los ids en producción
+        self.assertEqual([quote[3] for quote in quotes], sorted(quote[3] for quote in quotes))
+
+        stored = list(Quote.objects.order_by('id').values_list(*Quote.TOTAL_FIELDS))
+        totals.recompute()
+        self.assertEqual(stored, list(Quote.objects.order_by('id').values_list(*Quote.TOTAL_FIELDS)))
 
-# Create your tests here.
+        Quote.objects.all().delete()
+        BaseRate.objects.all().delete()
+        Port.objects.filter(code__startswith='G').delete()
+        Country.objects.filter(code__startswith='Z').delete()
+        self.assertEqual(self.generate()[:50], quotes[:50])
@@ -4,8 +4,10 @@ from .models import ContainerType, CargoType
 from .serializers import ContainerTypeSerializer, CargoTypeSerializer
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
+from shipquote_backend.http_cache import ConditionalCacheMixin
 
-class ContainerTypeViewSet(viewsets.ModelViewSet):
+class ContainerTypeViewSet(ConditionalCacheMixin, viewsets.ModelViewSet):
+    cache_models = (ContainerType,)
     queryset = ContainerType.objects.all()
     serializer_class = ContainerTypeSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
@@ -13,7 +15,8 @@ class ContainerTypeViewSet(viewsets.ModelViewSet):
     search_fields = ['name', 'size', 'type']
     ordering_fields = ['size', 'type', 'max_weight']
 
-class CargoTypeViewSet(viewsets.ModelViewSet):
+class CargoTypeViewSet(ConditionalCacheMixin, viewsets.ModelViewSet):
+    cache_models = (CargoType,)
     queryset = CargoType.objects.all()
     serializer_class = CargoTypeSerializer
     filter_backends = [SearchFilter, OrderingFilter]
@@ -0,0 +1,177 @@
+"""
+Índice espacial de puertos para buscar los más cercanos a unas coordenadas
+(endpoint /ports/nearest/).
+
+Cada puerto activo con latitud/longitud se guarda como vector unitario
+(x, y, z) en un k-d tree en memoria. La distancia recta entre dos vectores
+unitarios crece con la distancia sobre la esfera, así que los vecinos más
+cercanos y los puertos dentro de un radio salen exactos en distancia de gran
+círculo, con poda por planos como en cualquier k-d tree euclídeo.
+
+Hay un árbol con todos los puertos y, armados al primer uso, uno por país y
+por "tiene rutas salientes activas". El índice se rearma cuando cambia la
+versión de Port o de ShippingRoute en shipquote_backend/http_cache.py (las
+señales la renuevan en todos los workers).
+"""
+import heapq
+import math
+import threading
+
+from shipquote_backend import http_cache
+from shipquote_backend.database_router import pinned_to_primary
+
+from .models import Port
+
+EARTH_RADIUS_KM = 6371.0088
+DEFAULT_K = 5
+MAX_K = 100
+# Tope de resultados por radio
+MAX_RADIUS_RESULTS = 500
+LEAF_SIZE = 8
+
+
+def unit_vector(latitude, longitude):
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    cos_lat = math.cos(lat)
+    return cos_lat * math.cos(lon), cos_lat * math.sin(lon), math.sin(lat)
+
+
+def chord_to_km(chord):
+    return 2 * math.asin(min(1.0, chord / 2)) * EARTH_RADIUS_KM
+
+
+def km_to_chord(km):
+    return 2 * math.sin(min(math.pi, km / EARTH_RADIUS_KM) / 2)
+
+
+class KDTree:
+    """k-d tree 3D con hojas de hasta LEAF_SIZE puntos; los nodos en listas planas."""
+
+    def __init__(self, points):
+        # points: [(x, y, z, port_id)]
+        self.points = list(points)
+        # Nodo interno: (eje, corte, izquierdo, derecho); hoja: (-1, inicio, fin, None)
+        self.nodes = []
+        if self.points:
+            self._build(0, len(self.points))
+
+    def __len__(self):
+        return len(self.points)
+
+    def _build(self, start, end):
+        index = len(self.nodes)
+        self.nodes.append(None)
+        if end - start <= LEAF_SIZE:
+            self.nodes[index] = (-1, start, end, None)
+            return index
+        chunk = self.points[start:end]
+        # Eje de mayor dispersión
+        axis = max(range(3), key=lambda a: max(p[a] for p in chunk) - min(p[a] for p in chunk))
+        chunk.sort(key=lambda p: p[axis])
+        self.points[start:end] = chunk
+        middle = start + len(chunk) // 2
+        split = self.points[middle][axis]
+        left = self._build(start, middle)
+        right = self._build(middle, end)
+        self.nodes[index] = (axis, split, left, right)
+        return index
+
+    def nearest(self, query, k, max_distance=math.inf):
+        """Los k puntos más cercanos a query dentro de max_distance: [(distancia, port_id)]."""
+        if not self.points or k < 1:
+            return []
+        heap = []  # (-distancia², port_id), a lo sumo k
+        bound = max_distance * max_distance
+        qx, qy, qz = query
+        points, nodes = self.points, self.nodes
+
+        def visit(node):
+            nonlocal bound
+            axis, split, left, right = nodes[node]
+            if axis < 0:
+                for x, y, z, port_id in points[split:left]:
+                    d2 = (x - qx) ** 2 + (y - qy) ** 2 + (z - qz) ** 2
+                    if d2 <= bound:
+                        if len(heap) < k:
+                            heapq.heappush(heap, (-d2, port_id))
+                        elif d2 < -heap[0][0]:
+                            heapq.heapreplace(heap, (-d2, port_id))
+                        if len(heap) == k:
+                            bound = min(bound, -heap[0][0])
+                return
+            delta = query[axis] - split
+            near, far = (left, right) if delta < 0 else (right, left)
+            visit(near)
+            if delta * delta <= bound:
+                visit(far)
+
+        visit(0)
+        return sorted((math.sqrt(-d2), port_id) for d2, port_id in heap)
+
+
+class PortIndex:
+    """Árboles de una versión de los puertos y las rutas."""
+
+    def __init__(self, versions=None):
+        from quotes.models import ShippingRoute
+
+        self.versions = versions
+        self.points = {}
+        self.country = {}
+        # Del primario, como el snapshot de precios: una réplica atrasada
+        # dejaría el índice armado con datos viejos bajo la versión nueva
+        with pinned_to_primary():
+            rows = Port.objects.filter(
+                is_active=True, latitude__isnull=False, longitude__isnull=False,
+            ).values_list('id', 'latitude', 'longitude', 'country_id')
+            for port_id, latitude, longitude, country_id in rows:
+                self.points[port_id] = (*unit_vector(float(latitude), float(longitude)), port_id)
+                self.country[port_id] = country_id
+            self.with_routes = set(ShippingRoute.objects.filter(
+                is_active=True, destination_port__is_active=True,
+            ).values_list('origin_port_id', flat=True).distinct())
+        self._trees = {(None, False): KDTree(self.points.values())}
+        self._lock = threading.Lock()
+
+    def tree(self, country_id=None, has_routes=False):
+        key = (country_id, has_routes)
+        tree = self._trees.get(key)
+        if tree is None:
+            points = [point for port_id, point in self.points.items()
+                      if (country_id is None or self.country[port_id] == country_id)
+                      and (not has_routes or port_id in self.with_routes)]
+            tree = KDTree(points)
+            with self._lock:
+                tree = self._trees.setdefault(key, tree)
+        return tree
+
+    def nearest(self, latitude, longitude, k=DEFAULT_K, radius_km=None, country_id=None, has_routes=False):
+        """[(distancia_km, port_id)] más cercanos primero; con radius_km, todos los del radio (hasta k)."""
+        max_distance = math.inf if radius_km is None else km_to_chord(radius_km)
+        found = self.tree(country_id, has_routes).nearest(unit_vector(latitude, longitude), k, max_distance)
+        return [(chord_to_km(chord), port_id) for chord, port_id in found]
+
+
+class SpatialEngine:
+    """Índice vigente del worker; se rearma al cambiar la versión de las tablas."""
+
+    def __init__(self):
+        self.index = None
+        self._lock = threading.Lock()
+
+    def _versions(self):
+        from quotes.models import ShippingRoute
+        return tuple(version['token'] for version in http_cache.table_versions((Port, ShippingRoute)))
+
+    def get(self):
+        versions = self._versions()
+        index = self.index
+        if index is not None and index.versions == versions:
+            return index
+        with self._lock:
+            if self.index is None or self.index.versions != versions:
+                self.index = PortIndex(versions)
+            return self.index
+
+
+engine = SpatialEngine()
@@ -1,3 +1,170 @@
-from django.test import TestCase
+import math
+import random
 
-# Create your tests here.
+import brotli
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from shipquote_backend import http_cache
+from shipquote_backend.database_router import reset_routing_stats, routing_stats
+
+from quotes.models import ShippingRoute
+from .models import Country, Port
+from . import spatial
+
+
+class QueryBudgetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        for i in range(5):
+            country = Country.objects.create(name=f'País {i}', code=f'P{i:02d}', continent='Europa')
+            Port.objects.create(name=f'Puerto {i}', code=f'PT{i:03d}', country=country, city=f'Ciudad {i}')
+
+    def test_list_and_detail_budgets(self):
+        for url in ('/api/v1/countries/', '/api/v1/ports/'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(queries), 2, url)
+
+            pk = response.json()['results'][0]['id']
+            with self.assertNumQueries(1):
+                self.client.get(f'{url}{pk}/')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.country = Country.objects.create(name='Chile', code='CHL', continent='América del Sur')
+        for i in range(5):
+            Port.objects.create(name=f'Puerto {i}', code=f'PT{i:03d}', country=self.country, city=f'Ciudad {i}')
+
+    def test_unchanged_data_is_served_without_queries(self):
+        response = self.client.get('/api/v1/ports/')
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        with self.assertNumQueries(0):
+            not_modified = self.client.get('/api/v1/ports/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+        with self.assertNumQueries(0):
+            cached = self.client.get('/api/v1/ports/')
+        self.assertEqual((cached.status_code, cached.content), (200, response.content))
+        self.assertNotEqual(self.client.get('/api/v1/ports/?is_active=true')['ETag'], etag)
+
+    def test_writes_to_nested_tables_change_the_etag(self):
+        etag = self.client.get('/api/v1/ports/')['ETag']
+        self.country.name = 'República de Chile'
+        self.country.save()
+        response = self.client.get('/api/v1/ports/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['results'][0]['country']['name'], 'República de Chile')
+
+    def test_gzip_is_negotiated(self):
+        response = self.client.get('/api/v1/ports/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        # El ETag débil del contenido comprimido sigue validando
+        self.assertEqual(self.client.get('/api/v1/ports/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_brotli_is_preferred_when_accepted(self):
+        plain = self.client.get('/api/v1/ports/')
+        response = self.client.get('/api/v1/ports/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), plain.content)
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+        self.assertEqual(self.client.get('/api/v1/ports/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        # br;q=0 lo rechaza explícitamente
+        self.assertEqual(self.client.get('/api/v1/ports/', HTTP_ACCEPT_ENCODING='br;q=0, gzip')['Content-Encoding'],
+                         'gzip')
+
+
+def haversine_km(a, b):
+    lat1, lon1, lat2, lon2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * spatial.EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+class KDTreeTests(TestCase):
+    def test_matches_brute_force_great_circle(self):
+        rng = random.Random(7)
+        coordinates = {i: (rng.uniform(-80, 80), rng.uniform(-180, 180)) for i in range(2000)}
+        tree = spatial.KDTree((*spatial.unit_vector(*coordinates[i]), i) for i in coordinates)
+        for _ in range(50):
+            query = (rng.uniform(-90, 90), rng.uniform(-180, 180))
+            expected = sorted((haversine_km(query, point), i) for i, point in coordinates.items())
+            found = tree.nearest(spatial.unit_vector(*query), 7)
+            self.assertEqual([i for _, i in found], [i for _, i in expected[:7]])
+            for (chord, _), (km, _) in zip(found, expected):
+                self.assertAlmostEqual(spatial.chord_to_km(chord), km, places=3)
+
+            within = tree.nearest(spatial.unit_vector(*query), 2000, spatial.km_to_chord(1500))
+            self.assertEqual([i for _, i in within], [i for km, i in expected if km <= 1500])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class NearestPortTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        chile = Country.objects.create(name='Chile', code='CHL', continent='América del Sur')
+        brazil = Country.objects.create(name='Brasil', code='BRA', continent='América del Sur')
+        self.chile = chile
+        Port.objects.create(name='Puerto de Valparaíso', code='CLVAP', country=chile,
+                            city='Valparaíso', latitude=-33.0472, longitude=-71.6127)
+        self.san_antonio = Port.objects.create(name='Puerto de San Antonio', code='CLSAI', country=chile,
+                                               city='San Antonio', latitude=-33.5933, longitude=-71.6217)
+        self.santos = Port.objects.create(name='Puerto de Santos', code='BRSSZ', country=brazil,
+                                          city='Santos', latitude=-23.9608, longitude=-46.3333)
+        Port.objects.create(name='Puerto sin coordenadas', code='CLXXX', country=chile, city='Sin datos')
+        Port.objects.create(name='Puerto cerrado', code='CLYYY', country=chile, city='Santiago',
+                            latitude=-33.45, longitude=-70.66, is_active=False)
+
+    def nearest(self, **params):
+        response = self.client.get('/api/v1/ports/nearest/', {'lat': -33.4489, 'lon': -70.6693, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(port['code'], port['distance_km']) for port in response.json()['results']]
+
+    def test_nearest_and_radius(self):
+        found = self.nearest(k=2)
+        self.assertEqual([code for code, _ in found], ['CLSAI', 'CLVAP'])
+        self.assertAlmostEqual(found[1][1], haversine_km((-33.4489, -70.6693), (-33.0472, -71.6127)), places=2)
+        self.assertEqual([code for code, _ in self.nearest(radius_km=95)], ['CLSAI'])
+        self.assertEqual([code for code, _ in self.nearest(radius_km=3000)], ['CLSAI', 'CLVAP', 'BRSSZ'])
+
+    def test_filters(self):
+        self.assertEqual([code for code, _ in self.nearest(country=self.santos.country_id)], ['BRSSZ'])
+        self.assertEqual(self.nearest(has_routes='true'), [])
+        ShippingRoute.objects.create(origin_port=self.san_antonio, destination_port=self.santos,
+                                     distance_nautical_miles=3000, estimated_transit_days=12)
+        self.assertEqual([code for code, _ in self.nearest(has_routes='true')], ['CLSAI'])
+        self.assertEqual([code for code, _ in self.nearest(has_routes='true', country=self.chile.pk)], ['CLSAI'])
+
+    def test_index_follows_port_changes(self):
+        self.assertEqual(self.nearest(k=1)[0][0], 'CLSAI')
+        self.san_antonio.is_active = False
+        self.san_antonio.save()
+        self.assertEqual(self.nearest(k=1)[0][0], 'CLVAP')
+        Port.objects.filter(code='CLYYY').update(is_active=True)
+        self.assertEqual(self.nearest(k=1)[0][0], 'CLVAP')  # update() no renueva la versión
+        http_cache.bump(Port)
+        self.assertEqual(self.nearest(k=1)[0][0], 'CLYYY')
+
+    @override_settings(DATABASE_REPLICAS=['default'])
+    def test_index_is_built_from_the_primary(self):
+        reset_routing_stats()
+        index = spatial.PortIndex()
+        self.assertEqual(len(index.points), 3)
+        self.assertEqual(set(routing_stats()), {('default', 'read_your_writes')})
+
+    def test_invalid_parameters(self):
+        for params in ({}, {'lat': 'x', 'lon': 0}, {'lat': 95, 'lon': 0}, {'lat': 0, 'lon': 0, 'k': 0},
+                       {'lat': 0, 'lon': 0, 'radius_km': -1}):
+            self.assertEqual(self.client.get('/api/v1/ports/nearest/', params).status_code, 400, params)
@@ -1,22 +1,64 @@
 from django.shortcuts import render
-from rest_framework import viewsets
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.response import Response
 from .models import Country, Port
 from .serializers import CountrySerializer, PortSerializer
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
+from shipquote_backend.http_cache import ConditionalCacheMixin
+from . import spatial
 
-class CountryViewSet(viewsets.ModelViewSet):
+class CountryViewSet(ConditionalCacheMixin, viewsets.ModelViewSet):
+    cache_models = (Country,)
     queryset = Country.objects.all()
     serializer_class = CountrySerializer
     filter_backends = [SearchFilter, OrderingFilter]
     search_fields = ['name', 'code', 'continent']
     ordering_fields = ['name', 'code']
 
-class PortViewSet(viewsets.ModelViewSet):
-    queryset = Port.objects.all()
+class PortViewSet(ConditionalCacheMixin, viewsets.ModelViewSet):
+    cache_models = (Port, Country)
+    queryset = Port.objects.select_related('country')
     serializer_class = PortSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['country', 'is_active']
     search_fields = ['name', 'code', 'city', 'country__name']
     ordering_fields = ['name', 'code', 'city', 'country__name']
 
+    @action(detail=False, methods=['get'])
+    def nearest(self, request):
+        """
+        Puertos activos más cercanos a unas coordenadas (lat, lon) por
+        distancia de gran círculo: los k más cercanos o, con radius_km, los
+        del radio. Filtros opcionales: country (id) y has_routes (con rutas
+        salientes activas).
+        """
+        params = request.query_params
+        try:
+            latitude = float(params['lat'])
+            longitude = float(params['lon'])
+            radius_km = float(params['radius_km']) if params.get('radius_km') else None
+            limit = spatial.MAX_K if radius_km is None else spatial.MAX_RADIUS_RESULTS
+            k = min(int(params.get('k', spatial.DEFAULT_K if radius_km is None else limit)), limit)
+            country_id = int(params['country']) if params.get('country') else None
+        except (KeyError, TypeError, ValueError):
+            return Response({"error": "Missing or invalid parameters."}, status=status.HTTP_400_BAD_REQUEST)
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return Response({"error": "lat must be within [-90, 90] and lon within [-180, 180]."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if k < 1 or (radius_km is not None and radius_km <= 0):
+            return Response({"error": "k and radius_km must be positive."}, status=status.HTTP_400_BAD_REQUEST)
+
+        found = spatial.engine.get().nearest(
+            latitude, longitude, k=k, radius_km=radius_km, country_id=country_id,
+            has_routes=params.get('has_routes') in ('1', 'true', 'True'),
+        )
+        ports = self.get_queryset().in_bulk([port_id for _, port_id in found])
+        results = []
+        for distance, port_id in found:
+            port = ports.get(port_id)
+            # Puede haberse borrado después de armar el índice
+            if port is not None:
+                results.append({**self.get_serializer(port).data, "distance_km": round(distance, 3)})
+        return Response({"count": len(results), "results": results}, status=status.HTTP_200_OK)
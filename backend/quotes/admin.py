@@ -28,4 +28,4 @@ class QuoteAdmin(admin.ModelAdmin):
     date_hierarchy = 'created_at'
     inlines = [QuoteItemInline]
     raw_id_fields = ('origin_port', 'destination_port', 'created_by')
-    readonly_fields = ('quote_number', 'total_amount', 'created_at', 'updated_at')
\ No newline at end of file
+    readonly_fields = ('quote_number', 'total_amount', 'item_count', 'total_weight_kg', 'total_volume_cbm', 'documentation_fee', 'created_at', 'updated_at')
\ No newline at end of file
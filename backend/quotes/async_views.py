@@ -0,0 +1,294 @@
+"""
+calculate_quote asíncrono, para servir bajo ASGI (shipquote_backend/asgi.py).
+
+Misma entrada y misma respuesta que QuoteViewSet.calculate_quote. Los POST
+sin header Origin no pasan por el handler de Django: asgi.py los despacha a
+asgi_calculate_quote, sin middlewares ni señales de request (bajo ASGI cada
+middleware de Django salta a un hilo). Con el snapshot de precios cargado
+la cotización se calcula en el event loop, sin hilos ni consultas.
+
+Como get_snapshot(), mientras el snapshot está desactualizado se responde
+con el anterior y se recompila una sola vez en un hilo aparte; el event
+loop nunca compila. Solo si el proceso todavía no tiene ningún snapshot se
+buscan en la base, en paralelo, la ruta, la tarifa, los tipos de contenedor
+y carga y los puertos. Esas búsquedas corren en un pool de
+ASYNC_QUOTE_DB_CONCURRENCY hilos (el máximo de consultas simultáneas del
+proceso) y el request entero tiene ASYNC_QUOTE_TIMEOUT segundos.
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.http import HttpResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from shipquote_backend.database_router import pinned_to_primary
+from shipquote_backend.structured_logging import REQUEST_ID_HEADER, log_context, request_id_from
+from ports.models import Port
+from ports.serializers import PortSerializer
+from containers.models import ContainerType, CargoType
+from containers.serializers import ContainerTypeSerializer, CargoTypeSerializer
+from .models import ShippingRoute, BaseRate
+from .pricing import QuoteError, parse_quote_request, quote_from_snapshot
+from .snapshot import current_snapshot, get_snapshot, latest_snapshot
+
+logger = logging.getLogger(__name__)
+
+_executor_lock = threading.Lock()
+_executors = {}
+_rebuild_lock = threading.Lock()
+_rebuild = None
+
+
+def _executor(name, workers):
+    with _executor_lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'quote-{name}')
+        return _executors[name]
+
+
+def _lookup_executor():
+    return _executor('lookup', getattr(settings, 'ASYNC_QUOTE_DB_CONCURRENCY', 8))
+
+
+def _in_thread(func):
+    """Corre func en el pool de búsquedas con el contexto actual; cierra la conexión como al final de un request."""
+    def run(*args):
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        context = contextvars.copy_context()
+        return asyncio.get_running_loop().run_in_executor(_lookup_executor(), context.run, run, *args)
+    return wrapper
+
+
+def _payload(serializer):
+    # Mismo recorrido que los payloads del snapshot: la respuesta queda idéntica
+    return json.loads(json.dumps(serializer.data, cls=JSONEncoder, ensure_ascii=False))
+
+
+# Las búsquedas leen del primario, igual que compile_snapshot: el cambio acaba de ocurrir
+
+@_in_thread
+@pinned_to_primary()
+def _route(origin_port_id, destination_port_id):
+    return ShippingRoute.objects.filter(
+        origin_port_id=origin_port_id, destination_port_id=destination_port_id, is_active=True,
+    ).values('estimated_transit_days').first()
+
+
+@_in_thread
+@pinned_to_primary()
+def _rate(origin_port_id, destination_port_id, container_type_id, today):
+    return BaseRate.objects.filter(
+        route__origin_port_id=origin_port_id, route__destination_port_id=destination_port_id,
+        route__is_active=True, container_type_id=container_type_id, is_active=True, effective_from__lte=today,
+    ).filter(
+        Q(effective_to__gte=today) | Q(effective_to__isnull=True)
+    ).order_by('-effective_from').values_list('base_rate_usd', 'fuel_surcharge_percentage').first()
+
+
+@_in_thread
+@pinned_to_primary()
+def _port(port_id):
+    port = Port.objects.select_related('country').filter(pk=port_id).first()
+    return port and _payload(PortSerializer(port))
+
+
+@_in_thread
+@pinned_to_primary()
+def _container_type(container_type_id):
+    container_type = ContainerType.objects.filter(pk=container_type_id).first()
+    return container_type and _payload(ContainerTypeSerializer(container_type))
+
+
+@_in_thread
+@pinned_to_primary()
+def _cargo_type(cargo_type_id):
+    cargo_type = CargoType.objects.filter(pk=cargo_type_id).first()
+    return cargo_type and _payload(CargoTypeSerializer(cargo_type))
+
+
+class LiveLookup:
+    """Los datos de una cotización leídos de la base, con la interfaz de PricingSnapshot."""
+
+    def __init__(self, date, route, rate, ports, container_type, cargo_type):
+        self.date = date
+        self._route = route
+        self._rate = rate
+        self._ports = ports
+        self._container_type = container_type
+        self._cargo_type = cargo_type
+
+    @classmethod
+    async def load(cls, origin_port_id, destination_port_id, container_type_id, cargo_type_id):
+        today = date.today()
+        route, rate, origin, destination, container_type, cargo_type = await asyncio.gather(
+            _route(origin_port_id, destination_port_id),
+            _rate(origin_port_id, destination_port_id, container_type_id, today),
+            _port(origin_port_id),
+            _port(destination_port_id),
+            _container_type(container_type_id),
+            _cargo_type(cargo_type_id),
+        )
+        ports = {origin_port_id: origin, destination_port_id: destination}
+        return cls(today, route, rate, ports, container_type, cargo_type)
+
+    def route(self, origin_port_id, destination_port_id):
+        return self._route
+
+    def rate(self, origin_port_id, destination_port_id, container_type_id):
+        return self._rate
+
+    def port(self, port_id):
+        return self._ports.get(port_id)
+
+    def container_type(self, container_type_id):
+        return self._container_type
+
+    def cargo_type(self, cargo_type_id):
+        return self._cargo_type
+
+
+def _rebuild_snapshot():
+    try:
+        get_snapshot()
+    except Exception:
+        logger.exception('No se pudo recompilar el snapshot de precios')
+    finally:
+        close_old_connections()
+
+
+def schedule_rebuild():
+    """Recompila el snapshot en segundo plano (una recompilación a la vez) y devuelve el Future."""
+    global _rebuild
+    with _rebuild_lock:
+        if _rebuild is None or _rebuild.done():
+            _rebuild = _executor('rebuild', 1).submit(contextvars.copy_context().run, _rebuild_snapshot)
+        return _rebuild
+
+
+async def _calculate(data):
+    snapshot = current_snapshot()
+    if snapshot is None:
+        # Como get_snapshot(): el anterior mientras se recompila en otro hilo
+        schedule_rebuild()
+        snapshot = latest_snapshot()
+    if snapshot is not None:
+        return quote_from_snapshot(snapshot, data)
+
+    lookup = await LiveLookup.load(*parse_quote_request(data)[:4])
+    return quote_from_snapshot(lookup, data)
+
+
+def _json_response(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+async def respond(body):
+    """(status, datos) de la cotización pedida en el cuerpo JSON body."""
+    try:
+        data = json.loads(body or b'{}')
+        if not isinstance(data, dict):
+            raise ValueError
+    except ValueError:
+        return 400, {"error": "Invalid JSON body."}
+
+    try:
+        calculated_quote = await asyncio.wait_for(_calculate(data), getattr(settings, 'ASYNC_QUOTE_TIMEOUT', 5))
+    except QuoteError as e:
+        return e.status_code, {"error": str(e)}
+    except asyncio.TimeoutError:
+        return 504, {"error": "Pricing data lookup timed out."}
+    except Exception as e:
+        return 500, {"error": str(e)}
+    return 200, calculated_quote
+
+
+@csrf_exempt
+@require_POST
+async def calculate_quote(request):
+    """Calcula una cotización (ver QuoteViewSet.calculate_quote) sin ocupar un hilo por request."""
+    status, data = await respond(request.body)
+    return _json_response(data, status=status)
+
+
+@functools.lru_cache(maxsize=None)
+def _headers():
+    """Headers de SecurityMiddleware y XFrameOptionsMiddleware para una respuesta JSON, según settings."""
+    headers = [(b'content-type', b'application/json')]
+    if settings.SECURE_CONTENT_TYPE_NOSNIFF:
+        headers.append((b'x-content-type-options', b'nosniff'))
+    if settings.SECURE_REFERRER_POLICY:
+        headers.append((b'referrer-policy', ','.join(
+            [settings.SECURE_REFERRER_POLICY] if isinstance(settings.SECURE_REFERRER_POLICY, str)
+            else settings.SECURE_REFERRER_POLICY).encode()))
+    if settings.SECURE_CROSS_ORIGIN_OPENER_POLICY:
+        headers.append((b'cross-origin-opener-policy', settings.SECURE_CROSS_ORIGIN_OPENER_POLICY.encode()))
+    headers.append((b'x-frame-options', getattr(settings, 'X_FRAME_OPTIONS', 'DENY').upper().encode()))
+    return headers
+
+
+def handles(scope):
+    """
+    True si el request va directo a asgi_calculate_quote: un POST a la vista
+    sin header Origin. Los de navegador (con Origin, y sus preflight OPTIONS)
+    siguen por Django, que agrega los headers de CORS.
+    """
+    return (scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] == _path()
+            and not any(name == b'origin' for name, _ in scope['headers']))
+
+
+@functools.lru_cache(maxsize=None)
+def _path():
+    return reverse('calculate_quote_async')
+
+
+async def asgi_calculate_quote(scope, receive, send):
+    """
+    La misma vista como aplicación ASGI, sin el handler de Django: sin
+    middlewares ni señales de request, que bajo ASGI saltan a un hilo cada
+    uno. Con el snapshot vigente el request entero corre en el event loop.
+    """
+    limit = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        chunks.append(message.get('body', b''))
+        size += len(chunks[-1])
+        if not message.get('more_body') or (limit is not None and size > limit):
+            break
+
+    received = next((value.decode('latin-1') for name, value in scope['headers'] if name == b'x-request-id'), '')
+    request_id = request_id_from(received)
+    if limit is not None and size > limit:
+        # Como request.body en Django (RequestDataTooBig)
+        status, data = 400, {"error": "Request body too large."}
+    else:
+        with log_context(request_id=request_id, view='calculate_quote_async'):
+            status, data = await respond(b''.join(chunks))
+    body = JSONRenderer().render(data)
+    headers = _headers() + [
+        (b'content-length', str(len(body)).encode()),
+        (REQUEST_ID_HEADER.lower().encode(), request_id.encode()),
+    ]
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,275 @@
+"""
+Benchmarks de los caminos críticos de la API y del ORM (ver el comando
+run_benchmarks).
+
+Cada escenario prepara los argumentos de una llamada fuera de la medición y
+la ejecuta por la pila completa (cliente de prueba de Django con middleware,
+autenticación y renderizado) o directamente sobre el serializer. Por
+escenario se miden percentiles de latencia, rendimiento y consultas SQL por
+llamada; los resultados se guardan en JSON para comparar corridas con
+compare().
+"""
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+import django
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from containers.models import ContainerType, CargoType
+from ports import spatial
+from shipquote_backend import http_cache, structured_logging
+from .models import BaseRate, Quote, RateMatrixEntry
+from .serializers import QuoteSerializer
+
+FORMAT_VERSION = 1
+# Métricas comparadas entre corridas: más alto es peor
+COMPARED_METRICS = ('p50_ms', 'p95_ms', 'queries_per_call')
+DEFAULT_THRESHOLD = 0.15
+# Variaciones por debajo de esto son ruido del reloj, no regresiones
+MIN_DELTA_MS = 1.0
+# Registros por llamada en los escenarios de logging: lo que emite un request típico
+LOG_RECORDS_PER_REQUEST = 20
+# Filas por llamada de calculate_quotes_batch (una planilla de licitación típica)
+BATCH_ROWS = 500
+
+
+def _percentile(ordered, fraction):
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(timings, queries, rows=1):
+    """
+    Estadísticas de una serie de latencias (segundos) y consultas por llamada;
+    rows son las filas que resuelve cada llamada (para rows_per_s).
+    """
+    ordered = sorted(timings)
+    total = sum(ordered)
+    return {
+        'calls': len(ordered),
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'p50_ms': _percentile(ordered, 0.50) * 1000,
+        'p95_ms': _percentile(ordered, 0.95) * 1000,
+        'p99_ms': _percentile(ordered, 0.99) * 1000,
+        'max_ms': ordered[-1] * 1000,
+        'throughput_per_s': len(ordered) / total if total else None,
+        'rows_per_s': rows * len(ordered) / total if total else None,
+        'queries_per_call': statistics.fmean(queries),
+        'max_queries': max(queries),
+    }
+
+
+class Scenario:
+    """
+    prepare(rng) devuelve los argumentos de una llamada (fuera de la medición)
+    y call(*args) la ejecuta; una respuesta HTTP con error aborta el escenario.
+    rows es la cantidad de filas que resuelve cada llamada.
+    """
+
+    def __init__(self, name, prepare, call, rows=1):
+        self.name = name
+        self.prepare = prepare
+        self.call = call
+        self.rows = rows
+
+    def run(self, rng, iterations, warmup):
+        timings, queries = [], []
+        for index in range(warmup + iterations):
+            args = self.prepare(rng)
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                result = self.call(*args)
+                elapsed = time.perf_counter() - started
+            status = getattr(result, 'status_code', 200)
+            if status >= 400:
+                raise RuntimeError(f'{self.name}: HTTP {status} {result.content[:200]!r}')
+            if index >= warmup:
+                timings.append(elapsed)
+                queries.append(len(captured))
+        return summarize(timings, queries, self.rows)
+
+
+class Suite:
+    """Escenarios sobre los datos existentes (p. ej. los de generate_data)."""
+
+    def __init__(self, quote_items=(1, 10, 50)):
+        self.client = Client()
+        self.quote_items = quote_items
+        self.lanes = list(RateMatrixEntry.objects.values_list(
+            'origin_port_id', 'destination_port_id', 'container_type_id')[:5000])
+        if not self.lanes:
+            raise RuntimeError('No priced routes found; load data first (manage.py generate_data).')
+        self.cargo_types = list(CargoType.objects.values_list('id', flat=True))
+        self.container_types = list(ContainerType.objects.values_list('id', flat=True))
+        self.customers = list(Quote.objects.order_by().values_list('customer_name', flat=True).distinct()[:500])
+        self.statuses = [status for status, _ in Quote.STATUS_CHOICES]
+        self._devnull = open(os.devnull, 'w')
+        self._log_handlers = []
+
+    def scenarios(self):
+        post = lambda url, payload: self.client.post(url, payload, content_type='application/json')
+        get = self.client.get
+
+        def quote_row(rng):
+            origin, destination, container_type = rng.choice(self.lanes)
+            return {
+                'origin_port_id': origin, 'destination_port_id': destination,
+                'container_type_id': container_type, 'cargo_type_id': rng.choice(self.cargo_types),
+                'quantity': rng.randint(1, 5), 'weight_kg': rng.randint(2000, 24000), 'volume_cbm': rng.randint(10, 60),
+            }
+
+        def quote_request(rng):
+            return '/api/v1/calculate_quote/', json.dumps(quote_row(rng))
+
+        def batch_request(rng):
+            return '/api/v1/calculate_quotes_batch/', json.dumps([quote_row(rng) for _ in range(BATCH_ROWS)])
+
+        def base_rates_uncached(rng):
+            # Nueva versión de la tabla: el ETag y la respuesta cacheada dejan de valer
+            http_cache.bump(BaseRate)
+            return ('/api/v1/base-rates/',)
+
+        scenarios = [
+            Scenario('calculate_quote', quote_request, post),
+            # Comparar rows_per_s con el de calculate_quote (una fila por request)
+            Scenario(f'calculate_quotes_batch[{BATCH_ROWS}]', batch_request, post, rows=BATCH_ROWS),
+            Scenario('quotes.list', lambda rng: ('/api/v1/quotes/',), get),
+            Scenario('quotes.filter_status', lambda rng: (f'/api/v1/quotes/?status={rng.choice(self.statuses)}',), get),
+            Scenario('quotes.search', lambda rng: (
+                f'/api/v1/quotes/?search={rng.choice(self.customers or ["Cliente"])}',), get),
+            Scenario('quotes.ordered', lambda rng: (
+                f'/api/v1/quotes/?ordering={rng.choice(["-total_amount", "valid_until", "-created_at"])}',), get),
+            Scenario('ports.nearest', lambda rng: (
+                f'/api/v1/ports/nearest/?lat={rng.uniform(-60, 60):.4f}&lon={rng.uniform(-180, 180):.4f}',), get),
+            Scenario('ports.nearest_index', lambda rng: (rng.uniform(-60, 60), rng.uniform(-180, 180)),
+                     lambda lat, lon: spatial.engine.get().nearest(lat, lon)),
+            Scenario('base_rates.list', lambda rng: ('/api/v1/base-rates/',), get),
+            Scenario('base_rates.list_uncached', base_rates_uncached, get),
+            self._logging_scenario('logging.stream', logging.StreamHandler(self._devnull)),
+            self._logging_scenario('logging.queue', structured_logging.QueueHandler(self._devnull)),
+            Scenario('logging.request_context', lambda rng: (RequestFactory().get('/api/v1/quotes/'),),
+                     structured_logging.RequestContextMiddleware(lambda request: HttpResponse())),
+        ]
+        for size in self.quote_items:
+            scenarios.append(Scenario(f'quote_serializer.create[{size}]', self._quote_payload(size), self._create))
+        return scenarios
+
+    def _logging_scenario(self, name, handler):
+        """LOG_RECORDS_PER_REQUEST registros JSON con contexto a través de handler."""
+        handler.setFormatter(structured_logging.JsonFormatter())
+        handler.addFilter(structured_logging.ContextFilter())
+        self._log_handlers.append(handler)
+        logger = logging.getLogger(f'shipquote_backend.benchmarks.{name}')
+        logger.handlers = [handler]
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+
+        def call():
+            for index in range(LOG_RECORDS_PER_REQUEST):
+                logger.info('Registro %d', index, extra={'quote_id': index, 'db_time_ms': 1.5})
+        return Scenario(f'{name}[{LOG_RECORDS_PER_REQUEST}]', lambda rng: (), call)
+
+    def close(self):
+        for handler in self._log_handlers:
+            handler.close()
+        self._devnull.close()
+
+    def _quote_payload(self, size):
+        def prepare(rng):
+            origin, destination, container_type = rng.choice(self.lanes)
+            return {
+                'customer_name': 'Cliente benchmark', 'customer_email': 'benchmark@example.com',
+                'origin_port_id': origin, 'destination_port_id': destination,
+                'valid_until': (timezone.now() + timedelta(days=15)).isoformat(),
+                'items': [{
+                    'container_type_id': container_type, 'cargo_type_id': rng.choice(self.cargo_types),
+                    'quantity': rng.randint(1, 5), 'weight_kg': '12000', 'volume_cbm': '30',
+                    'base_rate': str(Decimal(rng.randint(800, 6000))), 'documentation_fee': '50',
+                } for _ in range(size)],
+            },
+        return prepare
+
+    def _create(self, payload):
+        # Se revierte para que el conjunto de datos no cambie entre corridas
+        with transaction.atomic():
+            serializer = QuoteSerializer(data=payload)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            transaction.set_rollback(True)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(iterations=200, warmup=20, seed=42, only=None, quote_items=(1, 10, 50), on_result=None):
+    """Corre los escenarios y devuelve el documento de resultados."""
+    suite = Suite(quote_items=quote_items)
+    results = {}
+    try:
+        for scenario in suite.scenarios():
+            if only and not any(scenario.name.startswith(prefix) for prefix in only):
+                continue
+            # Cada escenario con su propio generador: agregar uno no cambia los demás
+            results[scenario.name] = scenario.run(random.Random(f'{seed}:{scenario.name}'), iterations, warmup)
+            if on_result:
+                on_result(scenario.name, results[scenario.name])
+    finally:
+        suite.close()
+    return {
+        'format': FORMAT_VERSION,
+        'meta': {
+            'started_at': datetime.now(dt_timezone.utc).isoformat(),
+            'commit': _git_commit(),
+            'vendor': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'seed': seed,
+            'iterations': iterations,
+            'dataset': {
+                'quotes': Quote.objects.count(),
+                'base_rates': BaseRate.objects.count(),
+            },
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Diferencias por escenario y métrica contra una corrida anterior. Una
+    regresión es un aumento mayor que threshold (fracción) en una métrica de
+    COMPARED_METRICS.
+    """
+    rows = []
+    for name, result in current['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if before is None:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = before.get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else (0.0 if new == old else float('inf'))
+            noise = metric.endswith('_ms') and abs(new - old) < MIN_DELTA_MS
+            rows.append({
+                'scenario': name, 'metric': metric, 'baseline': old, 'current': new, 'change': change,
+                'regression': change > threshold and not noise,
+            })
+    return rows
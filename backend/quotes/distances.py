@@ -0,0 +1,335 @@
+"""
+Matriz de distancias entre puertos para estimar distance_nautical_miles y
+estimated_transit_days de ShippingRoute.
+
+La matriz de gran círculo (millas náuticas) de todos los puertos con
+coordenadas se calcula por bloques de filas con NumPy y se guarda en
+DISTANCE_MATRIX_PATH. Cada worker mapea el archivo en memoria (mmap), así que
+todos comparten la misma copia. El comando distance_matrix la arma completa;
+cuando un puerto se mueve o se agrega, update_ports() recalcula solo su fila
+y su columna en el mismo archivo (hay lugar libre para puertos nuevos; sin
+lugar se rearma). Un puerto que pierde sus coordenadas sale de la matriz.
+
+La distancia por mar se estima con SEA_ROUTE_FACTOR sobre la de gran círculo
+(el mismo desvío que usa generate_data) y el tránsito con la velocidad de
+servicio más los días de puerto.
+"""
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+
+import numpy
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo el lock del proceso
+    fcntl = None
+
+EARTH_RADIUS_NM = 3440.065
+# Desvío típico de la navegación respecto del gran círculo
+SEA_ROUTE_FACTOR = 1.25
+SERVICE_SPEED_KNOTS = 18
+PORT_DAYS = 2
+# Ningún portacontenedores sostiene más que esto: un tránsito más corto es un error de carga
+MAX_SPEED_KNOTS = 25
+# Diferencia relativa tolerada entre la distancia cargada y la estimada
+TOLERANCE = 0.5
+
+MAGIC = b'SQDM'
+FORMAT_VERSION = 1
+# magic, versión, reservado, puertos, capacidad, generación
+_HEADER = struct.Struct('<4sHHIIQ')
+_COUNT = struct.Struct('<IIQ')
+_COUNT_OFFSET = 8
+# Filas por bloque del cálculo vectorizado (acota la memoria temporal)
+CHUNK_ROWS = 256
+# Id de una fila libre: el puerto ya no tiene coordenadas
+_REMOVED = 0
+MIN_FREE_SLOTS = 64
+
+_write_lock = threading.Lock()
+_state = {'signature': None, 'matrix': None}
+
+
+def _matrix_path():
+    return settings.DISTANCE_MATRIX_PATH
+
+
+def _layout(capacity):
+    """Offsets de ids, latitudes, longitudes y matriz, y tamaño total."""
+    ids = _HEADER.size
+    latitudes = ids + 8 * capacity
+    longitudes = latitudes + 8 * capacity
+    matrix = longitudes + 8 * capacity
+    return ids, latitudes, longitudes, matrix, matrix + 4 * capacity * capacity
+
+
+def great_circle_nm(a, b):
+    """Distancia de gran círculo entre (lat, lon) en grados."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_NM * math.asin(min(1.0, math.sqrt(h)))
+
+
+def estimate(great_circle):
+    """(distancia por mar, días de tránsito) a partir de la distancia de gran círculo."""
+    distance = max(1, round(great_circle * SEA_ROUTE_FACTOR))
+    return distance, math.ceil(distance / (24 * SERVICE_SPEED_KNOTS)) + PORT_DAYS
+
+
+def _port_coordinates(port_ids=None):
+    from ports.models import Port
+
+    ports = Port.objects.filter(latitude__isnull=False, longitude__isnull=False).order_by('id')
+    if port_ids is not None:
+        ports = ports.filter(id__in=port_ids)
+    return [(pk, float(lat), float(lon)) for pk, lat, lon in ports.values_list('id', 'latitude', 'longitude')]
+
+
+def _rows_numpy(latitudes, longitudes, rows, count):
+    """Filas `rows` de la matriz contra los primeros count puertos (radianes)."""
+    lat, lon = latitudes[:count], longitudes[:count]
+    row_lat, row_lon = latitudes[rows, None], longitudes[rows, None]
+    h = (numpy.sin((lat - row_lat) / 2) ** 2
+         + numpy.cos(row_lat) * numpy.cos(lat) * numpy.sin((lon - row_lon) / 2) ** 2)
+    return (2 * EARTH_RADIUS_NM * numpy.arcsin(numpy.sqrt(numpy.clip(h, 0, 1)))).astype(numpy.float32)
+
+
+def _fill(buffer, capacity, count, rows):
+    """Calcula y escribe las filas (y, por simetría, las columnas) `rows`."""
+    _, lat_offset, lon_offset, matrix_offset, _ = _layout(capacity)
+    latitudes = numpy.radians(numpy.frombuffer(buffer, numpy.float64, capacity, lat_offset))
+    longitudes = numpy.radians(numpy.frombuffer(buffer, numpy.float64, capacity, lon_offset))
+    matrix = numpy.ndarray((capacity, capacity), numpy.float32, buffer, matrix_offset)
+    rows = numpy.asarray(rows)
+    full = len(rows) == count
+    for start in range(0, len(rows), CHUNK_ROWS):
+        chunk = rows[start:start + CHUNK_ROWS]
+        values = _rows_numpy(latitudes, longitudes, chunk, count)
+        matrix[chunk, :count] = values
+        if not full:
+            matrix[:count, chunk] = values.T
+    # El mmap no se puede cerrar mientras haya un arreglo sobre él
+    del matrix
+
+
+class _WriteLock:
+    """Lock entre hilos y, donde hay fcntl, entre procesos (un archivo .lock al lado)."""
+
+    def __enter__(self):
+        _write_lock.acquire()
+        self._file = None
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(_matrix_path()), exist_ok=True)
+            self._file = open(_matrix_path() + '.lock', 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+        _write_lock.release()
+
+
+def build():
+    """Calcula la matriz completa y reemplaza el archivo. Devuelve estadísticas."""
+    started = time.perf_counter()
+    ports = _port_coordinates()
+    count = len(ports)
+    capacity = count + max(MIN_FREE_SLOTS, count // 10)
+    ids_offset, lat_offset, lon_offset, _, size = _layout(capacity)
+    path = _matrix_path()
+    with _WriteLock():
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w+b') as fh:
+            fh.truncate(size)
+            buffer = mmap.mmap(fh.fileno(), size)
+            try:
+                _HEADER.pack_into(buffer, 0, MAGIC, FORMAT_VERSION, 0, count, capacity, time.time_ns())
+                buffer[ids_offset:ids_offset + 8 * count] = array('q', (row[0] for row in ports)).tobytes()
+                buffer[lat_offset:lat_offset + 8 * count] = array('d', (row[1] for row in ports)).tobytes()
+                buffer[lon_offset:lon_offset + 8 * count] = array('d', (row[2] for row in ports)).tobytes()
+                _fill(buffer, capacity, count, list(range(count)))
+                buffer.flush()
+            finally:
+                buffer.close()
+        os.replace(tmp_path, path)
+    return {'ports': count, 'capacity': capacity, 'seconds': time.perf_counter() - started}
+
+
+def update_ports(port_ids):
+    """
+    Recalcula en el archivo la fila y la columna de los puertos (movidos o
+    nuevos) y saca los que ya no tienen coordenadas. Sin archivo no hace
+    nada; sin lugar para los nuevos, lo rearma. Devuelve la cantidad de
+    puertos actualizados o quitados.
+    """
+    port_ids = list(port_ids)
+    ports = _port_coordinates(port_ids)
+    located = {pk for pk, _, _ in ports}
+    path = _matrix_path()
+    if not os.path.exists(path):
+        return 0
+    with _WriteLock():
+        with open(path, 'r+b') as fh:
+            buffer = mmap.mmap(fh.fileno(), 0)
+            try:
+                _, _, _, count, capacity, _ = _HEADER.unpack_from(buffer, 0)
+                ids_offset, lat_offset, lon_offset, _, _ = _layout(capacity)
+                index = _row_index(buffer[ids_offset:ids_offset + 8 * count])
+                removed = [index[pk] for pk in port_ids if pk not in located and pk in index]
+                if not ports and not removed:
+                    rebuild = False
+                elif count + sum(pk not in index for pk in located) > capacity:
+                    rebuild = True
+                else:
+                    rebuild = False
+                    # La fila queda libre hasta el próximo build(); no se la vuelve a leer
+                    for row in removed:
+                        struct.pack_into('<q', buffer, ids_offset + 8 * row, _REMOVED)
+                    rows = []
+                    for pk, lat, lon in ports:
+                        row = index.get(pk)
+                        if row is None:
+                            row = count
+                            count += 1
+                            struct.pack_into('<q', buffer, ids_offset + 8 * row, pk)
+                        struct.pack_into('<d', buffer, lat_offset + 8 * row, lat)
+                        struct.pack_into('<d', buffer, lon_offset + 8 * row, lon)
+                        rows.append(row)
+                    if rows:
+                        _fill(buffer, capacity, count, rows)
+                    # Los lectores ven los puertos nuevos recién con la generación nueva
+                    _COUNT.pack_into(buffer, _COUNT_OFFSET, count, capacity, time.time_ns())
+                    buffer.flush()
+            finally:
+                buffer.close()
+    if rebuild:
+        build()
+    return len(ports) + len(removed)
+
+
+def _row_index(ids):
+    """id de puerto -> fila, sin las filas libres."""
+    return {pk: i for i, pk in enumerate(array('q', ids)) if pk != _REMOVED}
+
+
+class DistanceMatrix:
+    """Lectura de la matriz mapeada; el índice id -> fila se rearma con cada generación."""
+
+    def __init__(self, buffer):
+        magic, version, _, _, capacity, _ = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError('Invalid distance matrix file')
+        self.buffer = buffer
+        self.capacity = capacity
+        self._ids_offset, _, _, self._matrix_offset, _ = _layout(capacity)
+        self._generation = None
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def _current_index(self):
+        count, _, generation = _COUNT.unpack_from(self.buffer, _COUNT_OFFSET)
+        if generation != self._generation:
+            with self._lock:
+                self._index = _row_index(self.buffer[self._ids_offset:self._ids_offset + 8 * count])
+                self._generation = generation
+        return self._index
+
+    def __len__(self):
+        return len(self._current_index())
+
+    def __contains__(self, port_id):
+        return port_id in self._current_index()
+
+    def great_circle(self, origin_port_id, destination_port_id):
+        """Millas náuticas de gran círculo, o None si algún puerto no está en la matriz."""
+        index = self._current_index()
+        row, column = index.get(origin_port_id), index.get(destination_port_id)
+        if row is None or column is None:
+            return None
+        return struct.unpack_from('<f', self.buffer, self._matrix_offset + 4 * (self.capacity * row + column))[0]
+
+
+def _signature():
+    try:
+        stat = os.stat(_matrix_path())
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_dev
+
+
+def get_matrix():
+    """La matriz mapeada del archivo vigente, o None si todavía no se armó."""
+    signature = _signature()
+    if signature != _state['signature']:
+        matrix = None
+        if signature is not None:
+            try:
+                with open(_matrix_path(), 'rb') as fh:
+                    matrix = DistanceMatrix(mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ))
+            except (FileNotFoundError, ValueError, struct.error):
+                matrix = None
+        _state.update(signature=signature, matrix=matrix)
+    return _state['matrix']
+
+
+def route_estimate(origin_port_id, destination_port_id):
+    """
+    (distance_nautical_miles, estimated_transit_days) estimados para una
+    ruta, o None si a algún puerto le faltan coordenadas. Sin matriz (o con
+    un puerto que todavía no está) se calcula desde las coordenadas.
+    """
+    matrix = get_matrix()
+    great_circle = matrix.great_circle(origin_port_id, destination_port_id) if matrix is not None else None
+    if great_circle is None:
+        coordinates = {pk: (lat, lon) for pk, lat, lon in _port_coordinates([origin_port_id, destination_port_id])}
+        if origin_port_id not in coordinates or destination_port_id not in coordinates:
+            return None
+        great_circle = great_circle_nm(coordinates[origin_port_id], coordinates[destination_port_id])
+    return estimate(great_circle)
+
+
+def validate_routes(tolerance=TOLERANCE, routes=None):
+    """
+    Compara distancia y tránsito cargados de las rutas (todas o el queryset
+    routes) con la matriz. Devuelve las que no pasan, con la estimación y
+    los problemas encontrados.
+    """
+    from .models import ShippingRoute
+
+    matrix = get_matrix()
+    coordinates = None
+    routes = ShippingRoute.objects.all() if routes is None else routes
+    results = []
+    for route_id, origin, destination, distance, transit_days in routes.order_by('id').values_list(
+            'id', 'origin_port_id', 'destination_port_id', 'distance_nautical_miles', 'estimated_transit_days'):
+        great_circle = matrix.great_circle(origin, destination) if matrix is not None else None
+        if great_circle is None:
+            if coordinates is None:
+                coordinates = {pk: (lat, lon) for pk, lat, lon in _port_coordinates()}
+            if origin not in coordinates or destination not in coordinates:
+                continue
+            great_circle = great_circle_nm(coordinates[origin], coordinates[destination])
+        estimated_distance, estimated_days = estimate(great_circle)
+        problems = []
+        # Medio por ciento de margen por el redondeo y la precisión de float32
+        if distance < great_circle * 0.995:
+            problems.append('distance_below_great_circle')
+        elif abs(distance - estimated_distance) > tolerance * estimated_distance:
+            problems.append('distance_off_estimate')
+        if transit_days < distance / (24 * MAX_SPEED_KNOTS):
+            problems.append('transit_too_fast')
+        if problems:
+            results.append({
+                'route_id': route_id, 'origin_port_id': origin, 'destination_port_id': destination,
+                'distance_nautical_miles': distance, 'estimated_transit_days': transit_days,
+                'estimated_distance': estimated_distance, 'estimated_days': estimated_days, 'problems': problems,
+            })
+    return results
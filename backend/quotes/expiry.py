@@ -0,0 +1,83 @@
+"""
+Vencimiento de cotizaciones: pasa a EXPIRED las DRAFT/SENT con valid_until
+vencido (comando expire_quotes).
+
+Cada lote toma las siguientes `batch_size` cotizaciones vencidas por el
+índice parcial quote_open_valid_until_idx y las actualiza con un solo UPDATE
+en su propia transacción, sin cargar instancias ni pasar por Quote.save().
+Los rollups de analytics se mueven con una lectura de los items del lote
+(rollups.moving()).
+Los lotes son chicos para que SQL Server no escale los bloqueos de fila a la
+tabla (lo hace a partir de unos 5.000 por sentencia) y entre lote y lote se
+espera `pause` segundos para dejar pasar a las escrituras de la API.
+
+El avance es el propio estado de las filas: una cotización vencida deja de
+cumplir el filtro, así que un barrido interrumpido se retoma corriendo el
+comando otra vez.
+"""
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import rollups
+from .models import Quote
+
+OPEN_STATUSES = ('DRAFT', 'SENT')
+EXPIRED = 'EXPIRED'
+BATCH_SIZE = 1000
+PAUSE = 0.05
+
+
+def overdue(now=None):
+    """Cotizaciones abiertas con valid_until anterior a now."""
+    return Quote.objects.filter(status__in=OPEN_STATUSES, valid_until__lt=now or timezone.now())
+
+
+def expire_batch(now, batch_size=BATCH_SIZE):
+    """Vence un lote y devuelve las filas actualizadas, o None si no quedan vencidas."""
+    with transaction.atomic():
+        # Bloqueadas hasta el UPDATE: los rollups mueven exactamente estas filas
+        rows = list(rollups.for_update(overdue(now)).order_by('valid_until', 'id').values(
+            *rollups.QUOTE_FIELDS)[:batch_size])
+        if not rows:
+            return None
+        changes = rollups.moving(rows, EXPIRED)
+        # El filtro se repite por si la base no soporta FOR UPDATE
+        updated = overdue(now).filter(id__in=[row['pk'] for row in rows]).update(
+            status=EXPIRED, updated_at=timezone.now())
+        changes.apply()
+        return updated
+
+
+def sweep(now=None, batch_size=BATCH_SIZE, pause=PAUSE, max_batches=None, max_seconds=None, on_batch=None):
+    """
+    Vence lotes hasta que no queden cotizaciones vencidas o se alcance
+    max_batches / max_seconds. on_batch(stats) se llama después de cada lote.
+    """
+    now = now or timezone.now()
+    started = time.perf_counter()
+    stats = {'expired': 0, 'batches': 0, 'elapsed': 0.0, 'rows_per_second': 0.0, 'complete': False}
+    while True:
+        if max_batches is not None and stats['batches'] >= max_batches:
+            break
+        if max_seconds is not None and time.perf_counter() - started >= max_seconds:
+            break
+        updated = expire_batch(now, batch_size)
+        if updated is None:
+            stats['complete'] = True
+            break
+        stats['expired'] += updated
+        stats['batches'] += 1
+        stats['elapsed'] = time.perf_counter() - started
+        stats['rows_per_second'] = stats['expired'] / stats['elapsed'] if stats['elapsed'] else 0.0
+        if on_batch:
+            on_batch(stats)
+        if pause:
+            time.sleep(pause)
+    if not stats['complete']:
+        stats['complete'] = not overdue(now).exists()
+    stats['elapsed'] = time.perf_counter() - started
+    if stats['elapsed']:
+        stats['rows_per_second'] = stats['expired'] / stats['elapsed']
+    return stats
@@ -0,0 +1,217 @@
+"""
+Prueba de carga de calculate_quote dentro del proceso (ver el comando
+load_test_quotes): el camino WSGI (vista de DRF; como un worker gthread, a lo
+sumo `threads` requests en curso) contra el camino ASGI (la aplicación de
+shipquote_backend/asgi.py, que despacha a async_views.asgi_calculate_quote,
+en un event loop), con la misma cantidad de clientes concurrentes. La latencia se mide desde que el cliente envía el request,
+incluida la espera por un hilo libre.
+
+db_latency_ms agrega una demora a cada consulta para simular la ida y vuelta
+a SQL Server (SQLite local responde en microsegundos) e invalidate_every
+invalida el snapshot cada N requests, como una importación de tarifas en
+curso. Para comparar con el mismo presupuesto de hilos, ASYNC_QUOTE_DB_CONCURRENCY
+tiene que ser igual a `threads`.
+"""
+import asyncio
+import io
+import json
+import random
+import threading
+import time
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.db.backends.signals import connection_created
+
+from containers.models import CargoType
+from . import snapshot
+from .benchmarks import _percentile
+from .models import RateMatrixEntry
+
+WSGI_PATH = '/api/v1/calculate_quote/'
+ASGI_PATH = '/api/v1/async/calculate_quote/'
+
+
+def request_bodies(count, seed=42):
+    """Cuerpos JSON de calculate_quote sobre rutas con tarifa."""
+    rng = random.Random(seed)
+    lanes = list(RateMatrixEntry.objects.values_list(
+        'origin_port_id', 'destination_port_id', 'container_type_id')[:5000])
+    if not lanes:
+        raise RuntimeError('No priced routes found; load data first (manage.py generate_data).')
+    cargo_types = list(CargoType.objects.values_list('id', flat=True))
+    bodies = []
+    for _ in range(count):
+        origin, destination, container_type = rng.choice(lanes)
+        bodies.append(json.dumps({
+            'origin_port_id': origin, 'destination_port_id': destination, 'container_type_id': container_type,
+            'cargo_type_id': rng.choice(cargo_types), 'quantity': rng.randint(1, 5),
+            'weight_kg': rng.randint(2000, 24000), 'volume_cbm': rng.randint(10, 60),
+        }).encode())
+    return bodies
+
+
+class _DatabaseLatency:
+    """execute_wrapper con una demora fija, instalado en cada conexión nueva mientras dura el bloque."""
+
+    def __init__(self, latency_ms):
+        self.delay = latency_ms / 1000
+
+    def __call__(self, execute, sql, params, many, context):
+        time.sleep(self.delay)
+        return execute(sql, params, many, context)
+
+    def _install(self, sender, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def __enter__(self):
+        if self.delay:
+            connection_created.connect(self._install, weak=False)
+        return self
+
+    def __exit__(self, *exc):
+        connection_created.disconnect(self._install)
+
+
+class _Results:
+    def __init__(self, invalidate_every):
+        self.invalidate_every = invalidate_every
+        self.timings = []
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+        self._sent = 0
+
+    def sent(self):
+        with self._lock:
+            self._sent += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            invalidate = self.invalidate_every and self._sent % self.invalidate_every == 0
+        if invalidate:
+            snapshot.invalidate()
+
+    def done(self, status, elapsed):
+        with self._lock:
+            self.in_flight -= 1
+            self.timings.append(elapsed)
+            if status >= 400:
+                self.errors += 1
+
+    def summary(self, elapsed):
+        ordered = sorted(self.timings)
+        return {
+            'requests': len(ordered),
+            'errors': self.errors,
+            'elapsed_s': elapsed,
+            'throughput_per_s': len(ordered) / elapsed if elapsed else None,
+            'p50_ms': _percentile(ordered, 0.50) * 1000,
+            'p95_ms': _percentile(ordered, 0.95) * 1000,
+            'p99_ms': _percentile(ordered, 0.99) * 1000,
+            'max_ms': ordered[-1] * 1000,
+            'peak_in_flight': self.peak_in_flight,
+        }
+
+
+def run_wsgi(bodies, concurrency, threads, invalidate_every=0):
+    """`concurrency` clientes contra el WSGIHandler con `threads` hilos de worker."""
+    application = WSGIHandler()
+    workers = threading.BoundedSemaphore(threads)
+    results = _Results(invalidate_every)
+    pending = list(reversed(bodies))
+    pending_lock = threading.Lock()
+
+    def call(body):
+        statuses = []
+        environ = {
+            'REQUEST_METHOD': 'POST', 'PATH_INFO': WSGI_PATH, 'QUERY_STRING': '', 'SCRIPT_NAME': '',
+            'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body)),
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'wsgi.input': io.BytesIO(body), 'wsgi.url_scheme': 'http', 'wsgi.errors': io.StringIO(),
+        }
+        response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+        b''.join(response)
+        response.close()
+        return int(statuses[0][:3])
+
+    def client():
+        while True:
+            with pending_lock:
+                if not pending:
+                    return
+                body = pending.pop()
+            started = time.perf_counter()
+            with workers:
+                results.sent()
+                status = call(body)
+            results.done(status, time.perf_counter() - started)
+
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return results.summary(time.perf_counter() - started)
+
+
+async def _asgi_call(application, body):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+        'path': ASGI_PATH, 'raw_path': ASGI_PATH.encode(), 'root_path': '', 'query_string': b'',
+        'headers': [(b'host', b'localhost'), (b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode())],
+        'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    statuses = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # Sin desconexión: Django cancela la espera al terminar la respuesta
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+
+    await application(scope, receive, send)
+    return statuses[0]
+
+
+def run_asgi(bodies, concurrency, invalidate_every=0):
+    """`concurrency` clientes contra la aplicación de shipquote_backend/asgi.py en un solo event loop."""
+    from shipquote_backend.asgi import application
+    results = _Results(invalidate_every)
+    pending = list(reversed(bodies))
+
+    async def client():
+        while pending:
+            body = pending.pop()
+            started = time.perf_counter()
+            results.sent()
+            status = await _asgi_call(application, body)
+            results.done(status, time.perf_counter() - started)
+
+    async def main():
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+
+    started = time.perf_counter()
+    asyncio.run(main())
+    return results.summary(time.perf_counter() - started)
+
+
+def run(requests=2000, concurrency=64, threads=4, db_latency_ms=0, invalidate_every=0, seed=42, modes=('wsgi', 'asgi')):
+    """Corre cada modo con los mismos requests y devuelve {modo: resumen}."""
+    bodies = request_bodies(requests, seed=seed)
+    results = {}
+    with _DatabaseLatency(db_latency_ms):
+        for mode in modes:
+            snapshot.get_snapshot()
+            if mode == 'wsgi':
+                results[mode] = run_wsgi(bodies, concurrency, threads, invalidate_every)
+            else:
+                results[mode] = run_asgi(bodies, concurrency, invalidate_every)
+    return results
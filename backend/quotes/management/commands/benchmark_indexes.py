@@ -0,0 +1,260 @@
+import json
+import math
+import random
+import statistics
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction, NotSupportedError
+from django.db.models import Q
+from django.utils import timezone
+
+from ports.models import Country, Port
+from containers.models import ContainerType
+from quotes.models import ShippingRoute, BaseRate, Quote
+from shipquote_backend.database_router import pinned_to_primary
+
+# Índices agregados en quotes/migrations/0004_hot_lookup_indexes.py
+BENCHMARK_INDEXES = {
+    BaseRate: ['baserate_lookup_idx', 'baserate_effective_idx'],
+    Quote: ['quote_created_idx', 'quote_status_created_idx', 'quote_email_created_idx', 'quote_user_created_idx'],
+}
+CODE_PREFIX = 'BX'
+
+
+def _base_descartable(connection):
+    """True para bases de prueba: SQLite en memoria o la base test_* del runner."""
+    name = str(connection.settings_dict['NAME'] or '')
+    test_name = connection.settings_dict.get('TEST', {}).get('NAME')
+    if connection.vendor == 'sqlite' and connection.creation.is_in_memory_db(name):
+        return True
+    return name.startswith('test_') or (test_name is not None and name == test_name)
+
+
+class Command(BaseCommand):
+    help = ('Carga un conjunto de datos grande (determinístico) y compara planes de consulta y '
+            'latencias de las búsquedas más usadas sin y con los índices compuestos. Todo corre en '
+            'una transacción que se revierte al final: no quedan datos de benchmark ni cambios de índices.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ports', type=int, default=200)
+        parser.add_argument('--routes', type=int, default=2000)
+        parser.add_argument('--rate-history', type=int, default=6, help='Tarifas históricas por ruta y contenedor.')
+        parser.add_argument('--quotes', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=200, help='Ejecuciones por consulta.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Archivo JSON con los resultados.')
+        parser.add_argument(
+            '--i-know', action='store_true',
+            help='Permite correr sobre una base que no es de prueba. Los cambios se revierten, pero mientras '
+                 'dura la medición las tablas de tarifas y cotizaciones quedan bloqueadas y sin los índices.'
+        )
+
+    def handle(self, *args, **options):
+        if not (options['i_know'] or _base_descartable(connection)):
+            raise CommandError(
+                f"Refusing to run on database {connection.settings_dict['NAME']!r}: it seeds benchmark rows "
+                "and drops indexes while measuring. Use a throwaway database or pass --i-know."
+            )
+        self.random = random.Random(options['seed'])
+        self.repeat = options['repeat']
+        # Las lecturas tienen que ver los datos sin confirmar de esta transacción
+        with pinned_to_primary(), transaction.atomic():
+            try:
+                results = self._correr(options)
+            finally:
+                transaction.set_rollback(True)
+
+        for name in results['before']:
+            before, after = results['before'][name], results['after'][name]
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(f"  sin índices: p50={before['p50_ms']:.3f}ms p95={before['p95_ms']:.3f}ms")
+            self.stdout.write(f"    {before['plan']}")
+            self.stdout.write(f"  con índices: p50={after['p50_ms']:.3f}ms p95={after['p95_ms']:.3f}ms")
+            self.stdout.write(f"    {after['plan']}")
+
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(results, fh, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {options['output']}."))
+
+    def _correr(self, options):
+        if not Port.objects.filter(code__startswith=CODE_PREFIX).exists():
+            self._sembrar_datos(options)
+        else:
+            self.stdout.write('Usando los datos de benchmark existentes.')
+        self._analizar_tablas()
+
+        queries = self._consultas()
+        results = {'vendor': connection.vendor}
+        self._quitar_indices()
+        results['before'] = self._medir(queries)
+        self._restaurar_indices()
+        results['after'] = self._medir(queries)
+        return results
+
+    def _sembrar_datos(self, options):
+        self.stdout.write('Creando datos de benchmark...')
+        country = Country.objects.get_or_create(code='BXX', defaults={'name': 'Benchmark', 'continent': 'Benchmark'})[0]
+        Port.objects.bulk_create([
+            Port(name=f'Puerto benchmark {i}', code=f'{CODE_PREFIX}{i:05d}', country=country, city='Benchmark')
+            for i in range(options['ports'])
+        ], batch_size=1000)
+        port_ids = list(Port.objects.filter(code__startswith=CODE_PREFIX).values_list('id', flat=True))
+
+        pairs = set()
+        while len(pairs) < min(options['routes'], len(port_ids) * (len(port_ids) - 1)):
+            origin, destination = self.random.sample(port_ids, 2)
+            pairs.add((origin, destination))
+        ShippingRoute.objects.bulk_create([
+            ShippingRoute(origin_port_id=o, destination_port_id=d, distance_nautical_miles=self.random.randint(500, 12000),
+                          estimated_transit_days=self.random.randint(3, 40))
+            for o, d in sorted(pairs)
+        ], batch_size=1000)
+        route_ids = list(ShippingRoute.objects.filter(origin_port_id__in=port_ids).values_list('id', flat=True))
+
+        container_type_ids = list(ContainerType.objects.values_list('id', flat=True))
+        if not container_type_ids:
+            container_type_ids = [ContainerType.objects.create(
+                name='Contenedor Seco 20ft', size='20', type='DRY', max_weight=28000, internal_length=5.89,
+                internal_width=2.35, internal_height=2.39, volume=33.2).id]
+
+        today = date.today()
+        rates = []
+        for route_id in route_ids:
+            for container_type_id in container_type_ids:
+                for version in range(options['rate_history']):
+                    start = today - timedelta(days=90 * (options['rate_history'] - version))
+                    rates.append(BaseRate(
+                        route_id=route_id, container_type_id=container_type_id,
+                        base_rate_usd=Decimal(self.random.randint(800, 6000)),
+                        fuel_surcharge_percentage=Decimal(self.random.randint(5, 25)),
+                        effective_from=start,
+                        effective_to=None if version == options['rate_history'] - 1 else start + timedelta(days=89),
+                        is_active=self.random.random() > 0.05,
+                    ))
+        BaseRate.objects.bulk_create(rates, batch_size=2000)
+
+        statuses = [choice for choice, _ in Quote.STATUS_CHOICES]
+        now = timezone.now()
+        quotes = []
+        for i in range(options['quotes']):
+            quotes.append(Quote(
+                quote_number=f'{CODE_PREFIX}{i:010d}', customer_name=f'Cliente {i % 5000}',
+                customer_email=f'cliente{i % 5000}@example.com',
+                origin_port_id=self.random.choice(port_ids), destination_port_id=self.random.choice(port_ids),
+                status=self.random.choice(statuses), total_amount=Decimal(self.random.randint(100, 50000)),
+                valid_until=now + timedelta(days=7),
+            ))
+            if len(quotes) == 5000:
+                Quote.objects.bulk_create(quotes)
+                quotes = []
+        Quote.objects.bulk_create(quotes)
+
+        # created_at es auto_now_add: se reparte en el último año por rangos de id
+        ids = Quote.objects.filter(quote_number__startswith=CODE_PREFIX).order_by('id').values_list('id', flat=True)
+        first, last = ids.first(), ids.last()
+        step = max(1, (last - first + 1) // 365)
+        for day, start in enumerate(range(first, last + 1, step)):
+            created = now - timedelta(days=365 - day)
+            Quote.objects.filter(id__gte=start, id__lt=start + step).update(
+                created_at=created, valid_until=created + timedelta(days=7)
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Creados {len(port_ids)} puertos, {len(route_ids)} rutas, {len(rates)} tarifas y {options["quotes"]} cotizaciones.'
+        ))
+
+    def _analizar_tablas(self):
+        if connection.vendor in ('sqlite', 'postgresql'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        elif connection.vendor == 'microsoft':
+            with connection.cursor() as cursor:
+                for model in BENCHMARK_INDEXES:
+                    cursor.execute(f'UPDATE STATISTICS {connection.ops.quote_name(model._meta.db_table)}')
+
+    def _consultas(self):
+        today = date.today()
+        route_pairs = list(BaseRate.objects.filter(
+            route__origin_port__code__startswith=CODE_PREFIX
+        ).values_list('route_id', 'container_type_id').distinct()[:1000])
+        emails = [f'cliente{i}@example.com' for i in range(0, 5000, 37)]
+
+        def rate_lookup():
+            route_id, container_type_id = self.random.choice(route_pairs)
+            return BaseRate.objects.filter(
+                route_id=route_id, container_type_id=container_type_id,
+                effective_from__lte=today, is_active=True,
+            ).filter(Q(effective_to__gte=today) | Q(effective_to__isnull=True)).order_by('-effective_from')[:1]
+
+        return {
+            'calculate_quote.base_rate': rate_lookup,
+            'quotes.list': lambda: Quote.objects.order_by('-created_at', '-id')[:20],
+            'quotes.filter_status': lambda: Quote.objects.filter(status='SENT').order_by('-created_at', '-id')[:20],
+            'quotes.filter_customer_email': lambda: Quote.objects.filter(
+                customer_email=self.random.choice(emails)).order_by('-created_at', '-id')[:20],
+            'quotes.filter_created_by': lambda: Quote.objects.filter(
+                created_by__isnull=True).order_by('-created_at', '-id')[:20],
+            'base_rates.list': lambda: BaseRate.objects.order_by('-effective_from', '-id')[:20],
+        }
+
+    def _medir(self, queries):
+        results = {}
+        for name, build in queries.items():
+            timings = []
+            for _ in range(self.repeat):
+                queryset = build()
+                started = time.perf_counter()
+                list(queryset)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            results[name] = {
+                'p50_ms': statistics.median(timings),
+                'p95_ms': timings[math.ceil(len(timings) * 0.95) - 1],
+                'plan': self._plan(build()),
+            }
+        return results
+
+    def _plan(self, queryset):
+        try:
+            return ' | '.join(line.strip() for line in queryset.explain().splitlines())
+        except NotSupportedError:
+            if connection.vendor != 'microsoft':
+                return 'n/a'
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('SET SHOWPLAN_TEXT ON')
+            try:
+                cursor.execute(sql, params)
+                plan = []
+                while True:
+                    plan += [row[0].strip() for row in cursor.fetchall()]
+                    if not cursor.nextset():
+                        break
+            finally:
+                cursor.execute('SET SHOWPLAN_TEXT OFF')
+        return ' | '.join(plan)
+
+    def _indices(self):
+        for model, names in BENCHMARK_INDEXES.items():
+            for index in model._meta.indexes:
+                if index.name in names:
+                    yield model, index
+
+    def _quitar_indices(self):
+        self.stdout.write('Quitando los índices compuestos para medir el estado anterior...')
+        # Sin entrar al schema_editor: en SQLite no se puede dentro de una
+        # transacción, y el DDL tiene que revertirse con ella
+        editor = connection.schema_editor()
+        for model, index in self._indices():
+            editor.execute(index.remove_sql(model, editor))
+        self._analizar_tablas()
+
+    def _restaurar_indices(self):
+        self.stdout.write('Restaurando los índices compuestos...')
+        editor = connection.schema_editor()
+        for model, index in self._indices():
+            editor.execute(index.create_sql(model, editor))
+        self._analizar_tablas()
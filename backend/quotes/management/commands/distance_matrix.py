@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from quotes import distances
+from quotes.models import ShippingRoute
+
+class Command(BaseCommand):
+    help = ('Calcula la matriz de distancias entre puertos (compartida por los workers) y valida la distancia '
+            'y el tránsito cargados en las rutas contra ella.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--validate', action='store_true', help='Lista las rutas fuera de la estimación.')
+        parser.add_argument('--tolerance', type=float, default=distances.TOLERANCE,
+                            help='Diferencia relativa tolerada con la distancia estimada.')
+        parser.add_argument('--fix', action='store_true',
+                            help='Reemplaza distancia y tránsito de las rutas fuera de la estimación.')
+
+    def handle(self, *args, **options):
+        stats = distances.build()
+        self.stdout.write(self.style.SUCCESS(
+            f"Matriz de {stats['ports']}×{stats['ports']} puertos en {stats['seconds']:.2f}s."
+        ))
+        if not (options['validate'] or options['fix']):
+            return
+
+        invalid = distances.validate_routes(tolerance=options['tolerance'])
+        for route in invalid:
+            self.stdout.write(
+                f"Ruta {route['route_id']} ({route['origin_port_id']} → {route['destination_port_id']}): "
+                f"{route['distance_nautical_miles']} nm / {route['estimated_transit_days']} días, "
+                f"estimado {route['estimated_distance']} nm / {route['estimated_days']} días "
+                f"[{', '.join(route['problems'])}]"
+            )
+        self.stdout.write(f'{len(invalid)} rutas fuera de la estimación.')
+        if options['fix'] and invalid:
+            # Una a una con save(): las señales actualizan el snapshot, la grilla y la caché HTTP
+            estimates = {route['route_id']: route for route in invalid}
+            with transaction.atomic():
+                for instance in ShippingRoute.objects.filter(pk__in=estimates):
+                    route = estimates[instance.pk]
+                    instance.distance_nautical_miles = route['estimated_distance']
+                    instance.estimated_transit_days = route['estimated_days']
+                    instance.save(update_fields=['distance_nautical_miles', 'estimated_transit_days'])
+            self.stdout.write(self.style.SUCCESS(f'{len(invalid)} rutas corregidas.'))
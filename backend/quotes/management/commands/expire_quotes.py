@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from quotes import expiry
+
+class Command(BaseCommand):
+    help = ('Pasa a EXPIRED las cotizaciones DRAFT/SENT con valid_until vencido, en lotes de UPDATE '
+            'acotados y con pausas entre lotes. Se puede interrumpir y volver a correr.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=expiry.BATCH_SIZE,
+                            help='Filas por UPDATE (por debajo del umbral de escalado de bloqueos).')
+        parser.add_argument('--pause', type=float, default=expiry.PAUSE, help='Segundos de espera entre lotes.')
+        parser.add_argument('--max-batches', type=int, help='Corta después de esta cantidad de lotes.')
+        parser.add_argument('--max-seconds', type=float, help='Corta después de estos segundos.')
+        parser.add_argument('--dry-run', action='store_true', help='Solo cuenta las cotizaciones vencidas.')
+        parser.add_argument('--interval', type=float,
+                            help='Repite el barrido cada N segundos (para correr como proceso periódico).')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            self.stdout.write(f'{expiry.overdue().count()} cotizaciones vencidas sin marcar.')
+            return
+
+        while True:
+            self._barrer(options)
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def _barrer(self, options):
+        def on_batch(stats):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"Lote {stats['batches']}: {stats['expired']} vencidas "
+                                  f"({stats['rows_per_second']:.0f} filas/s)...")
+
+        stats = expiry.sweep(
+            now=timezone.now(), batch_size=options['batch_size'], pause=options['pause'],
+            max_batches=options['max_batches'], max_seconds=options['max_seconds'], on_batch=on_batch,
+        )
+        message = (f"{stats['expired']} cotizaciones vencidas en {stats['batches']} lotes, "
+                   f"{stats['elapsed']:.1f}s ({stats['rows_per_second']:.0f} filas/s).")
+        if stats['complete']:
+            self.stdout.write(self.style.SUCCESS(message))
+        else:
+            self.stdout.write(self.style.WARNING(message + ' Quedan vencidas: volver a correr para continuar.'))
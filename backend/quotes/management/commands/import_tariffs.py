@@ -0,0 +1,60 @@
+import csv
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from quotes import tariff_import
+
+class Command(BaseCommand):
+    help = ('Importa una planilla de tarifas (CSV o XLSX) en streaming, con inserción o actualización '
+            'en bloque de rutas y tarifas base.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Archivo .csv o .xlsx con las tarifas.')
+        parser.add_argument('--supersede', action='store_true',
+                            help='Cierra las tarifas abiertas que empiezan antes que una tarifa importada.')
+        parser.add_argument('--dry-run', action='store_true', help='Valida todo y revierte la transacción.')
+        parser.add_argument('--batch-size', type=int, default=tariff_import.BATCH_SIZE)
+        parser.add_argument('--errors', help='Archivo CSV donde escribir las filas rechazadas.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        error_file = open(options['errors'], 'w', newline='', encoding='utf-8') if options['errors'] else None
+        error_writer = csv.writer(error_file) if error_file else None
+        if error_writer:
+            error_writer.writerow(['row', 'errors'])
+
+        def on_error(error):
+            if error_writer:
+                error_writer.writerow([error['row'], json.dumps(error['errors'], ensure_ascii=False)])
+            elif options['verbosity'] > 1:
+                self.stderr.write(f"Fila {error['row']}: {error['errors']}")
+
+        def on_progress(stats):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"{stats['rows']} filas procesadas ({stats['rows'] / max(elapsed, 1e-6):.0f} filas/s), "
+                              f"{stats['errors']} con errores...")
+
+        importer = tariff_import.TariffImporter(
+            supersede=options['supersede'], batch_size=options['batch_size'],
+            on_progress=on_progress, on_error=on_error,
+        )
+        try:
+            with open(options['path'], 'rb') as file:
+                stats = importer.run(tariff_import.read_rows(file, options['path']), dry_run=options['dry_run'])
+        except (OSError, tariff_import.ImportFormatError) as e:
+            raise CommandError(str(e))
+        finally:
+            if error_file:
+                error_file.close()
+
+        elapsed = time.perf_counter() - started
+        verb = 'Validadas' if options['dry_run'] else 'Importadas'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {stats['rows'] - stats['errors']} de {stats['rows']} filas en {elapsed:.1f}s: "
+            f"{stats['created']} tarifas creadas, {stats['updated']} actualizadas, {stats['closed']} cerradas, "
+            f"{stats['routes_created']} rutas creadas, {stats['routes_updated']} rutas actualizadas."
+        ))
+        if stats['errors']:
+            destination = f" (detalle en {options['errors']})" if options['errors'] else ''
+            self.stdout.write(self.style.WARNING(f"{stats['errors']} filas rechazadas{destination}."))
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from quotes import load_test
+
+class Command(BaseCommand):
+    help = ('Prueba de carga de calculate_quote en el proceso: la vista WSGI con un número fijo de hilos '
+            'contra la vista async servida por ASGI, con los mismos clientes concurrentes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=64, help='Clientes concurrentes.')
+        parser.add_argument('--threads', type=int, default=4, help='Hilos del worker WSGI.')
+        parser.add_argument('--db-latency-ms', type=float, default=0,
+                            help='Demora agregada a cada consulta (ida y vuelta a la base).')
+        parser.add_argument('--invalidate-every', type=int, default=0,
+                            help='Invalida el snapshot de precios cada N requests (0: nunca).')
+        parser.add_argument('--mode', choices=['wsgi', 'asgi'], nargs='*', default=['wsgi', 'asgi'])
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        try:
+            results = load_test.run(
+                requests=options['requests'], concurrency=options['concurrency'], threads=options['threads'],
+                db_latency_ms=options['db_latency_ms'], invalidate_every=options['invalidate_every'],
+                seed=options['seed'], modes=options['mode'],
+            )
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        for mode, result in results.items():
+            self.stdout.write(
+                f"{mode:5} {result['throughput_per_s']:8.1f}/s p50={result['p50_ms']:8.2f}ms "
+                f"p95={result['p95_ms']:8.2f}ms p99={result['p99_ms']:8.2f}ms "
+                f"en curso={result['peak_in_flight']:4d} errores={result['errors']}"
+            )
+        if {'wsgi', 'asgi'} <= set(results):
+            ratio = results['asgi']['throughput_per_s'] / results['wsgi']['throughput_per_s']
+            self.stdout.write(f'ASGI/WSGI: {ratio:.2f}x requests por segundo.')
+            lookup_threads = getattr(settings, 'ASYNC_QUOTE_DB_CONCURRENCY', 8)
+            if lookup_threads != options['threads']:
+                self.stdout.write(self.style.WARNING(
+                    f"Presupuestos de hilos distintos: WSGI {options['threads']}, ASGI {lookup_threads} "
+                    f"(ASYNC_QUOTE_DB_CONCURRENCY)."
+                ))
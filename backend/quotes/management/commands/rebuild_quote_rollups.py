@@ -0,0 +1,46 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from quotes import rollups
+
+class Command(BaseCommand):
+    help = ('Recalcula los rollups de analytics de cotizaciones (QuoteRollup y QuoteItemRollup) desde las '
+            'cotizaciones e items. Necesario después de cargas que no pasan por Quote.save(); conviene '
+            'correrlo con poca actividad de escritura.')
+
+    def add_arguments(self, parser):
+        since = parser.add_mutually_exclusive_group()
+        since.add_argument('--since', help='Solo los días desde esta fecha (YYYY-MM-DD).')
+        since.add_argument('--days', type=int,
+                           help='Solo los últimos N días antes de hoy, más hoy (1: desde ayer). Se calcula en cada '
+                                'corrida de --interval.')
+        parser.add_argument('--batch-size', type=int, default=rollups.BATCH_SIZE, help='Filas por INSERT.')
+        parser.add_argument('--interval', type=float,
+                            help='Repite el recálculo cada N segundos (para correr como proceso periódico).')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_date(options['since'])
+            if since is None:
+                raise CommandError('--since must be a date (YYYY-MM-DD).')
+        if options['days'] is not None and options['days'] < 0:
+            raise CommandError('--days must be zero or positive.')
+
+        while True:
+            if options['days'] is not None:
+                since = timezone.localdate() - datetime.timedelta(days=options['days'])
+            self._recalcular(since, options)
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def _recalcular(self, since, options):
+        started = time.perf_counter()
+        lanes, items = rollups.rebuild(since=since, batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{lanes} filas por ruta y {items} por tipo de contenedor recalculadas en {elapsed:.1f}s.'))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+from quotes import search
+
+class Command(BaseCommand):
+    help = ('Reconstruye el índice de búsqueda de cotizaciones (QuoteSearchToken), por lotes en orden de id. '
+            'Necesario después de cargas que no pasan por Quote.save().')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=search.BATCH_SIZE, help='Cotizaciones por lote.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+
+        def progress(indexed):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'  {indexed} cotizaciones ({indexed / elapsed:.0f}/s)')
+
+        indexed = search.reindex(batch_size=options['batch_size'], on_batch=progress)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'{indexed} cotizaciones indexadas en {elapsed:.1f}s.'))
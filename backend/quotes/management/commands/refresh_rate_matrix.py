@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from quotes import rate_matrix
+
+class Command(BaseCommand):
+    help = 'Reconstruye la grilla materializada de tarifas (ruta × tipo de contenedor).'
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write('Reconstruyendo la grilla de tarifas...')
+        total = rate_matrix.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Grilla de tarifas reconstruida con {total} celdas.'))
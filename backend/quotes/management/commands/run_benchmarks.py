@@ -0,0 +1,73 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from quotes import benchmarks
+
+class Command(BaseCommand):
+    help = ('Mide latencia (percentiles), rendimiento y consultas por llamada de los caminos críticos '
+            '(calculate_quote, creación de cotizaciones, listados) y compara con una corrida anterior.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200, help='Llamadas medidas por escenario.')
+        parser.add_argument('--warmup', type=int, default=20, help='Llamadas previas sin medir.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--only', nargs='*', help='Prefijos de los escenarios a correr (p. ej. quotes.).')
+        parser.add_argument('--quote-items', type=int, nargs='*', default=[1, 10, 50],
+                            help='Tamaños de cotización para QuoteSerializer.create.')
+        parser.add_argument('--output', help='Archivo JSON con los resultados.')
+        parser.add_argument('--compare', help='Resultados JSON de una corrida anterior.')
+        parser.add_argument('--threshold', type=float, default=benchmarks.DEFAULT_THRESHOLD,
+                            help='Aumento (fracción) a partir del cual se marca una regresión.')
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help='Termina con error si hay regresiones.')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as fh:
+                    baseline = json.load(fh)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Could not read {options['compare']}: {e}")
+
+        def on_result(name, result):
+            rows = ''
+            if result['rows_per_s'] != result['throughput_per_s']:
+                rows = f" {result['rows_per_s']:8.1f} filas/s"
+            self.stdout.write(
+                f"{name:34} p50={result['p50_ms']:8.2f}ms p95={result['p95_ms']:8.2f}ms "
+                f"p99={result['p99_ms']:8.2f}ms {result['throughput_per_s']:8.1f}/s "
+                f"consultas={result['queries_per_call']:.1f}{rows}"
+            )
+
+        try:
+            report = benchmarks.run(
+                iterations=options['iterations'], warmup=options['warmup'], seed=options['seed'],
+                only=options['only'], quote_items=options['quote_items'], on_result=on_result,
+            )
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        if baseline is not None:
+            rows = benchmarks.compare(baseline, report, options['threshold'])
+            report['comparison'] = {'baseline': baseline.get('meta'), 'threshold': options['threshold'], 'rows': rows}
+            regressions = [row for row in rows if row['regression']]
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"Comparación con {options['compare']} (umbral {options['threshold']:.0%}):"))
+            for row in rows:
+                line = (f"  {row['scenario']:34} {row['metric']:16} {row['baseline']:10.2f} -> "
+                        f"{row['current']:10.2f} ({row['change']:+.1%})")
+                self.stdout.write(self.style.ERROR(line) if row['regression'] else line)
+        else:
+            regressions = []
+
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(report, fh, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {options['output']}."))
+
+        if regressions:
+            message = f'{len(regressions)} regresiones por encima del {options["threshold"]:.0%}.'
+            if options['fail_on_regression']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
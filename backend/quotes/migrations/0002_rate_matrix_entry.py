@@ -0,0 +1,49 @@
+# Generated by Django 5.0.14 on 2026-10-18 14:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('containers', '0001_initial'),
+        ('ports', '0001_initial'),
+        ('quotes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateMatrixEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('origin_port_code', models.CharField(max_length=10)),
+                ('destination_port_code', models.CharField(max_length=10)),
+                ('origin_country_code', models.CharField(max_length=3)),
+                ('origin_continent', models.CharField(max_length=50)),
+                ('estimated_transit_days', models.IntegerField()),
+                ('base_rate_usd', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('fuel_surcharge_percentage', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('fuel_surcharge_amount', models.DecimalField(decimal_places=4, max_digits=14)),
+                ('handling_fee', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('insurance_fee', models.DecimalField(decimal_places=6, max_digits=16)),
+                ('documentation_fee', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('all_in_per_container', models.DecimalField(decimal_places=6, max_digits=16)),
+                ('effective_from', models.DateField()),
+                ('effective_to', models.DateField(blank=True, null=True)),
+                ('as_of', models.DateField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('base_rate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rate_matrix_entries', to='quotes.baserate')),
+                ('container_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rate_matrix_entries', to='containers.containertype')),
+                ('destination_port', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ports.port')),
+                ('origin_country', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ports.country')),
+                ('origin_port', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ports.port')),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rate_matrix_entries', to='quotes.shippingroute')),
+            ],
+            options={
+                'ordering': ['origin_port_code', 'destination_port_code', 'container_type'],
+                'indexes': [models.Index(fields=['origin_country_code'], name='ratematrix_origin_country_idx'), models.Index(fields=['origin_continent'], name='ratematrix_continent_idx')],
+                'unique_together': {('route', 'container_type')},
+            },
+        ),
+    ]
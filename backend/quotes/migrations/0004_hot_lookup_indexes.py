@@ -0,0 +1,41 @@
+# Generated by Django 5.0.14 on 2026-10-18 14:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('containers', '0001_initial'),
+        ('ports', '0001_initial'),
+        ('quotes', '0003_quote_number_sequence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='baserate',
+            index=models.Index(fields=['route', 'container_type', 'is_active', '-effective_from', 'effective_to'], name='baserate_lookup_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='baserate',
+            index=models.Index(fields=['-effective_from', '-id'], name='baserate_effective_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quote',
+            index=models.Index(fields=['-created_at', '-id'], name='quote_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quote',
+            index=models.Index(fields=['status', '-created_at', '-id'], name='quote_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quote',
+            index=models.Index(fields=['customer_email', '-created_at', '-id'], name='quote_email_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quote',
+            index=models.Index(fields=['created_by', '-created_at', '-id'], name='quote_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.0.14 on 2026-10-18 14:19
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    # Solo llena las columnas nuevas desde los items guardados. Los subtotales
+    # y total_amount de las cotizaciones ya emitidas no se tocan: sus items
+    # incluyen la tarifa de documentación por contenedor, así que la tarifa
+    # por cotización queda en 0. El cambio de cálculo rige para las nuevas.
+    Quote = apps.get_model('quotes', 'Quote')
+    QuoteItem = apps.get_model('quotes', 'QuoteItem')
+
+    def aggregate(expression, output_field):
+        subquery = QuoteItem.objects.filter(quote=OuterRef('pk')).order_by().values('quote').annotate(
+            value=expression
+        ).values('value')
+        return Coalesce(Subquery(subquery, output_field=output_field), Value(0), output_field=output_field)
+
+    measure = DecimalField(max_digits=14, decimal_places=2)
+    Quote.objects.update(
+        item_count=aggregate(Count('id'), models.IntegerField()),
+        total_weight_kg=aggregate(Sum('weight_kg'), measure),
+        total_volume_cbm=aggregate(Sum('volume_cbm'), measure),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotes', '0004_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quote',
+            name='documentation_fee',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='quote',
+            name='item_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='quote',
+            name='total_volume_cbm',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='quote',
+            name='total_weight_kg',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=14),
+        ),
+        migrations.AlterField(
+            model_name='quote',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=12),
+        ),
+        # Al revertir, los datos se van con las columnas que quitan los AddField
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
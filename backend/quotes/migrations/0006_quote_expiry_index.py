@@ -0,0 +1,20 @@
+# Generated by Django 5.0.14 on 2026-10-18 15:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ports', '0001_initial'),
+        ('quotes', '0005_quote_totals'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='quote',
+            index=models.Index(condition=models.Q(('status__in', ['DRAFT', 'SENT'])), fields=['valid_until', 'id'], name='quote_open_valid_until_idx'),
+        ),
+    ]
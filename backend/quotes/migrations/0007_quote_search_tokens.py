@@ -0,0 +1,74 @@
+# Generated by Django 5.0.14 on 2026-10-18 15:30
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Copia de quotes.search al momento de esta migración, para que no cambie si
+# después cambia la tokenización de la app
+TOKEN_LENGTH = 40
+BATCH_SIZE = 2000
+FIELDS = (
+    ('quote_number', 8),
+    ('customer_name', 4),
+    ('customer_email', 4),
+    ('customer_company', 3),
+    ('origin_port__code', 2),
+    ('destination_port__code', 2),
+    ('origin_port__name', 2),
+    ('destination_port__name', 2),
+)
+_TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def _tokenize(text):
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    normalized = ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+    return [token[:TOKEN_LENGTH] for token in _TOKEN.findall(normalized)]
+
+
+def index_quotes(apps, schema_editor):
+    Quote = apps.get_model('quotes', 'Quote')
+    QuoteSearchToken = apps.get_model('quotes', 'QuoteSearchToken')
+    queryset = Quote.objects.order_by('pk').values('pk', *(field for field, _ in FIELDS))
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_id)[:BATCH_SIZE])
+        if not rows:
+            return
+        tokens = []
+        for row in rows:
+            weights = {}
+            for field, weight in FIELDS:
+                for token in _tokenize(row[field]):
+                    if weights.get(token, 0) < weight:
+                        weights[token] = weight
+            tokens += [QuoteSearchToken(quote_id=row['pk'], token=token, weight=weight)
+                       for token, weight in weights.items()]
+        QuoteSearchToken.objects.bulk_create(tokens, batch_size=BATCH_SIZE)
+        last_id = rows[-1]['pk']
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotes', '0006_quote_expiry_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuoteSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=40)),
+                ('weight', models.SmallIntegerField()),
+                ('quote', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='quotes.quote')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'quote'], name='quote_search_token_idx'), models.Index(fields=['quote', 'token', 'weight'], name='quote_search_quote_idx')],
+            },
+        ),
+        migrations.RunPython(index_quotes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,95 @@
+# Generated by Django 5.0.14 on 2026-10-18 15:52
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+
+BATCH_SIZE = 2000
+
+
+def _bulk_insert(model, rows):
+    batch = []
+    for row in rows:
+        batch.append(model(month=row['day'].replace(day=1), **row))
+        if len(batch) >= BATCH_SIZE:
+            model.objects.bulk_create(batch)
+            batch = []
+    model.objects.bulk_create(batch)
+
+
+def build_rollups(apps, schema_editor):
+    # Mismas agrupaciones que quotes.rollups.rebuild(), con los modelos históricos
+    Quote = apps.get_model('quotes', 'Quote')
+    QuoteItem = apps.get_model('quotes', 'QuoteItem')
+    _bulk_insert(apps.get_model('quotes', 'QuoteRollup'), Quote.objects.annotate(
+        day=TruncDate('created_at'),
+    ).values('origin_port_id', 'destination_port_id', 'day', 'status').annotate(
+        quote_count=Count('id'), revenue=Sum('total_amount'),
+    ).order_by().iterator())
+    _bulk_insert(apps.get_model('quotes', 'QuoteItemRollup'), QuoteItem.objects.values(
+        'container_type_id',
+        origin_port_id=F('quote__origin_port_id'),
+        destination_port_id=F('quote__destination_port_id'),
+        day=TruncDate('quote__created_at'),
+        status=F('quote__status'),
+    ).annotate(
+        quote_count=Count('quote_id', distinct=True), container_count=Sum('quantity'), revenue=Sum('subtotal'),
+    ).order_by().iterator())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('containers', '0001_initial'),
+        ('ports', '0001_initial'),
+        ('quotes', '0007_quote_search_tokens'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuoteRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('month', models.DateField()),
+                ('status', models.CharField(choices=[('DRAFT', 'Draft'), ('SENT', 'Sent'), ('ACCEPTED', 'Accepted'), ('REJECTED', 'Rejected'), ('EXPIRED', 'Expired')], max_length=20)),
+                ('quote_count', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=16)),
+                ('destination_port', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ports.port')),
+                ('origin_port', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ports.port')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QuoteItemRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('month', models.DateField()),
+                ('status', models.CharField(choices=[('DRAFT', 'Draft'), ('SENT', 'Sent'), ('ACCEPTED', 'Accepted'), ('REJECTED', 'Rejected'), ('EXPIRED', 'Expired')], max_length=20)),
+                ('quote_count', models.IntegerField(default=0)),
+                ('container_count', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=16)),
+                ('container_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='containers.containertype')),
+                ('destination_port', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ports.port')),
+                ('origin_port', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ports.port')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day', 'status'], name='quote_item_rollup_day_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='quoteitemrollup',
+            constraint=models.UniqueConstraint(fields=('origin_port', 'destination_port', 'container_type', 'day', 'status'), name='quote_item_rollup_key'),
+        ),
+        migrations.AddIndex(
+            model_name='quoterollup',
+            index=models.Index(fields=['day', 'status'], name='quote_rollup_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='quoterollup',
+            constraint=models.UniqueConstraint(fields=('origin_port', 'destination_port', 'day', 'status'), name='quote_rollup_key'),
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
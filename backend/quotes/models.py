@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from decimal import Decimal
 from django.contrib.auth.models import User
 from ports.models import Port
@@ -30,6 +30,12 @@ class BaseRate(models.Model):
     
     class Meta:
         ordering = ['-effective_from']
+        indexes = [
+            # Búsqueda de la tarifa vigente en calculate_quote: igualdades primero, luego el rango de fechas
+            models.Index(fields=['route', 'container_type', 'is_active', '-effective_from', 'effective_to'],
+                         name='baserate_lookup_idx'),
+            models.Index(fields=['-effective_from', '-id'], name='baserate_effective_idx'),
+        ]
     
     def __str__(self):
         return f"{self.route} - {self.container_type} - ${self.base_rate_usd}"
@@ -43,6 +49,8 @@ class Quote(models.Model):
         ('EXPIRED', 'Expired'),
     ]
     
+    TOTAL_FIELDS = ('total_amount', 'item_count', 'total_weight_kg', 'total_volume_cbm', 'documentation_fee')
+
     quote_number = models.CharField(max_length=20, unique=True)
     customer_name = models.CharField(max_length=200)
     customer_email = models.EmailField()
@@ -53,7 +61,12 @@ class Quote(models.Model):
     
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='DRAFT')
     
-    total_amount = models.DecimalField(max_digits=12, decimal_places=2)
+    # Totales mantenidos desde los items (ver quotes/totals.py)
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0'))
+    item_count = models.IntegerField(default=0)
+    total_weight_kg = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0'))
+    total_volume_cbm = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0'))
+    documentation_fee = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0'))
     currency = models.CharField(max_length=3, default='USD')
     
     valid_until = models.DateTimeField()
@@ -65,18 +78,110 @@ class Quote(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Filtros de QuoteViewSet (filterset_fields) con el orden por defecto del listado
+            models.Index(fields=['-created_at', '-id'], name='quote_created_idx'),
+            models.Index(fields=['status', '-created_at', '-id'], name='quote_status_created_idx'),
+            models.Index(fields=['customer_email', '-created_at', '-id'], name='quote_email_created_idx'),
+            models.Index(fields=['created_by', '-created_at', '-id'], name='quote_user_created_idx'),
+            # Barrido de vencimientos (quotes/expiry.py): solo las cotizaciones abiertas
+            models.Index(fields=['valid_until', 'id'], name='quote_open_valid_until_idx',
+                         condition=models.Q(status__in=['DRAFT', 'SENT'])),
+        ]
     
     def __str__(self):
         return f"Quote {self.quote_number} - {self.customer_name}"
     
     def save(self, *args, **kwargs):
         if not self.quote_number:
-            
-            import datetime
-            today = datetime.date.today()
-            count = Quote.objects.filter(created_at__date=today).count() + 1
-            self.quote_number = f"SQ{today.strftime('%Y%m%d')}{count:04d}"
-        super().save(*args, **kwargs)
+            # Numeración por día desde QuoteNumberSequence (bloques reservados en memoria)
+            from .numbering import allocator
+            self.quote_number = allocator.next_number()
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Los totales se escriben solo desde quotes/totals.py; una instancia
+            # cargada antes de cambiar los items no debe pisarlos
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.TOTAL_FIELDS
+            ]
+        # Los rollups se aplican en post_save: fuera de una transacción el
+        # INSERT/UPDATE se confirmaría antes que ellos
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            super().save(*args, **kwargs)
+
+class QuoteSearchToken(models.Model):
+    """Índice invertido de búsqueda de cotizaciones (ver quotes/search.py)."""
+    token = models.CharField(max_length=40)
+    quote = models.ForeignKey(Quote, on_delete=models.CASCADE, related_name='search_tokens', db_index=False)
+    weight = models.SmallIntegerField()
+
+    class Meta:
+        indexes = [
+            # Candidatos por rango de token (prefijo)
+            models.Index(fields=['token', 'quote'], name='quote_search_token_idx'),
+            # Comprobación de términos y ranking por cotización, sin ir a la tabla
+            models.Index(fields=['quote', 'token', 'weight'], name='quote_search_quote_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.token} → {self.quote_id}"
+
+class QuoteRollup(models.Model):
+    """Cotizaciones y monto total por ruta, día y estado (ver quotes/rollups.py)."""
+    origin_port = models.ForeignKey(Port, on_delete=models.CASCADE, related_name='+', db_index=False)
+    destination_port = models.ForeignKey(Port, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    # Primer día del mes de day, para agrupar por mes sin funciones de fecha
+    month = models.DateField()
+    status = models.CharField(max_length=20, choices=Quote.STATUS_CHOICES)
+    quote_count = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal('0'))
+
+    class Meta:
+        constraints = [
+            # También es el índice de los filtros por origen
+            models.UniqueConstraint(fields=['origin_port', 'destination_port', 'day', 'status'],
+                                    name='quote_rollup_key'),
+        ]
+        indexes = [models.Index(fields=['day', 'status'], name='quote_rollup_day_idx')]
+
+    def __str__(self):
+        return f"{self.origin_port_id} → {self.destination_port_id} {self.day} {self.status}: {self.quote_count}"
+
+class QuoteItemRollup(models.Model):
+    """Cotizaciones, contenedores y monto de items por ruta, tipo de contenedor, día y estado."""
+    origin_port = models.ForeignKey(Port, on_delete=models.CASCADE, related_name='+', db_index=False)
+    destination_port = models.ForeignKey(Port, on_delete=models.CASCADE, related_name='+')
+    container_type = models.ForeignKey(ContainerType, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    # Primer día del mes de day, para agrupar por mes sin funciones de fecha
+    month = models.DateField()
+    status = models.CharField(max_length=20, choices=Quote.STATUS_CHOICES)
+    quote_count = models.IntegerField(default=0)
+    container_count = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal('0'))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['origin_port', 'destination_port', 'container_type', 'day', 'status'],
+                                    name='quote_item_rollup_key'),
+        ]
+        indexes = [models.Index(fields=['day', 'status'], name='quote_item_rollup_day_idx')]
+
+    def __str__(self):
+        return (f"{self.origin_port_id} → {self.destination_port_id} {self.container_type_id} "
+                f"{self.day} {self.status}: {self.quote_count}")
+
+class QuoteNumberSequence(models.Model):
+    """Contador diario de números de cotización (ver quotes/numbering.py)."""
+    day = models.DateField(unique=True)
+    last_value = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['-day']
+
+    def __str__(self):
+        return f"{self.day} - {self.last_value}"
 
 class QuoteItem(models.Model):
     quote = models.ForeignKey(Quote, on_delete=models.CASCADE, related_name='items')
@@ -100,16 +205,76 @@ class QuoteItem(models.Model):
     def __str__(self):
         return f"{self.quote.quote_number} - {self.container_type} x{self.quantity}"
     
-    def save(self, *args, **kwargs):
-        from decimal import Decimal
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Valores guardados, para aplicar solo la diferencia a los totales de la cotización
+        from .totals import TRACKED_FIELDS
+        if all(name in instance.__dict__ for name in TRACKED_FIELDS):
+            instance._tracked = {name: getattr(instance, name) for name in TRACKED_FIELDS}
+        # Y los de los rollups de analytics (ver quotes/rollups.py)
+        from .rollups import ITEM_FIELDS
+        if all(name in instance.__dict__ for name in ITEM_FIELDS):
+            instance._rollup_tracked = {name: getattr(instance, name) for name in ITEM_FIELDS}
+        return instance
+
+    def calculate_subtotal(self):
+        """Calcula el subtotal en memoria (también usado por las creaciones en bloque)."""
         # Convertir todos los valores a Decimal por si acaso
         base_rate = Decimal(str(self.base_rate))
         fuel_surcharge = Decimal(str(self.fuel_surcharge))
         handling_fee = Decimal(str(self.handling_fee))
-        documentation_fee = Decimal(str(self.documentation_fee))
         insurance_fee = Decimal(str(self.insurance_fee))
         quantity = Decimal(str(self.quantity))
-        self.subtotal = (
-            (base_rate + fuel_surcharge + handling_fee + documentation_fee + insurance_fee) * quantity
-        )
-        super().save(*args, **kwargs)
\ No newline at end of file
+        # La tarifa de documentación se cobra una vez por cotización, no por contenedor
+        self.subtotal = (base_rate + fuel_surcharge + handling_fee + insurance_fee) * quantity
+        return self.subtotal
+
+    def save(self, *args, **kwargs):
+        self.calculate_subtotal()
+        # Totales y rollups de la cotización en la misma transacción que el item
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            super().save(*args, **kwargs)
+
+class RateMatrixEntry(models.Model):
+    """
+    Grilla materializada ruta × tipo de contenedor con el precio total por
+    contenedor vigente. Se mantiene desde quotes/rate_matrix.py.
+    """
+    route = models.ForeignKey(ShippingRoute, on_delete=models.CASCADE, related_name='rate_matrix_entries')
+    container_type = models.ForeignKey(ContainerType, on_delete=models.CASCADE, related_name='rate_matrix_entries')
+    base_rate = models.ForeignKey(BaseRate, on_delete=models.CASCADE, related_name='rate_matrix_entries')
+
+    # Datos desnormalizados para filtrar sin joins
+    origin_port = models.ForeignKey(Port, on_delete=models.CASCADE, related_name='+')
+    destination_port = models.ForeignKey(Port, on_delete=models.CASCADE, related_name='+')
+    origin_port_code = models.CharField(max_length=10)
+    destination_port_code = models.CharField(max_length=10)
+    origin_country = models.ForeignKey('ports.Country', on_delete=models.CASCADE, related_name='+')
+    origin_country_code = models.CharField(max_length=3)
+    origin_continent = models.CharField(max_length=50)
+    estimated_transit_days = models.IntegerField()
+
+    base_rate_usd = models.DecimalField(max_digits=10, decimal_places=2)
+    fuel_surcharge_percentage = models.DecimalField(max_digits=5, decimal_places=2)
+    fuel_surcharge_amount = models.DecimalField(max_digits=14, decimal_places=4)
+    handling_fee = models.DecimalField(max_digits=10, decimal_places=2)
+    insurance_fee = models.DecimalField(max_digits=16, decimal_places=6)
+    documentation_fee = models.DecimalField(max_digits=10, decimal_places=2)
+    all_in_per_container = models.DecimalField(max_digits=16, decimal_places=6)
+    effective_from = models.DateField()
+    effective_to = models.DateField(null=True, blank=True)
+
+    as_of = models.DateField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['route', 'container_type']
+        ordering = ['origin_port_code', 'destination_port_code', 'container_type']
+        indexes = [
+            models.Index(fields=['origin_country_code'], name='ratematrix_origin_country_idx'),
+            models.Index(fields=['origin_continent'], name='ratematrix_continent_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.origin_port_code} → {self.destination_port_code} - {self.container_type_id}"
@@ -0,0 +1,124 @@
+"""
+Asignación de números de cotización (formato SQYYYYMMDDNNNN).
+
+Cada proceso reserva bloques de números del contador diario
+QuoteNumberSequence con un UPDATE bajo bloqueo de fila y los entrega desde
+memoria, así la mayoría de las inserciones no necesitan una consulta extra.
+Los números son únicos entre procesos porque cada bloque se reserva una sola
+vez; un bloque reservado dentro de una transacción solo pasa al pool del
+proceso después del commit (si la transacción se revierte, la reserva
+también y el resto del bloque se descarta). Todo número reservado se emite o
+sigue en el pool de algún proceso: solo quedan huecos por los bloques sin
+terminar al cerrar un proceso o por cotizaciones que no llegan a guardarse.
+"""
+import datetime
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+
+PREFIX = 'SQ'
+
+
+def format_number(day, value):
+    return f"{PREFIX}{day.strftime('%Y%m%d')}{value:04d}"
+
+
+class QuoteNumberAllocator:
+    def __init__(self, block_size=None):
+        self._block_size = block_size
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Bloques confirmados por día: [[siguiente, último], ...]
+        self._blocks = {}
+
+    @property
+    def block_size(self):
+        return self._block_size or getattr(settings, 'QUOTE_NUMBER_BLOCK_SIZE', 20)
+
+    def _initial_value(self, day):
+        """Último número ya emitido ese día (datos anteriores al contador)."""
+        from .models import Quote
+        last = Quote.objects.filter(
+            quote_number__startswith=format_number(day, 0)[:-4]
+        ).aggregate(last=Max('quote_number'))['last']
+        return int(last[len(PREFIX) + 8:]) if last else 0
+
+    def _reserve(self, day, size):
+        """Reserva un bloque en el contador diario. Devuelve [inicio, fin]."""
+        from .models import QuoteNumberSequence
+        with transaction.atomic():
+            # El valor inicial (un MAX sobre las cotizaciones) solo se calcula al crear el contador
+            sequence, _ = QuoteNumberSequence.objects.select_for_update().get_or_create(
+                day=day, defaults={'last_value': lambda: self._initial_value(day)}
+            )
+            start = sequence.last_value + 1
+            sequence.last_value += size
+            sequence.save(update_fields=['last_value'])
+        return [start, sequence.last_value]
+
+    def _take(self, block):
+        value = block[0]
+        block[0] += 1
+        return value
+
+    def _take_pooled(self, day):
+        """Siguiente número del pool del proceso para ese día, o None. Requiere self._lock."""
+        blocks = self._blocks.get(day)
+        while blocks:
+            if blocks[0][0] <= blocks[0][1]:
+                return self._take(blocks[0])
+            blocks.pop(0)
+        return None
+
+    def next_number(self, day=None):
+        day = day or datetime.date.today()
+        connection = transaction.get_connection()
+
+        if connection.in_atomic_block:
+            # Bloque provisorio, propio de esta transacción
+            pending = getattr(self._local, 'pending', None)
+            if pending is None or pending['day'] != day or pending['block'][0] > pending['block'][1] \
+                    or not self._is_live(connection, pending):
+                with self._lock:
+                    value = self._take_pooled(day)
+                    if value is not None:
+                        return format_number(day, value)
+                pending = {'day': day, 'block': self._reserve(day, self.block_size)}
+                pending['callback'] = lambda: self._release(pending)
+                self._local.pending = pending
+                transaction.on_commit(pending['callback'])
+            return format_number(day, self._take(pending['block']))
+
+        with self._lock:
+            value = self._take_pooled(day)
+            if value is None:
+                block = self._reserve(day, self.block_size)
+                # Se descartan los bloques de días anteriores
+                self._blocks = {day: [block]}
+                value = self._take(block)
+            return format_number(day, value)
+
+    def _is_live(self, connection, pending):
+        """
+        El bloque sigue siendo válido mientras su callback on_commit esté
+        registrado: si la transacción (o el savepoint) se revirtió, la reserva
+        también se revirtió y esos números pueden volver a asignarse.
+        """
+        return any(entry[1] is pending['callback'] for entry in connection.run_on_commit)
+
+    def _release(self, pending):
+        """Después del commit, el resto del bloque provisorio pasa al pool del proceso."""
+        if getattr(self._local, 'pending', None) is pending:
+            self._local.pending = None
+        block = pending['block']
+        if block[0] > block[1]:
+            return
+        with self._lock:
+            # Se agrega a los bloques del día en lugar de reemplazarlos, para no perder números
+            self._blocks.setdefault(pending['day'], []).append(list(block))
+            block[0] = block[1] + 1
+
+
+allocator = QuoteNumberAllocator()
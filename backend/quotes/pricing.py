@@ -0,0 +1,163 @@
+from decimal import Decimal
+from datetime import timedelta
+
+# Reglas de tarificación usadas por calculate_quote
+HANDLING_FEE = Decimal('50.00')
+DOCUMENTATION_FEE = Decimal('25.00')
+INSURANCE_RATE = Decimal('0.01')
+QUOTE_VALIDITY_DAYS = 7
+
+# Máximo de filas aceptadas por calculate_quotes_batch
+MAX_BATCH_SIZE = 2000
+
+REQUIRED_FIELDS = ('origin_port_id', 'destination_port_id', 'container_type_id',
+                   'cargo_type_id', 'weight_kg', 'volume_cbm')
+
+
+class QuoteError(Exception):
+    """Error de cotización con el código HTTP que debe devolverse."""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def calculate_container_charges(base_cost, fuel_surcharge_percentage):
+    """Recargos por contenedor; no dependen de la cantidad."""
+    base_cost = Decimal(str(base_cost))
+    fuel_surcharge_percentage = Decimal(str(fuel_surcharge_percentage))
+
+    fuel_surcharge_amount = base_cost * (fuel_surcharge_percentage / Decimal('100'))
+    insurance_fee = (base_cost + fuel_surcharge_amount) * INSURANCE_RATE
+
+    return {
+        'base_cost': base_cost,
+        'fuel_surcharge_percentage': fuel_surcharge_percentage,
+        'fuel_surcharge_amount': fuel_surcharge_amount,
+        'handling_fee': HANDLING_FEE,
+        'insurance_fee': insurance_fee,
+        'documentation_fee': DOCUMENTATION_FEE,
+        'per_container_cost': base_cost + fuel_surcharge_amount + HANDLING_FEE + insurance_fee,
+    }
+
+
+def calculate_breakdown(base_cost, fuel_surcharge_percentage, quantity, charges=None):
+    """
+    Aplica los recargos de combustible, seguro, manipulación y documentación
+    a una tarifa base. Todos los importes se manejan como Decimal.
+    """
+    charges = charges or calculate_container_charges(base_cost, fuel_surcharge_percentage)
+    total_item_cost = charges['per_container_cost'] * Decimal(str(quantity))
+    return dict(
+        charges,
+        total_item_cost=total_item_cost,
+        total_quote_amount=total_item_cost + DOCUMENTATION_FEE,
+    )
+
+
+def build_quote_response(origin_port, destination_port, container_type, cargo_type,
+                         quantity, weight_kg, volume_cbm, estimated_transit_days,
+                         breakdown, today):
+    """Arma la respuesta de calculate_quote a partir de los datos ya serializados."""
+    return {
+        "origin_port": origin_port,
+        "destination_port": destination_port,
+        "container_type": container_type,
+        "cargo_type": cargo_type,
+        "quantity": quantity,
+        "weight_kg": weight_kg,
+        "volume_cbm": volume_cbm,
+        "estimated_transit_days": estimated_transit_days,
+        "breakdown": {
+            "base_rate_per_container": float(breakdown['base_cost']),
+            "fuel_surcharge_percentage": float(breakdown['fuel_surcharge_percentage']),
+            "fuel_surcharge_amount_per_container": float(breakdown['fuel_surcharge_amount']),
+            "handling_fee_per_container": float(breakdown['handling_fee']),
+            "insurance_fee_per_container": float(breakdown['insurance_fee']),
+            "documentation_fee_per_quote": float(breakdown['documentation_fee']),
+        },
+        "total_item_cost": float(breakdown['total_item_cost']),
+        "total_quote_amount": float(breakdown['total_quote_amount']),
+        "currency": "USD",
+        "valid_until": (today + timedelta(days=QUOTE_VALIDITY_DAYS)).isoformat()
+    }
+
+
+def parse_quote_request(data):
+    """
+    Valida la entrada de calculate_quote y devuelve (origin_port_id,
+    destination_port_id, container_type_id, cargo_type_id, cantidad como
+    Decimal). Lanza QuoteError (400).
+    """
+    if not all(data.get(field) for field in REQUIRED_FIELDS):
+        raise QuoteError("Missing required parameters.", 400)
+
+    try:
+        parsed = (
+            int(data['origin_port_id']),
+            int(data['destination_port_id']),
+            int(data['container_type_id']),
+            int(data['cargo_type_id']),
+            Decimal(str(data.get('quantity', 1))),
+        )
+    except (TypeError, ValueError, ArithmeticError):
+        raise QuoteError("Invalid parameters.", 400)
+    # Decimal acepta NaN, Infinity y negativos
+    if not parsed[4].is_finite() or parsed[4] <= 0:
+        raise QuoteError("Quantity must be a positive number.", 400)
+    return parsed
+
+
+def quote_from_snapshot(snapshot, data, cache=None):
+    """
+    Calcula una cotización con los datos del snapshot de precios.
+
+    ``cache`` permite reutilizar payloads y recargos entre varias filas de un
+    mismo lote. Lanza QuoteError con el código HTTP correspondiente.
+    """
+    if cache is None:
+        cache = {}
+    quantity = data.get('quantity', 1)
+    origin_port_id, destination_port_id, container_type_id, cargo_type_id, quantity_dec = parse_quote_request(data)
+
+    def cached(kind, key, loader):
+        cache_key = (kind, key)
+        if cache_key not in cache:
+            cache[cache_key] = loader(key)
+        return cache[cache_key]
+
+    # 1. Encontrar la ruta
+    route = cached('route', (origin_port_id, destination_port_id), lambda key: snapshot.route(*key))
+    if route is None:
+        raise QuoteError("Shipping route not found or inactive.", 404)
+
+    # 2. Encontrar la tarifa base activa para la ruta y tipo de contenedor
+    rate_key = (origin_port_id, destination_port_id, container_type_id)
+    rate = cached('rate', rate_key, lambda key: snapshot.rate(*key))
+    if rate is None:
+        raise QuoteError("No active base rate found for this route and container type.", 404)
+
+    # 3. Obtener tipo de contenedor y carga
+    container_type = cached('container_type', container_type_id, snapshot.container_type)
+    if container_type is None:
+        raise QuoteError("Container type not found.", 404)
+    cargo_type = cached('cargo_type', cargo_type_id, snapshot.cargo_type)
+    if cargo_type is None:
+        raise QuoteError("Cargo type not found.", 404)
+
+    # 4. Calcular el costo total usando Decimal
+    charges = cached('charges', rate, lambda key: calculate_container_charges(*key))
+    breakdown = calculate_breakdown(rate[0], rate[1], quantity_dec, charges=charges)
+
+    return build_quote_response(
+        cached('port', origin_port_id, snapshot.port),
+        cached('port', destination_port_id, snapshot.port),
+        container_type,
+        cargo_type,
+        quantity,
+        data.get('weight_kg'),
+        data.get('volume_cbm'),
+        route['estimated_transit_days'],
+        breakdown,
+        snapshot.date,
+    )
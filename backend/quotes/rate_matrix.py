@@ -0,0 +1,169 @@
+"""
+Mantenimiento de la grilla materializada de tarifas (RateMatrixEntry).
+
+La grilla guarda, por ruta activa y tipo de contenedor, la tarifa vigente y
+el precio total por contenedor con las mismas reglas de calculate_quote.
+Los cambios en una tarifa o ruta solo recalculan las celdas afectadas; la
+reconstrucción completa se usa al cambiar de día o desde el comando
+refresh_rate_matrix.
+"""
+from datetime import date
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from shipquote_backend.database_router import pinned_to_primary
+
+from .models import ShippingRoute, BaseRate, RateMatrixEntry
+from .pricing import calculate_container_charges
+
+# Campos que refresh_cells reescribe en una celda existente
+_UPDATE_FIELDS = [
+    field.name for field in RateMatrixEntry._meta.concrete_fields
+    if field.name not in ('id', 'route', 'container_type')
+]
+
+
+def _effective_rates(today, **filters):
+    """Tarifa vigente por (ruta, contenedor); la más reciente gana, igual que calculate_quote."""
+    rates = {}
+    queryset = BaseRate.objects.filter(
+        effective_from__lte=today,
+        is_active=True,
+        route__is_active=True,
+        **filters
+    ).filter(
+        Q(effective_to__gte=today) | Q(effective_to__isnull=True)
+    ).order_by('-effective_from')
+    for rate in queryset:
+        rates.setdefault((rate.route_id, rate.container_type_id), rate)
+    return rates
+
+
+def _build_entry(route, rate, today):
+    charges = calculate_container_charges(rate.base_rate_usd, rate.fuel_surcharge_percentage)
+    origin = route.origin_port
+    return RateMatrixEntry(
+        route=route,
+        container_type_id=rate.container_type_id,
+        base_rate=rate,
+        origin_port=origin,
+        destination_port=route.destination_port,
+        origin_port_code=origin.code,
+        destination_port_code=route.destination_port.code,
+        origin_country=origin.country,
+        origin_country_code=origin.country.code,
+        origin_continent=origin.country.continent,
+        estimated_transit_days=route.estimated_transit_days,
+        base_rate_usd=charges['base_cost'],
+        fuel_surcharge_percentage=charges['fuel_surcharge_percentage'],
+        fuel_surcharge_amount=charges['fuel_surcharge_amount'],
+        handling_fee=charges['handling_fee'],
+        insurance_fee=charges['insurance_fee'],
+        documentation_fee=charges['documentation_fee'],
+        all_in_per_container=charges['per_container_cost'],
+        effective_from=rate.effective_from,
+        effective_to=rate.effective_to,
+        as_of=today,
+    )
+
+
+def _routes(**filters):
+    return ShippingRoute.objects.filter(is_active=True, **filters).select_related(
+        'origin_port__country', 'destination_port'
+    )
+
+
+@transaction.atomic
+def rebuild(today=None):
+    """Reconstruye la grilla completa. Devuelve la cantidad de celdas."""
+    today = today or date.today()
+    routes = {route.id: route for route in _routes()}
+    entries = [
+        _build_entry(routes[route_id], rate, today)
+        for (route_id, _), rate in _effective_rates(today).items()
+    ]
+    RateMatrixEntry.objects.all().delete()
+    RateMatrixEntry.objects.bulk_create(entries, batch_size=1000)
+    return len(entries)
+
+
+@transaction.atomic
+def refresh_cells(route_id, container_type_ids=None, today=None):
+    """
+    Recalcula las celdas de una ruta (opcionalmente solo algunos
+    contenedores) por conjuntos: un UPDATE para las celdas que siguen, un
+    INSERT para las nuevas y un DELETE para las que ya no tienen tarifa,
+    sin importar cuántos contenedores tenga la ruta. Las celdas conservan su id.
+    """
+    today = today or date.today()
+    existing = RateMatrixEntry.objects.filter(route_id=route_id)
+    filters = {'route_id': route_id}
+    if container_type_ids is not None:
+        existing = existing.filter(container_type_id__in=container_type_ids)
+        filters['container_type_id__in'] = container_type_ids
+
+    route = _routes(id=route_id).first()
+    rates = _effective_rates(today, **filters) if route else {}
+    current = dict(existing.values_list('container_type_id', 'id'))
+
+    now = timezone.now()
+    updated, created = [], []
+    for (_, container_type_id), rate in rates.items():
+        entry = _build_entry(route, rate, today)
+        entry.pk = current.pop(container_type_id, None)
+        if entry.pk is None:
+            created.append(entry)
+        else:
+            # bulk_update no aplica auto_now
+            entry.updated_at = now
+            updated.append(entry)
+
+    if current:
+        RateMatrixEntry.objects.filter(id__in=current.values()).delete()
+    if updated:
+        RateMatrixEntry.objects.bulk_update(updated, _UPDATE_FIELDS)
+    if created:
+        RateMatrixEntry.objects.bulk_create(created)
+
+
+@pinned_to_primary()
+def refresh_for_rate(rate_id, route_id, container_type_id):
+    """Celdas afectadas por una tarifa: su ruta/contenedor actual y donde estaba antes."""
+    cells = set(
+        RateMatrixEntry.objects.filter(base_rate_id=rate_id).values_list('route_id', 'container_type_id')
+    )
+    cells.add((route_id, container_type_id))
+    by_route = {}
+    for route_id, container_type_id in cells:
+        by_route.setdefault(route_id, []).append(container_type_id)
+    for route_id, container_type_ids in by_route.items():
+        refresh_cells(route_id, container_type_ids)
+
+
+def refresh_for_port(port):
+    """Actualiza los datos desnormalizados de un puerto y su país."""
+    country = port.country
+    RateMatrixEntry.objects.filter(origin_port=port).update(
+        origin_port_code=port.code,
+        origin_country=country,
+        origin_country_code=country.code,
+        origin_continent=country.continent,
+    )
+    RateMatrixEntry.objects.filter(destination_port=port).update(destination_port_code=port.code)
+
+
+def refresh_for_country(country):
+    RateMatrixEntry.objects.filter(origin_country=country).update(
+        origin_country_code=country.code,
+        origin_continent=country.continent,
+    )
+
+
+def ensure_current(today=None):
+    """Reconstruye la grilla si está vacía o alguna celda es de un día anterior."""
+    today = today or date.today()
+    oldest = RateMatrixEntry.objects.order_by('as_of').values_list('as_of', flat=True).first()
+    if oldest is None or oldest < today:
+        rebuild(today)
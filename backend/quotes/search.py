@@ -0,0 +1,166 @@
+"""
+Índice de búsqueda de cotizaciones (QuoteSearchToken) para ?search= de
+QuoteViewSet.
+
+Cada cotización se guarda como tokens normalizados (sin tildes, en
+minúsculas, solo letras y dígitos) de su número, cliente, email, empresa y
+nombres y códigos de los puertos, con un peso por campo. La búsqueda parte el
+texto de la misma forma y cada término es un rango sobre el índice
+(token, quote_id): "sid" encuentra "Sídney" por prefijo, sin LIKE con
+comodín inicial ni joins con los puertos. Todos los términos tienen que
+coincidir; el ranking suma los pesos de los tokens, el doble si el token es
+el término completo.
+
+El índice se actualiza al guardar una cotización o al cambiar el nombre o el
+código de un puerto (quotes/signals.py). Las cargas que no pasan por save()
+usan reindex(); el comando rebuild_quote_search lo reconstruye completo.
+"""
+import re
+import unicodedata
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, Exists, F, IntegerField, OuterRef, Q, Subquery, Sum, When
+from rest_framework.filters import SearchFilter
+
+TOKEN_LENGTH = 40
+MAX_TERMS = 8
+# Un término más corto solo coincide completo: un prefijo de una letra trae media tabla
+MIN_PREFIX_LENGTH = 2
+# Filas del índice a partir de las que un término es común (ver search())
+COMMON_TERM_ROWS = 5000
+BATCH_SIZE = 2000
+
+# Campos indexados (lookups de values()) y su peso en el ranking
+FIELDS = (
+    ('quote_number', 8),
+    ('customer_name', 4),
+    ('customer_email', 4),
+    ('customer_company', 3),
+    ('origin_port__code', 2),
+    ('destination_port__code', 2),
+    ('origin_port__name', 2),
+    ('destination_port__name', 2),
+)
+
+_TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def normalize(text):
+    """Texto sin tildes ni diacríticos y en minúsculas ("Sídney" -> "sidney")."""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def tokenize(text):
+    return [token[:TOKEN_LENGTH] for token in _TOKEN.findall(normalize(text))]
+
+
+def quote_tokens(values):
+    """{token: peso} de una cotización a partir de los valores de FIELDS."""
+    weights = {}
+    for field, weight in FIELDS:
+        for token in tokenize(values.get(field)):
+            if weights.get(token, 0) < weight:
+                weights[token] = weight
+    return weights
+
+
+def reindex(where=None, batch_size=BATCH_SIZE, on_batch=None):
+    """
+    Reemplaza los tokens de las cotizaciones que cumplen where (todas si es
+    None), por lotes de batch_size en orden de id. Devuelve la cantidad de
+    cotizaciones indexadas.
+    """
+    from .models import Quote, QuoteSearchToken
+
+    queryset = Quote.objects.order_by('pk')
+    if where is not None:
+        queryset = queryset.filter(where)
+    fields = [field for field, _ in FIELDS]
+    indexed = 0
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_id).values('pk', *fields)[:batch_size])
+        if not rows:
+            return indexed
+        ids = [row['pk'] for row in rows]
+        with transaction.atomic():
+            QuoteSearchToken.objects.filter(quote_id__in=ids).delete()
+            QuoteSearchToken.objects.bulk_create([
+                QuoteSearchToken(quote_id=row['pk'], token=token, weight=weight)
+                for row in rows for token, weight in quote_tokens(row).items()
+            ], batch_size=batch_size)
+        indexed += len(rows)
+        last_id = ids[-1]
+        if on_batch:
+            on_batch(indexed)
+
+
+def search_terms(text):
+    """Términos de búsqueda sin repetidos ni prefijos de otro término (ya implicados)."""
+    terms = list(dict.fromkeys(tokenize(text)))[:MAX_TERMS]
+    return [term for term in terms
+            if not any(other != term and other.startswith(term) for other in terms)]
+
+
+def _term_filter(term):
+    if len(term) < MIN_PREFIX_LENGTH:
+        return Q(token=term)
+    # Los tokens solo tienen [a-z0-9]: todos los que empiezan con el término caen en este rango
+    return Q(token__gte=term, token__lte=term + 'z' * (TOKEN_LENGTH - len(term)))
+
+
+def _tokens(term, **filters):
+    from .models import QuoteSearchToken
+    return QuoteSearchToken.objects.filter(_term_filter(term), **filters)
+
+
+def rank(terms, quote=OuterRef('pk')):
+    """Subquery con el ranking de una cotización (por defecto la de la consulta externa)."""
+    from .models import QuoteSearchToken
+
+    tokens = QuoteSearchToken.objects.filter(reduce(or_, [_term_filter(term) for term in terms]), quote_id=quote)
+    points = Case(When(token__in=terms, then=F('weight') * 2), default=F('weight'), output_field=IntegerField())
+    return Subquery(tokens.values('quote_id').annotate(rank=Sum(points)).values('rank').order_by())
+
+
+def search(queryset, text):
+    """
+    Filtra queryset por las cotizaciones que contienen todos los términos de
+    text. Devuelve (queryset, ordenable por ranking).
+
+    El término más raro (contado en el índice hasta COMMON_TERM_ROWS)
+    arma los candidatos y el resto se comprueba por cotización; el ranking
+    se anota solo sobre esos candidatos. Si todos los términos son comunes,
+    rankear obligaría a leer todas las coincidencias: no se anota y el
+    listado conserva su orden, que corta en la primera página.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return queryset, False
+    frequencies = {term: _tokens(term)[:COMMON_TERM_ROWS].count() for term in terms}
+    rarest = min(terms, key=frequencies.get)
+    selective = frequencies[rarest] < COMMON_TERM_ROWS
+    for term in terms:
+        if not selective or term != rarest:
+            queryset = queryset.filter(Exists(_tokens(term, quote_id=OuterRef('pk'))))
+    if not selective:
+        return queryset, False
+    queryset = queryset.filter(pk__in=_tokens(rarest).values('quote_id'))
+    return queryset.annotate(search_rank=rank(terms)), True
+
+
+class QuoteSearchFilter(SearchFilter):
+    """
+    ?search= de QuoteViewSet sobre el índice. Con resultados rankeados y sin
+    otro ordering pedido, ordena por ranking.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        queryset, ranked = search(queryset, request.query_params.get(self.search_param, ''))
+        if ranked:
+            # OrderingFilter y KeysetPagination toman view.ordering como orden por defecto
+            view.ordering = ('-search_rank', '-created_at')
+        return queryset
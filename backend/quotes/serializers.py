@@ -1,5 +1,7 @@
+from django.db import transaction
 from rest_framework import serializers
-from .models import ShippingRoute, BaseRate, Quote, QuoteItem, Port
+from .models import ShippingRoute, BaseRate, Quote, QuoteItem, RateMatrixEntry, Port
+from . import distances, rollups, totals
 from ports.serializers import PortSerializer
 from containers.serializers import ContainerTypeSerializer, CargoTypeSerializer
 from containers.models import ContainerType, CargoType  
@@ -18,7 +20,19 @@ class ShippingRouteSerializer(serializers.ModelSerializer):
     class Meta:
         model = ShippingRoute
         fields = '__all__'
-        read_only_fields = ('distance_nautical_miles', 'estimated_transit_days') # Estos podrían calcularse o ser solo de lectura
+        read_only_fields = ('distance_nautical_miles', 'estimated_transit_days') # Estimados desde la matriz de distancias
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        if self.instance is None or 'origin_port' in attrs or 'destination_port' in attrs:
+            origin = attrs.get('origin_port', getattr(self.instance, 'origin_port', None))
+            destination = attrs.get('destination_port', getattr(self.instance, 'destination_port', None))
+            estimate = distances.route_estimate(origin.pk, destination.pk)
+            if estimate is None:
+                raise serializers.ValidationError(
+                    'Both ports need latitude and longitude to estimate the route distance.')
+            attrs['distance_nautical_miles'], attrs['estimated_transit_days'] = estimate
+        return attrs
 
 class BaseRateSerializer(serializers.ModelSerializer):
     route = ShippingRouteSerializer(read_only=True)
@@ -51,6 +65,15 @@ class QuoteItemSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ('subtotal',) # Subtotal se calcula automáticamente
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.context.get('nested'):
+            # Creación anidada desde QuoteSerializer: la cotización todavía no existe
+            # y los tipos se resuelven en bloque en lugar de una consulta por item
+            self.fields.pop('quote')
+            self.fields['container_type_id'] = serializers.IntegerField(write_only=True)
+            self.fields['cargo_type_id'] = serializers.IntegerField(write_only=True)
+
 class QuoteSerializer(serializers.ModelSerializer):
     items = QuoteItemSerializer(many=True, read_only=True) # Para mostrar los items anidados
     
@@ -67,28 +90,62 @@ class QuoteSerializer(serializers.ModelSerializer):
     class Meta:
         model = Quote
         fields = '__all__'
-        read_only_fields = ('quote_number', 'total_amount', 'created_at', 'updated_at', 'created_by')
+        read_only_fields = ('quote_number', *Quote.TOTAL_FIELDS, 'created_at', 'updated_at', 'created_by')
 
-    def create(self, validated_data):
-        # Manejar la creación de QuoteItems si se envían en la misma solicitud
-        items_data = self.context['request'].data.get('items', [])
-        quote = Quote.objects.create(**validated_data)
-        for item_data in items_data:
-            # Asegúrate de que los IDs de container_type y cargo_type se manejen correctamente
-            container_type_id = item_data.pop('container_type_id')
-            cargo_type_id = item_data.pop('cargo_type_id')
-            
-            container_type = ContainerType.objects.get(id=container_type_id)
-            cargo_type = CargoType.objects.get(id=cargo_type_id)
-            
-            QuoteItem.objects.create(
-                quote=quote, 
-                container_type=container_type, 
-                cargo_type=cargo_type, 
-                **item_data
+    def validate(self, attrs):
+        # Validar los items anidados (si vienen en la solicitud) con QuoteItemSerializer
+        items_data = self.initial_data.get('items', []) if self.instance is None else []
+        if not isinstance(items_data, list):
+            raise serializers.ValidationError({'items': 'Expected a list of items.'})
+        items = QuoteItemSerializer(data=items_data, many=True, context={**self.context, 'nested': True})
+        if not items.is_valid():
+            raise serializers.ValidationError({'items': items.errors})
+
+        # Una consulta "in" por tipo, sin importar la cantidad de items
+        items_data = items.validated_data
+        container_types = ContainerType.objects.in_bulk({item['container_type_id'] for item in items_data})
+        cargo_types = CargoType.objects.in_bulk({item['cargo_type_id'] for item in items_data})
+        errors = []
+        for item in items_data:
+            error = {}
+            if item['container_type_id'] not in container_types:
+                error['container_type_id'] = ['Invalid pk - object does not exist.']
+            if item['cargo_type_id'] not in cargo_types:
+                error['cargo_type_id'] = ['Invalid pk - object does not exist.']
+            errors.append(error)
+        if any(errors):
+            raise serializers.ValidationError({'items': errors})
+
+        self._items = [
+            QuoteItem(
+                container_type=container_types[item.pop('container_type_id')],
+                cargo_type=cargo_types[item.pop('cargo_type_id')],
+                **item
             )
+            for item in items_data
+        ]
+        return attrs
+
+    def create(self, validated_data):
+        # Cotización e items en una sola transacción, con un bulk_create para los items
+        items = getattr(self, '_items', [])
+        for item in items:
+            item.calculate_subtotal()
+        with transaction.atomic():
+            # Totales calculados en memoria: bulk_create no dispara las señales de QuoteItem
+            validated_data.update(totals.summarize(items))
+            quote = Quote.objects.create(**validated_data)
+            for item in items:
+                item.quote = quote
+            QuoteItem.objects.bulk_create(items, batch_size=500)
+            rollups.items_created(quote, items)
         return quote
 
     def update(self, instance, validated_data):
         
-        return super().update(instance, validated_data)
\ No newline at end of file
+        return super().update(instance, validated_data)
+
+class RateMatrixEntrySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RateMatrixEntry
+        exclude = ('as_of', 'updated_at')
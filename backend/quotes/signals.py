@@ -0,0 +1,159 @@
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+
+from ports.models import Country, Port
+from containers.models import ContainerType, CargoType
+from .models import ShippingRoute, BaseRate, Quote, QuoteItem
+from shipquote_backend import http_cache
+
+from . import distances, rate_matrix, rollups, search, snapshot, totals
+
+PRICING_MODELS = (BaseRate, ShippingRoute, Port, Country, ContainerType, CargoType)
+
+
+def invalidate_pricing_snapshot(sender, **kwargs):
+    """Invalida el snapshot de precios cuando cambian los datos de referencia."""
+    if kwargs.get('raw'):
+        return
+    # Solo después del commit, para que la recompilación vea los datos nuevos
+    transaction.on_commit(snapshot.invalidate)
+
+
+def invalidate_http_cache(sender, **kwargs):
+    """Renueva la versión de la tabla para los ETag y la caché de respuestas."""
+    if kwargs.get('raw'):
+        return
+    http_cache.bump_on_commit(sender)
+
+
+def refresh_rate_matrix(sender, instance, **kwargs):
+    """Recalcula solo las celdas de la grilla de tarifas afectadas por el cambio."""
+    if kwargs.get('raw'):
+        return
+    if sender is BaseRate:
+        args = (instance.pk, instance.route_id, instance.container_type_id)
+        transaction.on_commit(lambda: rate_matrix.refresh_for_rate(*args))
+    elif sender is ShippingRoute:
+        route_id = instance.pk
+        transaction.on_commit(lambda: rate_matrix.refresh_cells(route_id))
+    elif sender is Port and 'created' in kwargs:
+        transaction.on_commit(lambda: rate_matrix.refresh_for_port(instance))
+    elif sender is Country and 'created' in kwargs:
+        transaction.on_commit(lambda: rate_matrix.refresh_for_country(instance))
+
+
+def update_quote_totals(sender, instance, **kwargs):
+    """Mantiene los totales de la cotización al crear, modificar o borrar items."""
+    if kwargs.get('raw'):
+        return
+    if 'created' in kwargs:
+        totals.item_saved(instance, kwargs['created'])
+    else:
+        totals.item_deleted(instance)
+
+
+def track_quote_rollups(sender, instance, **kwargs):
+    """Antes de guardar una cotización: su ruta y estado anteriores para los rollups de analytics."""
+    if kwargs.get('raw'):
+        return
+    rollups.quote_saving(instance)
+
+
+def update_quote_rollups(sender, instance, created, **kwargs):
+    """Suma la cotización nueva a los rollups, o la mueve si cambió de ruta o de estado."""
+    if kwargs.get('raw'):
+        return
+    rollups.quote_saved(instance, created)
+
+
+def discount_quote_rollups(sender, instance, **kwargs):
+    """Descuenta de los rollups la cotización que se va a borrar, con sus items."""
+    rollups.quote_deleting(instance, origin=kwargs.get('origin'))
+
+
+def track_item_rollups(sender, instance, **kwargs):
+    """Antes de guardar o borrar un item: clave y total de su cotización para los rollups."""
+    if kwargs.get('raw') or rollups.cascaded(kwargs.get('origin')):
+        return
+    rollups.item_saving(instance)
+
+
+def update_item_rollups(sender, instance, **kwargs):
+    """Aplica el alta, la modificación o la baja de un item a los rollups (después de los totales)."""
+    if kwargs.get('raw') or rollups.cascaded(kwargs.get('origin')):
+        return
+    rollups.item_saved(instance, created=kwargs.get('created', False), deleted='created' not in kwargs)
+
+
+def reindex_quote(sender, instance, **kwargs):
+    """Actualiza los tokens de búsqueda de la cotización guardada."""
+    if kwargs.get('raw'):
+        return
+    quote_id = instance.pk
+    transaction.on_commit(lambda: search.reindex(Q(pk=quote_id)))
+
+
+def track_port_changes(sender, instance, **kwargs):
+    """Guarda los valores anteriores de los campos del puerto que usan la búsqueda y las distancias."""
+    instance._previous = None
+    if kwargs.get('raw') or instance.pk is None:
+        return
+    instance._previous = Port.objects.filter(pk=instance.pk).values(
+        'name', 'code', 'latitude', 'longitude').first()
+
+
+def _port_changed(instance, fields):
+    previous = getattr(instance, '_previous', None)
+    return previous is not None and any(previous[field] != getattr(instance, field) for field in fields)
+
+
+def reindex_port_quotes(sender, instance, created, **kwargs):
+    """Reindexa las cotizaciones del puerto cuando cambió su nombre o código."""
+    if kwargs.get('raw') or created or not _port_changed(instance, ('name', 'code')):
+        return
+    port_id = instance.pk
+    transaction.on_commit(lambda: search.reindex(Q(origin_port_id=port_id) | Q(destination_port_id=port_id)))
+
+
+def update_port_distances(sender, instance, created, **kwargs):
+    """Recalcula la fila y la columna del puerto en la matriz de distancias si se agregó o se movió."""
+    if kwargs.get('raw'):
+        return
+    if created or _port_changed(instance, ('latitude', 'longitude')):
+        port_id = instance.pk
+        transaction.on_commit(lambda: distances.update_ports([port_id]))
+
+
+for model in PRICING_MODELS:
+    post_save.connect(invalidate_pricing_snapshot, sender=model,
+                      dispatch_uid=f'pricing_snapshot_save_{model._meta.label_lower}')
+    post_delete.connect(invalidate_pricing_snapshot, sender=model,
+                        dispatch_uid=f'pricing_snapshot_delete_{model._meta.label_lower}')
+    post_save.connect(invalidate_http_cache, sender=model,
+                      dispatch_uid=f'http_cache_save_{model._meta.label_lower}')
+    post_delete.connect(invalidate_http_cache, sender=model,
+                        dispatch_uid=f'http_cache_delete_{model._meta.label_lower}')
+
+for model in (BaseRate, ShippingRoute, Port, Country):
+    post_save.connect(refresh_rate_matrix, sender=model,
+                      dispatch_uid=f'rate_matrix_save_{model._meta.label_lower}')
+    post_delete.connect(refresh_rate_matrix, sender=model,
+                        dispatch_uid=f'rate_matrix_delete_{model._meta.label_lower}')
+
+post_save.connect(update_quote_totals, sender=QuoteItem, dispatch_uid='quote_totals_save')
+post_delete.connect(update_quote_totals, sender=QuoteItem, dispatch_uid='quote_totals_delete')
+
+# Los de los items van después de update_quote_totals: leen el total ya actualizado
+pre_save.connect(track_quote_rollups, sender=Quote, dispatch_uid='quote_rollups_pre_save')
+post_save.connect(update_quote_rollups, sender=Quote, dispatch_uid='quote_rollups_save')
+pre_delete.connect(discount_quote_rollups, sender=Quote, dispatch_uid='quote_rollups_delete')
+pre_save.connect(track_item_rollups, sender=QuoteItem, dispatch_uid='item_rollups_pre_save')
+pre_delete.connect(track_item_rollups, sender=QuoteItem, dispatch_uid='item_rollups_pre_delete')
+post_save.connect(update_item_rollups, sender=QuoteItem, dispatch_uid='item_rollups_save')
+post_delete.connect(update_item_rollups, sender=QuoteItem, dispatch_uid='item_rollups_delete')
+
+post_save.connect(reindex_quote, sender=Quote, dispatch_uid='quote_search_save')
+pre_save.connect(track_port_changes, sender=Port, dispatch_uid='port_changes_pre_save')
+post_save.connect(reindex_port_quotes, sender=Port, dispatch_uid='quote_search_port_save')
+post_save.connect(update_port_distances, sender=Port, dispatch_uid='distance_matrix_port_save')
@@ -0,0 +1,390 @@
+"""
+Snapshot compilado de precios para calculate_quote.
+
+Las rutas activas, las tarifas vigentes, los tipos de contenedor/carga y los
+puertos ya serializados se compilan en un archivo binario de arreglos
+ordenados. Cada worker lo mapea en memoria (mmap), de modo que todos los
+procesos comparten la misma copia y una cotización no necesita consultar la
+base de datos mientras el snapshot siga vigente.
+
+Cualquier cambio en los modelos de referencia reemplaza el token de
+generación (ver quotes/signals.py); el siguiente acceso detecta el cambio y
+recompila el archivo. Compila un solo proceso a la vez (un archivo .lock al
+lado del snapshot); mientras tanto los demás siguen sirviendo el snapshot
+anterior.
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+import uuid
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import BigIntegerField, F, Q
+from django.db.models.functions import Cast, Round
+from rest_framework.utils.encoders import JSONEncoder
+
+from shipquote_backend.database_router import pinned_to_primary
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo el lock del proceso
+    fcntl = None
+
+MAGIC = b'SQPS'
+FORMAT_VERSION = 2
+
+# magic, versión, reservado, fecha (ordinal), token de generación,
+# n_rutas, n_tarifas, n_puertos, n_contenedores, n_cargas, bytes de payloads
+_HEADER = struct.Struct('<4sHHi32s5IQ')
+_ITEM_SIZE = array('q').itemsize
+
+_lock = threading.Lock()
+_state = {'token_signature': None, 'snapshot': None}
+
+
+def _snapshot_path():
+    return settings.PRICING_SNAPSHOT_PATH
+
+
+def _token_path():
+    return _snapshot_path() + '.gen'
+
+
+@contextmanager
+def _compile_lock(blocking=True):
+    """
+    Lock de compilación entre hilos y, donde hay fcntl, entre procesos (un
+    archivo .lock al lado del snapshot). Devuelve si se obtuvo.
+    """
+    if not _lock.acquire(blocking=blocking):
+        yield False
+        return
+    try:
+        if fcntl is None:
+            yield True
+            return
+        os.makedirs(os.path.dirname(_snapshot_path()), exist_ok=True)
+        with open(_snapshot_path() + '.lock', 'a') as fh:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+    finally:
+        _lock.release()
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as fh:
+        fh.write(data)
+    os.replace(tmp_path, path)
+
+
+def _read_token():
+    try:
+        with open(_token_path(), 'rb') as fh:
+            return fh.read(32).ljust(32, b'\0')
+    except FileNotFoundError:
+        return b'\0' * 32
+
+
+def invalidate():
+    """Marca el snapshot como obsoleto para todos los workers."""
+    _write_atomic(_token_path(), uuid.uuid4().hex.encode())
+
+
+def _payload_table(rows):
+    """Convierte [(id, dict)] en (ids, offsets, bytes) ordenados por id."""
+    rows = sorted(rows, key=lambda row: row[0])
+    ids = array('q')
+    offsets = array('q', [0])
+    chunks = []
+    size = 0
+    for pk, data in rows:
+        encoded = json.dumps(data, cls=JSONEncoder, ensure_ascii=False).encode('utf-8')
+        ids.append(pk)
+        chunks.append(encoded)
+        size += len(encoded)
+        offsets.append(size)
+    return ids, offsets, b''.join(chunks)
+
+
+def _hundredths(field):
+    return Cast(Round(F(field) * 100), output_field=BigIntegerField())
+
+
+@pinned_to_primary()
+def compile_snapshot(today=None, token=None):
+    """
+    Consulta la base de datos y devuelve el snapshot serializado (bytes). Lee
+    del primario: la invalidación llega justo después del commit, antes de que
+    las réplicas lo tengan.
+
+    Se recompila entero: con 2.000 puertos y 215.000 tarifas vigentes tarda
+    unos 3 s en SQLite, casi todo en leer las filas de la base.
+    """
+    from ports.models import Port
+    from ports.serializers import PortSerializer
+    from containers.models import ContainerType, CargoType
+    from containers.serializers import ContainerTypeSerializer, CargoTypeSerializer
+    from .models import ShippingRoute, BaseRate
+
+    today = today or date.today()
+    token = token if token is not None else _read_token()
+
+    routes = sorted(
+        ShippingRoute.objects.filter(is_active=True).values_list(
+            'id', 'origin_port_id', 'destination_port_id', 'estimated_transit_days',
+            'distance_nautical_miles'
+        ),
+        key=lambda row: (row[1], row[2])
+    )
+    route_index = {row[0]: i for i, row in enumerate(routes)}
+
+    rates = {}
+    rate_rows = BaseRate.objects.filter(
+        route__is_active=True,
+        effective_from__lte=today,
+        is_active=True,
+    ).filter(
+        Q(effective_to__gte=today) | Q(effective_to__isnull=True)
+    ).order_by('route_id', 'container_type_id', '-effective_from').values_list(
+        # Importes como enteros (centavos / centésimas) desde la base: los dos
+        # campos tienen dos decimales y así no se convierte cada fila a Decimal
+        'route_id', 'container_type_id', _hundredths('base_rate_usd'), _hundredths('fuel_surcharge_percentage')
+    )
+    for route_id, container_type_id, base_cents, fuel_hundredths in rate_rows:
+        # La primera fila por ruta/contenedor es la más reciente, igual que .first();
+        # el orden es el de baserate_lookup_idx, así la base no ordena
+        # las tarifas
+        rates.setdefault((route_id, container_type_id), (base_cents, fuel_hundredths))
+
+    rate_keys = sorted(
+        (routes[route_index[route_id]][1], routes[route_index[route_id]][2], container_type_id, route_id)
+        for route_id, container_type_id in rates
+    )
+
+    port_ids = {row[1] for row in routes} | {row[2] for row in routes}
+    ports = Port.objects.filter(id__in=port_ids).select_related('country')
+    # many=True arma los campos del serializer una sola vez y no una por fila
+    port_table = _payload_table((row['id'], row) for row in PortSerializer(ports, many=True).data)
+    container_table = _payload_table(
+        (row['id'], row) for row in ContainerTypeSerializer(ContainerType.objects.all(), many=True).data
+    )
+    cargo_table = _payload_table(
+        (row['id'], row) for row in CargoTypeSerializer(CargoType.objects.all(), many=True).data
+    )
+
+    sections = [
+        array('q', (row[1] for row in routes)),
+        array('q', (row[2] for row in routes)),
+        array('q', (row[3] for row in routes)),
+        array('q', (row[4] for row in routes)),
+        array('q', (key[0] for key in rate_keys)),
+        array('q', (key[1] for key in rate_keys)),
+        array('q', (key[2] for key in rate_keys)),
+        array('q', (route_index[key[3]] for key in rate_keys)),
+        # Importes guardados como enteros (centavos / centésimas) para no perder precisión
+        array('q', (rates[(key[3], key[2])][0] for key in rate_keys)),
+        array('q', (rates[(key[3], key[2])][1] for key in rate_keys)),
+    ]
+    blob = b''
+    for ids, offsets, data in (port_table, container_table, cargo_table):
+        sections.append(ids)
+        sections.append(array('q', (offset + len(blob) for offset in offsets)))
+        blob += data
+
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, 0, today.toordinal(), token,
+        len(routes), len(rate_keys), len(port_table[0]), len(container_table[0]), len(cargo_table[0]),
+        len(blob),
+    )
+    return header + b''.join(section.tobytes() for section in sections) + blob
+
+
+def _find(columns, key):
+    """
+    Búsqueda binaria sobre columnas ordenadas lexicográficamente: acota el
+    rango columna por columna con bisect, sin armar tuplas por comparación.
+    """
+    lo, hi = 0, len(columns[0])
+    for column, value in zip(columns, key):
+        lo = bisect_left(column, value, lo, hi)
+        hi = bisect_right(column, value, lo, hi)
+        if lo == hi:
+            return None
+    return lo
+
+
+class PricingSnapshot:
+    """Vista de solo lectura sobre un snapshot compilado."""
+
+    def __init__(self, buffer):
+        view = memoryview(buffer)
+        (magic, version, _, day, token, n_routes, n_rates,
+         n_ports, n_containers, n_cargo, blob_size) = _HEADER.unpack_from(view)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Invalid pricing snapshot file.")
+        self.date = date.fromordinal(day)
+        self.token = token
+        self._buffer = buffer
+
+        offset = _HEADER.size
+        sizes = [n_routes] * 4 + [n_rates] * 6
+        for count in (n_ports, n_containers, n_cargo):
+            sizes += [count, count + 1]
+        columns = []
+        for size in sizes:
+            columns.append(view[offset:offset + size * _ITEM_SIZE].cast('q'))
+            offset += size * _ITEM_SIZE
+        self._blob = view[offset:offset + blob_size]
+
+        self._routes = columns[0:2]
+        self._route_transit_days = columns[2]
+        self._route_distance = columns[3]
+        self._rates = columns[4:7]
+        self._rate_route, self._rate_base, self._rate_fuel = columns[7:10]
+        self._ports = columns[10:12]
+        self._container_types = columns[12:14]
+        self._cargo_types = columns[14:16]
+
+    @property
+    def route_count(self):
+        return len(self._route_transit_days)
+
+    @property
+    def rate_count(self):
+        return len(self._rate_base)
+
+    def _payload(self, table, pk):
+        ids, offsets = table
+        index = _find((ids,), (pk,))
+        if index is None:
+            return None
+        return json.loads(bytes(self._blob[offsets[index]:offsets[index + 1]]))
+
+    def route(self, origin_port_id, destination_port_id):
+        """Devuelve {'estimated_transit_days': n} para una ruta activa o None."""
+        index = _find(self._routes, (origin_port_id, destination_port_id))
+        if index is None:
+            return None
+        return {'estimated_transit_days': self._route_transit_days[index]}
+
+    def rate(self, origin_port_id, destination_port_id, container_type_id):
+        """Tarifa vigente (base_rate_usd, fuel_surcharge_percentage) como Decimal, o None."""
+        index = _find(self._rates, (origin_port_id, destination_port_id, container_type_id))
+        if index is None:
+            return None
+        return Decimal(self._rate_base[index]) / 100, Decimal(self._rate_fuel[index]) / 100
+
+    def iter_routes(self):
+        """(origin_port_id, destination_port_id, transit_days, distance) de cada ruta activa."""
+        origins, destinations = self._routes
+        for i in range(len(origins)):
+            yield origins[i], destinations[i], self._route_transit_days[i], self._route_distance[i]
+
+    def iter_rates(self):
+        """(origin_port_id, destination_port_id, container_type_id, base, fuel%) vigentes."""
+        origins, destinations, container_types = self._rates
+        for i in range(len(origins)):
+            yield (origins[i], destinations[i], container_types[i],
+                   Decimal(self._rate_base[i]) / 100, Decimal(self._rate_fuel[i]) / 100)
+
+    def port(self, port_id):
+        return self._payload(self._ports, port_id)
+
+    def container_type(self, container_type_id):
+        return self._payload(self._container_types, container_type_id)
+
+    def cargo_type(self, cargo_type_id):
+        return self._payload(self._cargo_types, cargo_type_id)
+
+
+def _map_file(path):
+    try:
+        with open(path, 'rb') as fh:
+            return PricingSnapshot(mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ))
+    except (FileNotFoundError, ValueError, struct.error):
+        return None
+
+
+def _token_signature():
+    try:
+        stat = os.stat(_token_path())
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _is_current(snapshot, token, today):
+    return snapshot is not None and snapshot.token == token and snapshot.date == today
+
+
+def current_snapshot():
+    """
+    El snapshot vigente si no hace falta recompilarlo, o None. No espera a
+    una recompilación en curso (para el event loop, ver async_views.py).
+    """
+    today = date.today()
+    signature = _token_signature()
+    snapshot = _state['snapshot']
+    if snapshot is not None and signature == _state['token_signature'] and snapshot.date == today:
+        return snapshot
+    if not _lock.acquire(blocking=False):
+        return None
+    try:
+        # Otro proceso puede haberlo recompilado ya
+        snapshot = _map_file(_snapshot_path())
+        if not _is_current(snapshot, _read_token(), today):
+            return None
+        _state.update(token_signature=signature, snapshot=snapshot)
+        return snapshot
+    finally:
+        _lock.release()
+
+
+def latest_snapshot():
+    """
+    El último snapshot del proceso (o el del archivo), aunque esté
+    desactualizado, o None si todavía no hay ninguno. No compila ni espera.
+    """
+    return _state['snapshot'] or _map_file(_snapshot_path())
+
+
+def get_snapshot():
+    """
+    Devuelve el snapshot vigente. En estado estable solo hace un stat() del
+    archivo de generación; recompila cuando cambió el token o el día. Si otro
+    hilo o proceso ya está recompilando devuelve el snapshot anterior sin
+    esperar; solo espera cuando no hay ninguno.
+    """
+    today = date.today()
+    signature = _token_signature()
+    snapshot = _state['snapshot']
+    if snapshot is not None and signature == _state['token_signature'] and snapshot.date == today:
+        return snapshot
+
+    previous = snapshot or _map_file(_snapshot_path())
+    with _compile_lock(blocking=previous is None) as acquired:
+        if not acquired:
+            return previous
+        token = _read_token()
+        snapshot = _map_file(_snapshot_path())
+        if not _is_current(snapshot, token, today):
+            _write_atomic(_snapshot_path(), compile_snapshot(today=today, token=token))
+            snapshot = _map_file(_snapshot_path())
+        _state.update(token_signature=signature, snapshot=snapshot)
+    return snapshot
@@ -0,0 +1,441 @@
+"""
+Importación masiva de tarifas (BaseRate) desde planillas CSV o XLSX.
+
+Las filas se leen en streaming y se procesan en lotes: puertos, tipos de
+contenedor y rutas se resuelven con diccionarios cargados una sola vez, las
+rutas que faltan se crean en bloque y las tarifas se insertan o actualizan
+(clave: ruta, tipo de contenedor y effective_from) con bulk_create y un
+UPDATE por id en executemany, todo dentro de una transacción. Las filas inválidas o con
+vigencias superpuestas no se importan y quedan en el reporte de errores.
+
+Las operaciones en bloque no disparan señales: al confirmar se invalidan el
+snapshot de precios, la grilla de tarifas y las versiones de la caché HTTP.
+
+Columnas: origin_port, destination_port (códigos de puerto), container_type
+(id, nombre o tamaño+tipo, p. ej. "40HC REEFER"), base_rate_usd,
+effective_from y opcionalmente fuel_surcharge_percentage,
+currency_adjustment_factor, effective_to, is_active,
+distance_nautical_miles y estimated_transit_days (obligatorias si la ruta
+no existe).
+"""
+import codecs
+import csv
+import re
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from ports.models import Port
+from containers.models import ContainerType
+from shipquote_backend import http_cache
+from .models import ShippingRoute, BaseRate
+from . import rate_matrix, snapshot
+
+REQUIRED_COLUMNS = ('origin_port', 'destination_port', 'container_type', 'base_rate_usd', 'effective_from')
+OPTIONAL_COLUMNS = (
+    'fuel_surcharge_percentage', 'currency_adjustment_factor', 'effective_to', 'is_active',
+    'distance_nautical_miles', 'estimated_transit_days',
+)
+BATCH_SIZE = 5000
+# Tamaño de las listas "IN" (SQL Server admite hasta 2100 parámetros por consulta)
+IN_CHUNK = 1000
+RATE_FIELDS = ('base_rate_usd', 'fuel_surcharge_percentage', 'currency_adjustment_factor', 'effective_to', 'is_active')
+
+# Errores que se guardan en el reporte de una importación por API
+MAX_REPORTED_ERRORS = 1000
+PROGRESS_KEY = 'tariff_import:{}'
+PROGRESS_TIMEOUT = 24 * 60 * 60
+
+# (máximo de dígitos, decimales) de los campos de BaseRate
+DECIMAL_LIMITS = {
+    'base_rate_usd': (10, 2),
+    'fuel_surcharge_percentage': (5, 2),
+    'currency_adjustment_factor': (5, 4),
+}
+TRUE_VALUES = {'1', 'true', 'yes', 'si', 'sí', 'y', 's'}
+FALSE_VALUES = {'0', 'false', 'no', 'n'}
+
+
+class ImportFormatError(Exception):
+    """El archivo no se puede leer como planilla de tarifas."""
+
+
+def _normalize(value):
+    return re.sub(r"[\s\-_'/]+", '', str(value)).lower()
+
+
+def _chunks(values, size=IN_CHUNK):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _csv_rows(file):
+    reader = csv.reader(codecs.iterdecode(file, 'utf-8-sig'))
+    yield from reader
+
+
+def _xlsx_rows(file):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportFormatError('XLSX files require the openpyxl package; upload a CSV file instead.')
+    # read_only lee la hoja en streaming, sin cargarla entera en memoria
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            yield ['' if value is None else value for value in row]
+    finally:
+        workbook.close()
+
+
+def read_rows(file, filename):
+    """Filas de la planilla como (número de fila, {columna: valor}), en streaming."""
+    name = filename.lower()
+    if name.endswith('.csv'):
+        rows = _csv_rows(file)
+    elif name.endswith('.xlsx'):
+        rows = _xlsx_rows(file)
+    else:
+        raise ImportFormatError('Unsupported file type; expected .csv or .xlsx.')
+
+    try:
+        header = [str(column).strip().lower().replace(' ', '_') for column in next(rows)]
+    except StopIteration:
+        raise ImportFormatError('The file is empty.')
+    missing = [column for column in REQUIRED_COLUMNS if column not in header]
+    if missing:
+        raise ImportFormatError(f"Missing required columns: {', '.join(missing)}.")
+
+    for number, values in enumerate(rows, start=2):
+        if not any(str(value).strip() for value in values):
+            continue
+        yield number, dict(zip(header, values))
+
+
+class TariffImporter:
+    """
+    Importa filas de tarifas en lotes. on_progress(stats) se llama después de
+    cada lote y on_error(error) por cada fila rechazada, con
+    error = {'row': número, 'errors': {columna: [mensajes]}}.
+
+    Con supersede=True, una tarifa vigente sin fecha de fin que empieza antes
+    que una tarifa importada se cierra el día anterior, en lugar de reportar
+    la superposición.
+    """
+
+    def __init__(self, supersede=False, batch_size=BATCH_SIZE, on_progress=None, on_error=None):
+        self.supersede = supersede
+        self.batch_size = batch_size
+        self.on_progress = on_progress
+        self.on_error = on_error
+        self.stats = dict.fromkeys(
+            ('rows', 'created', 'updated', 'unchanged', 'closed', 'routes_created', 'routes_updated', 'errors'), 0
+        )
+
+    def _load_lookups(self):
+        self.ports = dict(Port.objects.values_list('code', 'id'))
+        self.ports.update({code.upper(): pk for code, pk in self.ports.items()})
+        self.container_types = {}
+        for pk, name, size, type_ in ContainerType.objects.values_list('id', 'name', 'size', 'type'):
+            for key in {str(pk), _normalize(name), _normalize(f'{size}{type_}')}:
+                # Un alias compartido por dos tipos no sirve para identificarlos
+                self.container_types[key] = pk if self.container_types.get(key, pk) == pk else None
+        # Rutas nuevas que una fila anterior ya definió (se crean con su lote)
+        self.new_lanes = set()
+        self.routes = {
+            (origin, destination): [pk, distance, transit]
+            for pk, origin, destination, distance, transit in ShippingRoute.objects.values_list(
+                'id', 'origin_port_id', 'destination_port_id', 'distance_nautical_miles', 'estimated_transit_days'
+            )
+        }
+
+    def run(self, rows, dry_run=False):
+        """Importa todas las filas en una transacción. Devuelve las estadísticas."""
+        with transaction.atomic():
+            self._load_lookups()
+            batch = []
+            for number, raw in rows:
+                self.stats['rows'] += 1
+                parsed = self._parse(number, raw)
+                if parsed is not None:
+                    batch.append(parsed)
+                if len(batch) >= self.batch_size:
+                    self._process(batch)
+                    batch = []
+                    self._progress()
+            if batch:
+                self._process(batch)
+            self._progress()
+
+            if dry_run:
+                transaction.set_rollback(True)
+            elif self.stats['created'] or self.stats['updated'] or self.stats['routes_created'] \
+                    or self.stats['routes_updated']:
+                transaction.on_commit(refresh_derived_data)
+        return self.stats
+
+    def _progress(self):
+        if self.on_progress:
+            self.on_progress(dict(self.stats))
+
+    def _error(self, number, errors):
+        self.stats['errors'] += 1
+        if self.on_error:
+            self.on_error({'row': number, 'errors': errors})
+
+    def _decimal(self, value, field, errors, default=None):
+        if value in ('', None):
+            if default is None:
+                errors[field] = ['This field is required.']
+            return default
+        max_digits, places = DECIMAL_LIMITS[field]
+        try:
+            number = Decimal(str(value).strip()).quantize(Decimal(1).scaleb(-places))
+        except InvalidOperation:
+            errors[field] = ['A valid number is required.']
+            return None
+        if number < 0 or len(number.as_tuple().digits) > max_digits:
+            errors[field] = [f'Ensure this value is between 0 and {10 ** (max_digits - places)}.']
+            return None
+        return number
+
+    def _date(self, value, field, errors, required=True):
+        if isinstance(value, datetime):
+            return value.date()
+        if isinstance(value, date):
+            return value
+        if value in ('', None):
+            if required:
+                errors[field] = ['This field is required.']
+            return None
+        try:
+            return date.fromisoformat(str(value).strip()[:10])
+        except ValueError:
+            errors[field] = ['Date has wrong format. Use YYYY-MM-DD.']
+            return None
+
+    def _integer(self, value, field, errors):
+        if value in ('', None):
+            return None
+        try:
+            number = int(Decimal(str(value).strip()))
+        except (InvalidOperation, ValueError):
+            errors[field] = ['A valid integer is required.']
+            return None
+        if number <= 0:
+            errors[field] = ['Ensure this value is greater than 0.']
+            return None
+        return number
+
+    def _parse(self, number, raw):
+        """Fila validada y con ids resueltos, o None (y el error reportado)."""
+        errors = {}
+        origin = self.ports.get(str(raw.get('origin_port', '')).strip().upper())
+        if origin is None:
+            errors['origin_port'] = ['Unknown port code.']
+        destination = self.ports.get(str(raw.get('destination_port', '')).strip().upper())
+        if destination is None:
+            errors['destination_port'] = ['Unknown port code.']
+        elif destination == origin:
+            errors['destination_port'] = ['Origin and destination must be different.']
+        container_type = self.container_types.get(_normalize(raw.get('container_type', '')))
+        if container_type is None:
+            errors['container_type'] = ['Unknown or ambiguous container type.']
+
+        row = {
+            'number': number,
+            'lane': (origin, destination),
+            'container_type_id': container_type,
+            'base_rate_usd': self._decimal(raw.get('base_rate_usd'), 'base_rate_usd', errors),
+            'fuel_surcharge_percentage': self._decimal(
+                raw.get('fuel_surcharge_percentage'), 'fuel_surcharge_percentage', errors, Decimal('0')),
+            'currency_adjustment_factor': self._decimal(
+                raw.get('currency_adjustment_factor'), 'currency_adjustment_factor', errors, Decimal('1')),
+            'effective_from': self._date(raw.get('effective_from'), 'effective_from', errors),
+            'effective_to': self._date(raw.get('effective_to'), 'effective_to', errors, required=False),
+            'distance_nautical_miles': self._integer(
+                raw.get('distance_nautical_miles'), 'distance_nautical_miles', errors),
+            'estimated_transit_days': self._integer(
+                raw.get('estimated_transit_days'), 'estimated_transit_days', errors),
+        }
+        is_active = str(raw.get('is_active', '')).strip().lower()
+        if is_active in ('', *TRUE_VALUES):
+            row['is_active'] = True
+        elif is_active in FALSE_VALUES:
+            row['is_active'] = False
+        else:
+            errors['is_active'] = ['Must be a valid boolean.']
+        if row['effective_from'] and row['effective_to'] and row['effective_to'] < row['effective_from']:
+            errors['effective_to'] = ['Must be on or after effective_from.']
+        if not errors and row['lane'] not in self.routes and row['lane'] not in self.new_lanes:
+            if row['distance_nautical_miles'] is None or row['estimated_transit_days'] is None:
+                errors['route'] = ['distance_nautical_miles and estimated_transit_days are required for new routes.']
+            else:
+                self.new_lanes.add(row['lane'])
+
+        if errors:
+            self._error(number, errors)
+            return None
+        return row
+
+    def _upsert_routes(self, batch):
+        """Crea las rutas que faltan y actualiza distancia/tránsito de las existentes."""
+        new_routes = {}
+        changed = {}
+        for row in batch:
+            lane = row['lane']
+            distance, transit = row['distance_nautical_miles'], row['estimated_transit_days']
+            if lane not in self.routes:
+                new_routes.setdefault(lane, ShippingRoute(
+                    origin_port_id=lane[0], destination_port_id=lane[1],
+                    distance_nautical_miles=distance, estimated_transit_days=transit,
+                ))
+            elif distance is not None and transit is not None and self.routes[lane][1:] != [distance, transit]:
+                self.routes[lane][1:] = [distance, transit]
+                changed[lane] = ShippingRoute(id=self.routes[lane][0], distance_nautical_miles=distance,
+                                              estimated_transit_days=transit)
+        if new_routes:
+            ShippingRoute.objects.bulk_create(new_routes.values(), batch_size=1000)
+            self.stats['routes_created'] += len(new_routes)
+            if any(route.pk is None for route in new_routes.values()):
+                # El backend no devuelve los ids del insert en bloque: se leen de nuevo
+                for origins in _chunks({lane[0] for lane in new_routes}):
+                    for pk, origin, destination in ShippingRoute.objects.filter(
+                            origin_port_id__in=origins).values_list('id', 'origin_port_id', 'destination_port_id'):
+                        if (origin, destination) in new_routes:
+                            new_routes[(origin, destination)].pk = pk
+            for lane, route in new_routes.items():
+                self.routes[lane] = [route.pk, route.distance_nautical_miles, route.estimated_transit_days]
+        if changed:
+            ShippingRoute.objects.bulk_update(
+                changed.values(), ['distance_nautical_miles', 'estimated_transit_days'], batch_size=1000
+            )
+            self.stats['routes_updated'] += len(changed)
+
+    def _existing_rates(self, route_ids, container_type_ids):
+        rates = {}
+        for chunk in _chunks(route_ids):
+            queryset = BaseRate.objects.filter(route_id__in=chunk, container_type_id__in=container_type_ids)
+            for rate in queryset.only('id', 'route_id', 'container_type_id', 'effective_from', *RATE_FIELDS):
+                rates.setdefault((rate.route_id, rate.container_type_id), []).append(rate)
+        return rates
+
+    def _process(self, batch):
+        self._upsert_routes(batch)
+
+        # Filas por tarifa (ruta, contenedor); una clave repetida en el lote queda con la última fila
+        lanes = {}
+        for row in batch:
+            row['route_id'] = self.routes[row['lane']][0]
+            key = (row['route_id'], row['container_type_id'])
+            rows = lanes.setdefault(key, {})
+            if row['effective_from'] in rows:
+                self._error(rows[row['effective_from']]['number'],
+                            {'effective_from': ['Superseded by a later row with the same rate key.']})
+            rows[row['effective_from']] = row
+
+        existing = self._existing_rates({key[0] for key in lanes}, {key[1] for key in lanes})
+        to_create, to_update, closed = [], {}, set()
+        for key, rows in lanes.items():
+            by_start = {rate.effective_from: rate for rate in existing.get(key, ())}
+            # Períodos vigentes: [inicio, fin, fila importada o None, tarifa existente o None]
+            periods = {
+                rate.effective_from: [rate.effective_from, rate.effective_to, None, rate]
+                for rate in existing.get(key, ()) if rate.is_active
+            }
+            for start, row in rows.items():
+                periods.pop(start, None)
+                if row['is_active']:
+                    periods[start] = [start, row['effective_to'], row, by_start.get(start)]
+
+            accepted = []
+            for period in sorted(periods.values(), key=lambda period: period[0]):
+                previous = accepted[-1] if accepted else None
+                if previous and self.supersede and previous[1] is None and previous[2] is None \
+                        and period[2] is not None:
+                    previous[1] = period[0] - timedelta(days=1)
+                    rate = previous[3]
+                    rate.effective_to = previous[1]
+                    to_update[rate.pk] = rate
+                    closed.add(rate.pk)
+                if previous and (previous[1] is None or previous[1] >= period[0]):
+                    rejected = period if period[2] is not None else previous
+                    if rejected[2] is None:
+                        # Superposición ya existente en la base: no es de esta planilla
+                        accepted.append(period)
+                        continue
+                    self._error(rejected[2]['number'], {'effective_from': [
+                        'Overlaps another active rate for this route and container type.'
+                    ]})
+                    rows.pop(rejected[0])
+                    if rejected is previous:
+                        accepted[-1] = period
+                    continue
+                accepted.append(period)
+
+            for start, row in rows.items():
+                rate = by_start.get(start)
+                if rate is None:
+                    to_create.append(BaseRate(
+                        route_id=key[0], container_type_id=key[1], effective_from=start,
+                        **{field: row[field] for field in RATE_FIELDS}
+                    ))
+                elif any(getattr(rate, field) != row[field] for field in RATE_FIELDS):
+                    for field in RATE_FIELDS:
+                        setattr(rate, field, row[field])
+                    to_update[rate.pk] = rate
+                else:
+                    self.stats['unchanged'] += 1
+
+        if to_create:
+            BaseRate.objects.bulk_create(to_create, batch_size=1000)
+            self.stats['created'] += len(to_create)
+        if to_update:
+            _update_rates(to_update.values())
+            updated = {pk for pk in to_update if pk not in closed}
+            self.stats['updated'] += len(updated)
+            self.stats['closed'] += len(closed)
+
+
+def _update_rates(rates):
+    """
+    UPDATE por id con executemany: bulk_update arma un CASE por campo y fila,
+    que con decenas de miles de filas cuesta más compilar que ejecutar.
+    """
+    fields = [BaseRate._meta.get_field(name) for name in RATE_FIELDS]
+    quote = connection.ops.quote_name
+    sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+        quote(BaseRate._meta.db_table),
+        ', '.join(f'{quote(field.column)} = %s' for field in fields),
+        quote(BaseRate._meta.pk.column),
+    )
+    params = [
+        [field.get_db_prep_save(getattr(rate, field.attname), connection) for field in fields] + [rate.pk]
+        for rate in rates
+    ]
+    with connection.cursor() as cursor:
+        for chunk in _chunks(params):
+            cursor.executemany(sql, chunk)
+
+
+def refresh_derived_data():
+    """Datos derivados de las tarifas, que las operaciones en bloque no actualizan por señales."""
+    snapshot.invalidate()
+    rate_matrix.rebuild()
+    http_cache.bump(BaseRate, ShippingRoute)
+
+
+def save_progress(import_id, **values):
+    """Estado de una importación, consultable desde otros requests y workers."""
+    progress = cache.get(PROGRESS_KEY.format(import_id)) or {'id': import_id}
+    progress.update(values, updated_at=time.time())
+    cache.set(PROGRESS_KEY.format(import_id), progress, timeout=PROGRESS_TIMEOUT)
+    return progress
+
+
+def get_progress(import_id):
+    return cache.get(PROGRESS_KEY.format(import_id))
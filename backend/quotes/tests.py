@@ -1,3 +1,1848 @@
-from django.test import TestCase
+import asyncio
+import base64
+import contextvars
+import datetime
+import io
+import json
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+from decimal import Decimal
+from unittest import mock, skipIf
 
-# Create your tests here.
+import numpy
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, transaction
+from django.db.models import Q
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from openpyxl import Workbook
+from rest_framework.test import APIClient
+
+from shipquote_backend.database_router import (
+    PIN_COOKIE, DatabaseRouter, ReplicaLagMonitor, ReplicaRoutingMiddleware, reset_routing_stats, routing_scope,
+    routing_stats,
+)
+from shipquote_backend.db_backends.sqlite3.base import DatabaseWrapper as PooledSQLiteWrapper
+from shipquote_backend.db_pool import ConnectionPool
+from shipquote_backend import sql_instrumentation, structured_logging
+from ports.models import Country, Port
+from containers.models import ContainerType, CargoType
+from .models import (
+    ShippingRoute, BaseRate, Quote, QuoteItem, QuoteItemRollup, QuoteNumberSequence, QuoteRollup, QuoteSearchToken,
+    RateMatrixEntry,
+)
+from .numbering import QuoteNumberAllocator, format_number
+from .pricing import MAX_BATCH_SIZE
+from .serializers import QuoteSerializer
+from . import (
+    async_views, benchmarks, distances, expiry, rate_matrix, rollups, routing, search, snapshot, tariff_import,
+    totals,
+)
+
+
+def create_ports():
+    country = Country.objects.create(name='Chile', code='CHL', continent='América del Sur')
+    origin = Port.objects.create(name='Puerto de Valparaíso', code='CLVAP', country=country, city='Valparaíso')
+    destination = Port.objects.create(name='Puerto de San Antonio', code='CLSAI', country=country, city='San Antonio')
+    return origin, destination
+
+
+def quote_data(origin, destination, **extra):
+    data = {
+        'customer_name': 'Cliente de prueba',
+        'customer_email': 'cliente@example.com',
+        'origin_port': origin,
+        'destination_port': destination,
+        'total_amount': Decimal('0'),
+        'valid_until': timezone.now() + datetime.timedelta(days=7),
+    }
+    data.update(extra)
+    return data
+
+
+class QuoteNumberAllocatorTests(TestCase):
+    def setUp(self):
+        self.origin, self.destination = create_ports()
+
+    def test_keeps_number_format(self):
+        quote = Quote.objects.create(**quote_data(self.origin, self.destination))
+        self.assertRegex(quote.quote_number, r'^SQ\d{8}\d{4}$')
+        self.assertTrue(quote.quote_number.startswith(f"SQ{datetime.date.today():%Y%m%d}"))
+
+    def test_reserves_blocks_instead_of_counting(self):
+        allocator = QuoteNumberAllocator(block_size=10)
+        day = datetime.date(2030, 1, 1)
+        numbers = [allocator.next_number(day) for _ in range(25)]
+        self.assertEqual(numbers, [format_number(day, n) for n in range(1, 26)])
+        self.assertEqual(QuoteNumberSequence.objects.get(day=day).last_value, 30)
+
+    def test_workers_get_disjoint_blocks(self):
+        day = datetime.date(2030, 1, 2)
+        first, second = QuoteNumberAllocator(block_size=5), QuoteNumberAllocator(block_size=5)
+        numbers = [first.next_number(day), second.next_number(day), first.next_number(day)]
+        self.assertEqual(len(set(numbers)), 3)
+
+    def test_continues_after_existing_quotes(self):
+        day = datetime.date(2030, 1, 3)
+        Quote.objects.create(**quote_data(self.origin, self.destination, quote_number=format_number(day, 42)))
+        self.assertEqual(QuoteNumberAllocator().next_number(day), format_number(day, 43))
+
+    def test_initial_value_only_when_counter_is_created(self):
+        day = datetime.date(2030, 1, 5)
+        allocator = QuoteNumberAllocator(block_size=2)
+        with mock.patch.object(allocator, '_initial_value', wraps=allocator._initial_value) as initial_value:
+            numbers = [allocator.next_number(day) for _ in range(5)]
+        self.assertEqual(initial_value.call_count, 1)
+        self.assertEqual(numbers, [format_number(day, n) for n in range(1, 6)])
+
+    def test_committed_blocks_are_pooled_without_gaps(self):
+        day = datetime.date(2030, 1, 6)
+        allocator = QuoteNumberAllocator(block_size=5)
+        # Dos transacciones concurrentes confirman los restos de sus bloques provisorios
+        allocator._release({'day': day, 'block': [2, 5]})
+        allocator._release({'day': day, 'block': [7, 10]})
+        numbers = [allocator.next_number(day) for _ in range(8)]
+        self.assertEqual(sorted(numbers), [format_number(day, n) for n in (2, 3, 4, 5, 7, 8, 9, 10)])
+
+    def test_rolled_back_block_is_not_reused(self):
+        day = datetime.date(2030, 1, 4)
+        allocator, other = QuoteNumberAllocator(block_size=5), QuoteNumberAllocator(block_size=5)
+        try:
+            with transaction.atomic():
+                allocator.next_number(day)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        # La reserva se revirtió: otro worker recibe el mismo rango y este no debe repetirlo
+        taken = other.next_number(day)
+        self.assertNotEqual(allocator.next_number(day), taken)
+
+
+class QuoteNumberConcurrencyTests(TransactionTestCase):
+    workers = 4
+    threads_per_worker = 2
+    quotes_per_thread = 50
+
+    def test_parallel_inserts_have_no_collisions(self):
+        origin, destination = create_ports()
+        # Cada asignador simula un proceso distinto que comparte el contador diario
+        allocators = [QuoteNumberAllocator(block_size=10) for _ in range(self.workers)]
+        write_lock = threading.Lock()
+        errors = []
+
+        def insert(allocator):
+            try:
+                for _ in range(self.quotes_per_thread):
+                    # SQLite en memoria no admite escritores concurrentes; en SQL Server corren en paralelo
+                    with write_lock if connection.vendor == 'sqlite' else nullcontext():
+                        with transaction.atomic():
+                            number = allocator.next_number()
+                            Quote.objects.create(**quote_data(origin, destination, quote_number=number))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=insert, args=(allocator,))
+            for allocator in allocators
+            for _ in range(self.threads_per_worker)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        total = self.workers * self.threads_per_worker * self.quotes_per_thread
+        self.assertEqual(errors, [])
+        day = datetime.date.today()
+        issued = [int(number[-4:]) for number in Quote.objects.values_list('quote_number', flat=True)]
+        self.assertEqual(len(issued), total)
+        self.assertEqual(len(set(issued)), total)
+        # Sin huecos: lo reservado en el contador está emitido o sigue en el pool de algún asignador
+        pooled = [
+            value
+            for allocator in allocators
+            for start, end in allocator._blocks.get(day, [])
+            for value in range(start, end + 1)
+        ]
+        last_value = QuoteNumberSequence.objects.get(day=day).last_value
+        self.assertEqual(sorted(issued + pooled), list(range(1, last_value + 1)))
+
+
+def create_pricing_data(ports=4):
+    """Países, puertos, tipos, rutas con tarifas y cotizaciones con items."""
+    countries = [
+        Country.objects.create(name=f'País {i}', code=f'P{i:02d}', continent='Asia' if i % 2 else 'Europa')
+        for i in range(ports)
+    ]
+    port_list = [
+        Port.objects.create(name=f'Puerto {i}', code=f'PT{i:03d}', country=countries[i], city=f'Ciudad {i}',
+                            latitude=Decimal(i), longitude=Decimal(-i))
+        for i in range(ports)
+    ]
+    container_types = [
+        ContainerType.objects.create(name=f'Contenedor {size}', size=size, type='DRY', max_weight=28000,
+                                     internal_length=5.89, internal_width=2.35, internal_height=2.39, volume=33.2)
+        for size in ('20', '40')
+    ]
+    cargo_types = [CargoType.objects.create(name=f'Carga {i}') for i in range(2)]
+    today = datetime.date.today()
+    for i, origin in enumerate(port_list):
+        for destination in port_list[i + 1:]:
+            route = ShippingRoute.objects.create(origin_port=origin, destination_port=destination,
+                                                 distance_nautical_miles=1000, estimated_transit_days=10)
+            for container_type in container_types:
+                BaseRate.objects.create(route=route, container_type=container_type, base_rate_usd=Decimal('1000'),
+                                        fuel_surcharge_percentage=Decimal('10'), effective_from=today)
+    for i in range(ports):
+        quote = Quote.objects.create(**quote_data(port_list[i], port_list[-1 - i]))
+        for j in range(3):
+            QuoteItem.objects.create(quote=quote, container_type=container_types[j % 2], cargo_type=cargo_types[j % 2],
+                                     quantity=1, weight_kg=100, volume_cbm=10, base_rate=1000)
+    return port_list, container_types, cargo_types
+
+
+class PricingSnapshotTests(TestCase):
+    """calculate_quote responde desde el snapshot y ve cada cambio de precios apenas se confirma."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(PRICING_SNAPSHOT_PATH=os.path.join(directory.name, 'snapshot.bin'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.client = APIClient()
+        self.ports, self.container_types, self.cargo_types = create_pricing_data(ports=3)
+        self.route = ShippingRoute.objects.get(origin_port=self.ports[0], destination_port=self.ports[1])
+        self.payload = {
+            'origin_port_id': self.ports[0].pk, 'destination_port_id': self.ports[1].pk,
+            'container_type_id': self.container_types[0].pk, 'cargo_type_id': self.cargo_types[0].pk,
+            'quantity': 2, 'weight_kg': 1000, 'volume_cbm': 10,
+        }
+
+    def calculate(self):
+        return self.client.post('/api/v1/calculate_quote/', self.payload, format='json')
+
+    def change(self, action):
+        """Aplica el cambio y corre los on_commit, como al confirmar la transacción."""
+        with self.captureOnCommitCallbacks(execute=True):
+            action()
+        return self.calculate()
+
+    def test_warm_snapshot_needs_no_queries(self):
+        self.assertEqual(self.calculate().status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.calculate()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['breakdown']['base_rate_per_container'], 1000.0)
+
+    def test_saves_invalidate_snapshot(self):
+        rate = BaseRate.objects.get(route=self.route, container_type=self.container_types[0])
+        country, port = self.ports[0].country, self.ports[0]
+        container_type, cargo_type = self.container_types[0], self.cargo_types[0]
+
+        def update(instance, **fields):
+            def action():
+                for name, value in fields.items():
+                    setattr(instance, name, value)
+                instance.save()
+            return action
+
+        cases = [
+            (update(rate, base_rate_usd=Decimal('1500')), lambda q: q['breakdown']['base_rate_per_container'], 1500.0),
+            (update(self.route, estimated_transit_days=25), lambda q: q['estimated_transit_days'], 25),
+            (update(port, name='Puerto renombrado'), lambda q: q['origin_port']['name'], 'Puerto renombrado'),
+            (update(country, name='País renombrado'), lambda q: q['origin_port']['country']['name'], 'País renombrado'),
+            (update(container_type, name='Contenedor nuevo'), lambda q: q['container_type']['name'],
+             'Contenedor nuevo'),
+            (update(cargo_type, name='Carga nueva'), lambda q: q['cargo_type']['name'], 'Carga nueva'),
+        ]
+        self.assertEqual(self.calculate().status_code, 200)
+        for action, field, expected in cases:
+            response = self.change(action)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(field(response.json()), expected)
+
+    def test_deletes_invalidate_snapshot(self):
+        # Cada borrado deja sin precio a la solicitud (directamente o en cascada)
+        deletions = [
+            lambda: BaseRate.objects.get(route=self.route, container_type=self.container_types[0]).delete(),
+            lambda: self.route.delete(),
+            lambda: self.ports[0].delete(),
+            lambda: self.ports[0].country.delete(),
+            lambda: self.container_types[0].delete(),
+            lambda: self.cargo_types[0].delete(),
+        ]
+        for delete in deletions:
+            with self.subTest(delete=delete), transaction.atomic():
+                self.assertEqual(self.calculate().status_code, 200)
+                self.assertEqual(self.change(delete).status_code, 404)
+                transaction.set_rollback(True)
+            # Al deshacer el borrado se vuelve a invalidar, como haría cualquier otra escritura
+            snapshot.invalidate()
+
+
+    @skipIf(snapshot.fcntl is None, 'sin fcntl no hay lock entre procesos')
+    def test_rebuild_in_another_process_serves_the_previous_snapshot(self):
+        self.assertEqual(self.calculate().status_code, 200)
+        BaseRate.objects.filter(route=self.route).update(base_rate_usd=Decimal('1500'))
+        snapshot.invalidate()
+        # Otro proceso tiene el lock de compilación: se responde con el anterior, sin consultas
+        with open(settings.PRICING_SNAPSHOT_PATH + '.lock', 'a') as fh:
+            snapshot.fcntl.flock(fh, snapshot.fcntl.LOCK_EX)
+            with self.assertNumQueries(0):
+                response = self.calculate()
+            self.assertEqual(response.json()['breakdown']['base_rate_per_container'], 1000.0)
+            snapshot.fcntl.flock(fh, snapshot.fcntl.LOCK_UN)
+        self.assertEqual(self.calculate().json()['breakdown']['base_rate_per_container'], 1500.0)
+
+    @skipIf(snapshot.fcntl is None, 'sin fcntl no hay lock entre procesos')
+    def test_without_a_previous_snapshot_waits_for_the_rebuild(self):
+        snapshot._state.update(token_signature=None, snapshot=None)
+        compiled = snapshot.compile_snapshot()
+        results = []
+        with mock.patch.object(snapshot, 'compile_snapshot', return_value=compiled) as compile_snapshot, \
+                open(settings.PRICING_SNAPSHOT_PATH + '.lock', 'a') as fh:
+            snapshot.fcntl.flock(fh, snapshot.fcntl.LOCK_EX)
+            worker = threading.Thread(target=lambda: results.append(snapshot.get_snapshot()))
+            worker.start()
+            worker.join(0.2)
+            self.assertTrue(worker.is_alive())
+            snapshot.fcntl.flock(fh, snapshot.fcntl.LOCK_UN)
+            worker.join(5)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(compile_snapshot.call_count, 1)
+        self.assertEqual(results[0].rate_count, 3 * 2)
+
+
+class BatchQuoteTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(PRICING_SNAPSHOT_PATH=os.path.join(directory.name, 'snapshot.bin'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.client = APIClient()
+        self.ports, self.container_types, self.cargo_types = create_pricing_data(ports=3)
+
+    def row(self, origin, destination, container_type=0, **extra):
+        return dict({
+            'origin_port_id': self.ports[origin].pk, 'destination_port_id': self.ports[destination].pk,
+            'container_type_id': self.container_types[container_type].pk, 'cargo_type_id': self.cargo_types[0].pk,
+            'quantity': 1, 'weight_kg': 1000, 'volume_cbm': 10,
+        }, **extra)
+
+    def post(self, payload):
+        return self.client.post('/api/v1/calculate_quotes_batch/', payload, format='json')
+
+    def test_rows_match_single_quotes_in_input_order(self):
+        rows = [self.row(1, 2, quantity=3), self.row(0, 1, 1), self.row(0, 2), self.row(1, 2, quantity=3)]
+        self.post([])  # compila el snapshot
+        with self.assertNumQueries(0):
+            response = self.post({'requests': rows})
+        self.assertEqual(response.status_code, 200)
+        payload = response.json()
+        self.assertEqual(payload['count'], len(rows))
+        self.assertEqual([result['index'] for result in payload['results']], list(range(len(rows))))
+        for row, result in zip(rows, payload['results']):
+            single = self.client.post('/api/v1/calculate_quote/', row, format='json')
+            self.assertEqual(result, {'index': result['index'], 'status': 200, 'quote': single.json()})
+
+    def test_errors_are_reported_per_row(self):
+        rows = [
+            self.row(0, 1),
+            self.row(2, 0),  # solo hay rutas de i a j > i
+            'no es un objeto',
+            self.row(0, 1, quantity='x'),
+            self.row(0, 1, container_type_id=10 ** 9),
+            {'origin_port_id': self.ports[0].pk},
+            self.row(0, 2),
+        ]
+        results = self.post(rows).json()['results']
+        self.assertEqual([(result['index'], result['status']) for result in results],
+                         [(0, 200), (1, 404), (2, 400), (3, 400), (4, 404), (5, 400), (6, 200)])
+        self.assertEqual(results[1]['error'], 'Shipping route not found or inactive.')
+        self.assertEqual(results[5]['error'], 'Missing required parameters.')
+        self.assertNotIn('quote', results[1])
+
+    def test_quantity_must_be_a_positive_number(self):
+        quantities = ['NaN', 'Infinity', '-Infinity', '-2', 0, '1.5']
+        response = self.post([self.row(0, 1, quantity=quantity) for quantity in quantities])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], [400, 400, 400, 400, 400, 200])
+        self.assertEqual(results[0]['error'], 'Quantity must be a positive number.')
+        single = self.client.post('/api/v1/calculate_quote/', self.row(0, 1, quantity='NaN'), format='json')
+        self.assertEqual((single.status_code, single.json()['error']), (400, 'Quantity must be a positive number.'))
+
+    def test_rejects_oversized_batches(self):
+        response = self.post([self.row(0, 1)] * (MAX_BATCH_SIZE + 1))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], f'A batch can contain at most {MAX_BATCH_SIZE} requests.')
+        self.assertEqual(self.post([self.row(0, 1)] * MAX_BATCH_SIZE).status_code, 200)
+        self.assertEqual(self.post({'requests': 'x'}).status_code, 400)
+
+
+class RateMatrixTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.ports, self.container_types, self.cargo_types = create_pricing_data(ports=3)
+        self.route = ShippingRoute.objects.get(origin_port=self.ports[0], destination_port=self.ports[1])
+
+    def rows(self, query=''):
+        response = self.client.get(f'/api/v1/rate-matrix/{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def cell(self, container_type=None):
+        return RateMatrixEntry.objects.get(route=self.route, container_type=container_type or self.container_types[0])
+
+    def test_lists_all_in_price_per_cell(self):
+        rows = self.rows()
+        self.assertEqual(len(rows), 3 * 2)
+        row = next(row for row in rows if row['route'] == self.route.pk and
+                   row['container_type'] == self.container_types[0].pk)
+        self.assertEqual(Decimal(str(row['all_in_per_container'])), Decimal('1161'))  # 1000 + 10% + 50 + 1%
+        self.assertEqual((row['origin_port_code'], row['destination_port_code']), ('PT000', 'PT001'))
+
+    def test_filters_and_ordering(self):
+        self.rows()
+        self.assertEqual({row['origin_port'] for row in self.rows(f'?origin_port={self.ports[0].pk}')},
+                         {self.ports[0].pk})
+        self.assertEqual(len(self.rows(f'?container_type={self.container_types[1].pk}')), 3)
+        self.assertEqual(len(self.rows('?origin_country_code=P01')), 2)
+        self.assertEqual(len(self.rows('?origin_continent=Europa')), 4)  # solo el puerto 0 tiene rutas de salida
+        BaseRate.objects.filter(route=self.route, container_type=self.container_types[0]).update(
+            base_rate_usd=Decimal('3000'))
+        rate_matrix.refresh_cells(self.route.pk)
+        self.assertEqual(self.rows('?ordering=-all_in_per_container')[0]['id'], self.cell().pk)
+
+    def test_rate_change_refreshes_its_cell_in_place(self):
+        self.rows()
+        cell, other = self.cell(), self.cell(self.container_types[1])
+        rate = BaseRate.objects.get(route=self.route, container_type=self.container_types[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            rate.base_rate_usd = Decimal('2000')
+            rate.save()
+        refreshed = self.cell()
+        self.assertEqual(refreshed.pk, cell.pk)
+        self.assertEqual(refreshed.base_rate_usd, Decimal('2000'))
+        self.assertEqual(refreshed.all_in_per_container, Decimal('2272'))
+        self.assertEqual(RateMatrixEntry.objects.get(pk=other.pk).updated_at, other.updated_at)
+
+        # Una tarifa más reciente reemplaza a la anterior; sin tarifa vigente la celda desaparece
+        today = datetime.date.today()
+        BaseRate.objects.filter(pk=rate.pk).update(effective_from=today - datetime.timedelta(days=30))
+        with self.captureOnCommitCallbacks(execute=True):
+            newer = BaseRate.objects.create(route=self.route, container_type=self.container_types[0],
+                                            base_rate_usd=Decimal('1500'), fuel_surcharge_percentage=Decimal('0'),
+                                            effective_from=today)
+        self.assertEqual(self.cell().base_rate_id, newer.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            newer.delete()
+        self.assertEqual(self.cell().base_rate_id, rate.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            rate.is_active = False
+            rate.save()
+        self.assertFalse(RateMatrixEntry.objects.filter(route=self.route, container_type=self.container_types[0]))
+
+    def test_refresh_is_set_based(self):
+        rate_matrix.rebuild()
+
+        def queries():
+            with CaptureQueriesContext(connection) as captured:
+                rate_matrix.refresh_cells(self.route.pk)
+            return len(captured)
+
+        before = queries()
+        for size in ('45', '53', '60'):
+            container_type = ContainerType.objects.create(
+                name=f'Contenedor {size}', size='40', type='DRY', max_weight=28000, internal_length=5.89,
+                internal_width=2.35, internal_height=2.39, volume=33.2)
+            BaseRate.objects.create(route=self.route, container_type=container_type, base_rate_usd=Decimal('900'),
+                                    fuel_surcharge_percentage=Decimal('5'), effective_from=datetime.date.today())
+        self.assertEqual(queries(), before + 1)  # el INSERT de las celdas nuevas
+        self.assertEqual(RateMatrixEntry.objects.filter(route=self.route).count(), 5)
+        self.assertEqual(queries(), before)
+
+    def test_port_and_country_changes_update_denormalized_columns(self):
+        self.rows()
+        port, country = self.ports[0], self.ports[0].country
+        with self.captureOnCommitCallbacks(execute=True):
+            port.code = 'NEW00'
+            port.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            country.code = 'N00'
+            country.continent = 'Oceanía'
+            country.save()
+        self.assertEqual(set(RateMatrixEntry.objects.filter(origin_port=port).values_list(
+            'origin_port_code', 'origin_country_code', 'origin_continent')), {('NEW00', 'N00', 'Oceanía')})
+        destination = self.ports[1]
+        with self.captureOnCommitCallbacks(execute=True):
+            destination.code = 'NEW01'
+            destination.save()
+        self.assertEqual(set(RateMatrixEntry.objects.filter(destination_port=destination).values_list(
+            'destination_port_code', flat=True)), {'NEW01'})
+        self.assertEqual(len(self.rows('?origin_country_code=N00')), 4)
+
+
+class ItineraryTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(PRICING_SNAPSHOT_PATH=os.path.join(directory.name, 'snapshot.bin'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        engine = mock.patch.object(routing, 'engine', routing.RoutingEngine())
+        engine.start()
+        self.addCleanup(engine.stop)
+
+        self.client = APIClient()
+        self.ports, self.container_types, _ = create_pricing_data(ports=4)
+        # Directo caro pero rápido; por transbordo (dos tramos de 1.161) más barato y más lento
+        self.direct = ShippingRoute.objects.get(origin_port=self.ports[0], destination_port=self.ports[3])
+        ShippingRoute.objects.filter(pk=self.direct.pk).update(estimated_transit_days=5)
+        BaseRate.objects.filter(route=self.direct).update(base_rate_usd=Decimal('4000'))
+
+    def post(self, **extra):
+        payload = dict({
+            'origin_port_id': self.ports[0].pk, 'destination_port_id': self.ports[3].pk,
+            'container_type_id': self.container_types[0].pk, 'quantity': 2,
+        }, **extra)
+        return self.client.post('/api/v1/calculate_itineraries/', payload, format='json')
+
+    def test_cheapest_and_fastest(self):
+        response = self.post(k=2, max_hops=2)
+        self.assertEqual(response.status_code, 200)
+        payload = response.json()
+        self.assertEqual(payload['origin_port']['code'], 'PT000')
+        self.assertEqual(payload['container_type']['id'], self.container_types[0].pk)
+
+        cheapest = payload['cheapest'][0]
+        self.assertEqual(cheapest['hops'], 2)
+        self.assertEqual(cheapest['cost_per_container'], 2322.0)
+        self.assertEqual(cheapest['estimated_transit_days'], 20)
+        self.assertEqual(cheapest['total_quote_amount'], 2322.0 * 2 + 25)
+        self.assertEqual([leg['origin_port_id'] for leg in cheapest['legs']], cheapest['port_ids'][:-1])
+
+        fastest = payload['fastest'][0]
+        self.assertEqual(fastest['port_ids'], [self.ports[0].pk, self.ports[3].pk])
+        self.assertEqual(fastest['estimated_transit_days'], 5)
+        self.assertEqual(len(payload['fastest']), 2)
+
+    def test_hop_limit(self):
+        payload = self.post(max_hops=1).json()
+        self.assertEqual([itinerary['hops'] for itinerary in payload['cheapest']], [1])
+        self.assertEqual(max(itinerary['hops'] for itinerary in self.post(max_hops=3, k=10).json()['cheapest']), 3)
+
+    def test_invalid_parameters(self):
+        for extra in ({'origin_port_id': None}, {'k': 0}, {'max_hops': 0}, {'k': 'x'}, {'max_hops': -1},
+                      {'quantity': 'NaN'}, {'container_type_id': 'x'}):
+            with self.subTest(extra=extra):
+                self.assertEqual(self.post(**extra).status_code, 400)
+        # k y max_hops por encima del máximo se recortan
+        response = self.post(k=1000, max_hops=1000)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(response.json()['cheapest']), routing.MAX_ITINERARIES)
+
+    def test_not_found(self):
+        cases = [
+            {'origin_port_id': self.ports[3].pk, 'destination_port_id': self.ports[0].pk},  # sin rutas de vuelta
+            {'container_type_id': 10 ** 9},
+            {'origin_port_id': 10 ** 9},
+            {'destination_port_id': self.ports[0].pk},
+        ]
+        for extra in cases:
+            with self.subTest(extra=extra):
+                response = self.post(**extra)
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json()['error'], 'No itinerary found for this route and container type.')
+
+    def test_one_graph_per_request(self):
+        with mock.patch.object(routing.engine, 'refresh', wraps=routing.engine.refresh) as refresh:
+            self.assertEqual(self.post().status_code, 200)
+        self.assertEqual(refresh.call_count, 1)
+
+    def test_rate_change_reaches_cached_itineraries(self):
+        self.assertEqual(self.post().json()['fastest'][0]['cost_per_container'], 4494.0)  # 4.000 + 10% + 50 + 1%
+        with self.captureOnCommitCallbacks(execute=True):
+            rate = BaseRate.objects.get(route=self.direct, container_type=self.container_types[0])
+            rate.base_rate_usd = Decimal('1000')
+            rate.save()
+        payload = self.post().json()
+        self.assertEqual(payload['cheapest'][0]['port_ids'], [self.ports[0].pk, self.ports[3].pk])
+        self.assertEqual(payload['fastest'][0]['cost_per_container'], 1161.0)
+
+
+class NestedQuoteCreateTests(TestCase):
+    """Creación de la cotización con sus items: validación en bloque, bulk_create y una sola transacción."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.ports, self.container_types, self.cargo_types = create_pricing_data()
+
+    def payload(self, items):
+        return {
+            'customer_name': 'Cliente', 'customer_email': 'cliente@example.com',
+            'origin_port_id': self.ports[0].id, 'destination_port_id': self.ports[1].id,
+            'valid_until': '2030-01-01T00:00:00Z',
+            'items': items,
+        }
+
+    def item(self, i=0, **extra):
+        return dict({
+            'container_type_id': self.container_types[i % 2].id, 'cargo_type_id': self.cargo_types[0].id,
+            'quantity': 1, 'weight_kg': '10', 'volume_cbm': '1', 'base_rate': '100',
+        }, **extra)
+
+    def test_quote_create_is_constant_in_items(self):
+        def create(items):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/api/v1/quotes/', self.payload([self.item(i) for i in range(items)]),
+                                            format='json')
+            self.assertEqual(response.status_code, 201, response.content)
+            self.assertEqual(len(response.json()['items']), items)
+            return len(queries)
+
+        # Reserva el bloque de números del día y crea las filas de rollup de los dos tipos
+        create(2)
+        self.assertEqual(create(2), create(40))
+
+    def test_subtotals_match_item_save(self):
+        extra = {'quantity': 3, 'base_rate': '1250.50', 'fuel_surcharge': '125.05', 'handling_fee': '50',
+                 'insurance_fee': '13.76', 'documentation_fee': '25'}
+        response = self.client.post('/api/v1/quotes/', self.payload([self.item(**extra)]), format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        created = QuoteItem.objects.get(quote_id=response.json()['id'])
+
+        saved = QuoteItem(quote=created.quote, container_type=self.container_types[0], cargo_type=self.cargo_types[0],
+                          weight_kg=10, volume_cbm=1, **extra)
+        saved.save()
+        saved.refresh_from_db()
+        self.assertEqual(created.subtotal, saved.subtotal)
+        self.assertEqual(Decimal(str(response.json()['items'][0]['subtotal'])), saved.subtotal)
+
+    def test_invalid_items_write_nothing(self):
+        quotes = Quote.objects.count()
+        for items, field in (([self.item(), self.item(quantity=None)], 'quantity'),
+                             ([self.item(), self.item(container_type_id=10 ** 9)], 'container_type_id')):
+            response = self.client.post('/api/v1/quotes/', self.payload(items), format='json')
+            self.assertEqual(response.status_code, 400)
+            errors = response.json()['items']
+            self.assertEqual(errors[0], {})
+            self.assertIn(field, errors[1])
+        self.assertEqual(Quote.objects.count(), quotes)
+
+    def test_failed_item_insert_rolls_back_the_quote(self):
+        quotes = Quote.objects.count()
+        serializer = QuoteSerializer(data=self.payload([self.item(), self.item(1)]))
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with mock.patch.object(QuoteItem.objects, 'bulk_create', side_effect=OperationalError('disk I/O error')):
+            with self.assertRaises(OperationalError):
+                serializer.save()
+        self.assertEqual(Quote.objects.count(), quotes)
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Presupuesto de consultas por endpoint: las lecturas deben cargar todo el
+    grafo de relaciones con una cantidad fija de consultas, sin importar
+    cuántas filas devuelvan.
+    """
+    # endpoint: (consultas en el listado, consultas en el detalle)
+    budgets = {
+        '/api/v1/shipping-routes/': (2, 1),
+        '/api/v1/base-rates/': (1, 1),
+        '/api/v1/quotes/': (2, 2),
+        '/api/v1/quote-items/': (1, 1),
+    }
+
+    def setUp(self):
+        self.client = APIClient()
+        self.ports, self.container_types, self.cargo_types = create_pricing_data()
+
+    def assertQueryBudget(self, url, budget):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        self.assertLessEqual(len(queries), budget, f"{url}: {[q['sql'] for q in queries]}")
+        return response
+
+    def test_list_and_detail_budgets(self):
+        for url, (list_budget, detail_budget) in self.budgets.items():
+            response = self.assertQueryBudget(url, list_budget)
+            pk = response.json()['results'][0]['id']
+            self.assertQueryBudget(f'{url}{pk}/', detail_budget)
+
+    def test_budget_does_not_grow_with_rows(self):
+        for i in range(5):
+            quote = Quote.objects.create(**quote_data(self.ports[0], self.ports[1]))
+            for _ in range(4):
+                QuoteItem.objects.create(quote=quote, container_type=self.container_types[1],
+                                         cargo_type=self.cargo_types[0], quantity=2, weight_kg=1, volume_cbm=1,
+                                         base_rate=1)
+        for url, (list_budget, _) in self.budgets.items():
+            self.assertQueryBudget(url, list_budget)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.origin, self.destination = origin, destination = create_ports()
+        for _ in range(7):
+            Quote.objects.create(**quote_data(origin, destination))
+        # Mismo created_at para todas: el desempate por id debe mantener el orden estable
+        Quote.objects.update(created_at=timezone.now())
+
+    def test_walks_every_row_once_without_count(self):
+        seen = []
+        url = '/api/v1/quotes/?page_size=2'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertFalse(any('COUNT(' in q['sql'].upper() for q in queries))
+            payload = response.json()
+            self.assertNotIn('count', payload)
+            seen += [quote['id'] for quote in payload['results']]
+            url = payload['next']
+        self.assertEqual(seen, list(Quote.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def walk(self, url, link='next'):
+        """Ids de todas las páginas siguiendo los enlaces next (o previous)."""
+        seen, pages = [], []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(any('OFFSET' in q['sql'].upper() for q in queries))
+            payload = response.json()
+            pages.append(payload)
+            seen += [quote['id'] for quote in payload['results']]
+            url = payload[link]
+        return seen, pages
+
+    def test_ties_across_page_boundaries(self):
+        for i in range(60):
+            Quote.objects.create(**quote_data(self.origin, self.destination, total_amount=Decimal(i % 3)))
+        # Muchas filas con el mismo valor de orden a ambos lados de cada corte de página
+        Quote.objects.filter(pk__in=list(Quote.objects.values_list('pk', flat=True)[:50])).update(
+            created_at=timezone.now() - datetime.timedelta(days=1))
+
+        for ordering, expected in (
+                ('', Quote.objects.order_by('-created_at', '-id')),
+                ('&ordering=total_amount', Quote.objects.order_by('total_amount', 'id')),
+                ('&ordering=-total_amount', Quote.objects.order_by('-total_amount', '-id'))):
+            expected = list(expected.values_list('id', flat=True))
+            seen, pages = self.walk(f'/api/v1/quotes/?page_size=7{ordering}')
+            self.assertEqual(seen, expected, ordering)
+            # Volviendo con previous desde la última página se recorren las mismas páginas
+            back, _ = self.walk(pages[-1]['previous'], link='previous')
+            self.assertEqual(back, [pk for page in pages[-2::-1] for pk in (q['id'] for q in page['results'])])
+
+    def test_invalid_cursor(self):
+        for cursor in ('x', 'eyJwIjoxfQ', 'eyJwIjpbMV19'):  # no base64, p no es lista, p incompleta
+            self.assertEqual(self.client.get(f'/api/v1/quotes/?cursor={cursor}').status_code, 404)
+        # Valores que no corresponden al tipo de los campos del orden
+        for position in (['abc', 1], [timezone.now().isoformat(), 'x'], [None, 1], [[1], 1]):
+            cursor = base64.urlsafe_b64encode(json.dumps({'p': position}).encode()).decode()
+            self.assertEqual(self.client.get(f'/api/v1/quotes/?cursor={cursor}').status_code, 404, position)
+        cursor = base64.urlsafe_b64encode(json.dumps({'p': ['abc', 1]}).encode()).decode()
+        response = self.client.get(f'/api/v1/quotes/?ordering=total_amount&cursor={cursor}')
+        self.assertEqual(response.status_code, 404)
+
+    def test_optional_count(self):
+        payload = self.client.get('/api/v1/quotes/?count=true').json()
+        self.assertEqual(payload['count'], 7)
+        payload = self.client.get('/api/v1/quotes/?count=true&status=SENT').json()
+        self.assertEqual((payload['count'], payload['count_is_estimate']), (0, False))
+
+
+class QuoteTotalsTests(TestCase):
+    def setUp(self):
+        self.ports, self.container_types, self.cargo_types = create_pricing_data(ports=2)
+        self.quote = Quote.objects.create(**quote_data(self.ports[0], self.ports[1]))
+
+    def add_item(self, **extra):
+        values = {'quote': self.quote, 'container_type': self.container_types[0], 'cargo_type': self.cargo_types[0],
+                  'quantity': 2, 'weight_kg': Decimal('100'), 'volume_cbm': Decimal('10'),
+                  'base_rate': Decimal('1000'), 'documentation_fee': Decimal('25')}
+        values.update(extra)
+        return QuoteItem.objects.create(**values)
+
+    def assertTotalsMatchItems(self):
+        stored = Quote.objects.values(*Quote.TOTAL_FIELDS).get(pk=self.quote.pk)
+        totals.recompute([self.quote.pk])
+        self.assertEqual(stored, Quote.objects.values(*Quote.TOTAL_FIELDS).get(pk=self.quote.pk))
+        return stored
+
+    def test_documentation_fee_is_charged_once(self):
+        self.add_item()
+        self.add_item(quantity=3)
+        stored = self.assertTotalsMatchItems()
+        self.assertEqual(stored['item_count'], 2)
+        self.assertEqual(stored['total_weight_kg'], Decimal('200'))
+        self.assertEqual(stored['total_amount'], Decimal('1000') * 5 + Decimal('25'))
+
+    def test_update_and_delete_apply_differences(self):
+        first, second = self.add_item(), self.add_item(documentation_fee=Decimal('40'))
+        item = QuoteItem.objects.get(pk=first.pk)
+        item.quantity = 4
+        item.volume_cbm = Decimal('12.5')
+        with CaptureQueriesContext(connection) as queries:
+            item.save()
+        # Item y totales; la clave y el total de la cotización antes y después, y las dos filas de rollup
+        self.assertEqual(len(queries), 6)
+        self.assertTotalsMatchItems()
+
+        second.delete()
+        stored = self.assertTotalsMatchItems()
+        self.assertEqual((stored['item_count'], stored['documentation_fee']), (1, Decimal('25')))
+        QuoteItem.objects.get(pk=first.pk).delete()
+        self.assertEqual(self.assertTotalsMatchItems()['total_amount'], Decimal('0'))
+
+    def test_stale_quote_save_keeps_totals(self):
+        stale = Quote.objects.get(pk=self.quote.pk)
+        self.add_item()
+        stale.notes = 'Actualizada'
+        stale.save()
+        self.assertEqual(self.assertTotalsMatchItems()['item_count'], 1)
+
+    def test_bulk_create_through_api(self):
+        payload = {
+            'customer_name': 'Cliente', 'customer_email': 'cliente@example.com',
+            'origin_port_id': self.ports[0].id, 'destination_port_id': self.ports[1].id,
+            'valid_until': '2030-01-01T00:00:00Z',
+            'items': [{
+                'container_type_id': self.container_types[0].id, 'cargo_type_id': self.cargo_types[0].id,
+                'quantity': 2, 'weight_kg': '10', 'volume_cbm': '1', 'base_rate': '100', 'documentation_fee': '25',
+            } for _ in range(3)],
+        }
+        response = APIClient().post('/api/v1/quotes/', payload, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['total_amount'], '625.00')
+        self.quote = Quote.objects.get(pk=response.json()['id'])
+        self.assertEqual(self.assertTotalsMatchItems()['item_count'], 3)
+
+
+class FixedLagMonitor(ReplicaLagMonitor):
+    """Réplicas locales de prueba con un retraso fijo (None = caída)."""
+
+    def __init__(self, lags, max_lag=5):
+        super().__init__(max_lag=max_lag, interval=0)
+        self.lags = lags
+
+    def measure(self, alias):
+        return self.lags[alias]
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        reset_routing_stats()
+        self.monitor = FixedLagMonitor({'replica_1': 0, 'replica_2': 1, 'replica_3': 30})
+        self.router = DatabaseRouter(replicas=['replica_1', 'replica_2', 'replica_3'], monitor=self.monitor)
+
+    def test_round_robin_skips_lagging_replicas(self):
+        reads = {self.router.db_for_read(Quote) for _ in range(6)}
+        self.assertEqual(reads, {'replica_1', 'replica_2'})
+        self.assertEqual(routing_stats()[('replica_1', 'replica')] + routing_stats()[('replica_2', 'replica')], 6)
+
+    def test_falls_back_to_primary_when_every_replica_lags(self):
+        self.monitor.lags = {'replica_1': None, 'replica_2': 10, 'replica_3': 30}
+        self.assertEqual(self.router.db_for_read(Port), 'default')
+        self.assertEqual(routing_stats(), {('default', 'replica_lag'): 1})
+
+    def test_reads_after_a_write_stay_on_primary(self):
+        with routing_scope() as scope:
+            self.assertNotEqual(self.router.db_for_read(Quote), 'default')
+            self.assertEqual(self.router.db_for_write(Quote), 'default')
+            self.assertEqual(self.router.db_for_read(Quote), 'default')
+        self.assertTrue(scope['wrote'])
+        self.assertIn(('default', 'read_your_writes'), routing_stats())
+
+    def test_replicas_are_not_migrated(self):
+        self.assertTrue(self.router.allow_migrate('default', 'quotes'))
+        self.assertFalse(self.router.allow_migrate('replica_1', 'quotes'))
+
+    def test_middleware_pins_client_after_a_write(self):
+        def write_view(request):
+            self.router.db_for_write(Quote)
+            return HttpResponse()
+
+        def read_view(request):
+            return HttpResponse(self.router.db_for_read(Quote))
+
+        factory = RequestFactory()
+        with override_settings(DATABASE_REPLICAS=self.router.replicas):
+            response = ReplicaRoutingMiddleware(write_view)(factory.post('/'))
+            self.assertIn(PIN_COOKIE, response.cookies)
+            factory.cookies[PIN_COOKIE] = response.cookies[PIN_COOKIE].value
+            response = ReplicaRoutingMiddleware(read_view)(factory.get('/'))
+        self.assertEqual((response.content, response['X-Database-Reads']), (b'default', 'default'))
+
+
+@override_settings(DATABASE_REPLICAS=['default'])
+class ReplicaRoutingRequestTests(TransactionTestCase):
+    """La réplica es un alias local de la base de tests (como TEST MIRROR)."""
+
+    def test_quote_create_reads_its_own_write(self):
+        origin, destination = create_ports()
+        client = APIClient()
+        reset_routing_stats()
+        response = client.post('/api/v1/quotes/', {
+            'customer_name': 'Cliente', 'customer_email': 'cliente@example.com',
+            'origin_port_id': origin.id, 'destination_port_id': destination.id,
+            'valid_until': '2030-01-01T00:00:00Z',
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertIn(('default', 'read_your_writes'), routing_stats())
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        reset_routing_stats()
+        client.get('/api/v1/quotes/')
+        self.assertEqual(set(reason for _, reason in routing_stats()), {'read_your_writes'})
+        client.cookies.clear()
+        reset_routing_stats()
+        client.get('/api/v1/quotes/')
+        self.assertEqual(set(reason for _, reason in routing_stats()), {'replica'})
+
+
+def sqlite_connection():
+    return sqlite3.connect(':memory:', check_same_thread=False)
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def test_reuses_released_connections(self):
+        pool = ConnectionPool('test', max_size=2)
+        first = pool.acquire(sqlite_connection)
+        pool.release(first)
+        self.assertIs(pool.acquire(sqlite_connection), first)
+        self.assertEqual((pool.stats()['created'], pool.stats()['reused'], pool.stats()['in_use']), (1, 1, 1))
+
+    def test_waits_for_a_free_connection_and_times_out(self):
+        pool = ConnectionPool('test', max_size=1, timeout=0.05)
+        held = pool.acquire(sqlite_connection)
+        with self.assertRaises(OperationalError):
+            pool.acquire(sqlite_connection)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+        pool.timeout = 5
+        acquired = []
+        waiter = threading.Thread(target=lambda: acquired.append(pool.acquire(sqlite_connection)))
+        waiter.start()
+        time.sleep(0.05)
+        pool.release(held)
+        waiter.join()
+        self.assertEqual(acquired, [held])
+
+    def test_discards_broken_and_expired_connections(self):
+        pool = ConnectionPool('test', max_size=2, ping_after=0)
+        broken = pool.acquire(sqlite_connection)
+        pool.release(broken)
+        broken.close()  # el servidor cerró la conexión mientras estaba libre
+        self.assertIsNot(pool.acquire(sqlite_connection), broken)
+        self.assertEqual(pool.stats()['discarded'], 1)
+
+        pool.recycle = 0
+        pool.release(pool.acquire(sqlite_connection))
+        self.assertEqual(pool.stats()['idle'], 0)
+
+    def test_django_connections_return_to_the_pool(self):
+        directory = tempfile.mkdtemp()
+        wrapper = PooledSQLiteWrapper({
+            'ENGINE': 'shipquote_backend.db_backends.sqlite3', 'NAME': os.path.join(directory, 'pool.sqlite3'),
+            'OPTIONS': {}, 'POOL': {'MAX_SIZE': 2}, 'AUTOCOMMIT': True, 'ATOMIC_REQUESTS': False,
+            'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'TIME_ZONE': None,
+            'USER': '', 'PASSWORD': '', 'HOST': '', 'PORT': '', 'TEST': {},
+        }, alias='pool_test')
+        with wrapper.cursor() as cursor:
+            cursor.execute('CREATE TABLE sample (value integer)')
+        raw = wrapper.connection
+        wrapper.close()
+
+        # Una transacción sin confirmar se revierte al devolver la conexión
+        wrapper.set_autocommit(False)
+        with wrapper.cursor() as cursor:
+            cursor.execute('INSERT INTO sample VALUES (1)')
+        self.assertIs(wrapper.connection, raw)
+        wrapper.close()
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM sample')
+            self.assertEqual(cursor.fetchone(), (0,))
+        wrapper.close()
+        self.assertEqual((wrapper.pool.stats()['created'], wrapper.pool.stats()['reused']), (1, 2))
+        wrapper.pool.close_idle()
+
+
+class DatabaseStatsTests(TestCase):
+    def test_only_staff_can_read_stats(self):
+        client = APIClient()
+        self.assertEqual(client.get('/api/v1/database-stats/').status_code, 403)
+        client.force_authenticate(User.objects.create_user('admin', is_staff=True))
+        payload = client.get('/api/v1/database-stats/').json()
+        self.assertEqual(set(payload), {'pools', 'routing'})
+
+
+def rate_sheet(*lines):
+    header = 'origin_port,destination_port,container_type,base_rate_usd,effective_from,effective_to,' \
+             'distance_nautical_miles,estimated_transit_days'
+    return io.BytesIO('\n'.join([header, *lines]).encode())
+
+
+class TariffImportTests(TestCase):
+    def setUp(self):
+        self.origin, self.destination = create_ports()
+        self.container_type = ContainerType.objects.create(
+            name='Contenedor 40', size='40', type='DRY', max_weight=28000,
+            internal_length=12.03, internal_width=2.35, internal_height=2.39, volume=67.7,
+        )
+
+    def run_import(self, sheet, **options):
+        errors = []
+        stats = tariff_import.TariffImporter(on_error=errors.append, **options).run(
+            tariff_import.read_rows(sheet, 'tarifas.csv')
+        )
+        return stats, errors
+
+    def test_creates_routes_and_rates_and_reports_row_errors(self):
+        stats, errors = self.run_import(rate_sheet(
+            'CLVAP,CLSAI,40DRY,1500.00,2025-01-01,2025-06-30,60,1',
+            'CLVAP,CLSAI,Contenedor 40,1600,2025-07-01,,,',
+            'CLVAP,XXXXX,40DRY,1500,2025-01-01,,60,1',
+            'CLSAI,CLVAP,40DRY,abc,2025-01-01,,60,1',
+            'CLSAI,CLVAP,40DRY,100,2025-01-01,,,',
+        ))
+        self.assertEqual((stats['rows'], stats['created'], stats['routes_created'], stats['errors']), (5, 2, 1, 3))
+        self.assertEqual([error['row'] for error in errors], [4, 5, 6])
+        self.assertIn('destination_port', errors[0]['errors'])
+        self.assertIn('base_rate_usd', errors[1]['errors'])
+        self.assertIn('route', errors[2]['errors'])
+        route = ShippingRoute.objects.get()
+        self.assertEqual(route.distance_nautical_miles, 60)
+        self.assertEqual(
+            list(BaseRate.objects.filter(route=route).order_by('effective_from').values_list('base_rate_usd', flat=True)),
+            [Decimal('1500.00'), Decimal('1600.00')],
+        )
+
+    def test_reimport_updates_in_place(self):
+        sheet = 'CLVAP,CLSAI,40DRY,{},2025-01-01,,60,1'
+        self.run_import(rate_sheet(sheet.format('1500')))
+        stats, errors = self.run_import(rate_sheet(sheet.format('1700')))
+        self.assertEqual((stats['created'], stats['updated'], errors), (0, 1, []))
+        self.assertEqual(BaseRate.objects.get().base_rate_usd, Decimal('1700.00'))
+
+    def test_overlaps_are_rejected_unless_superseding(self):
+        self.run_import(rate_sheet('CLVAP,CLSAI,40DRY,1500,2025-01-01,,60,1'))
+        later = 'CLVAP,CLSAI,40DRY,1800,2025-03-01,,,'
+
+        stats, errors = self.run_import(rate_sheet(later))
+        self.assertEqual((stats['created'], errors[0]['row']), (0, 2))
+        self.assertIn('effective_from', errors[0]['errors'])
+
+        stats, errors = self.run_import(rate_sheet(later), supersede=True)
+        self.assertEqual((stats['created'], stats['closed'], errors), (1, 1, []))
+        self.assertEqual(
+            list(BaseRate.objects.order_by('effective_from').values_list('effective_to', flat=True)),
+            [datetime.date(2025, 2, 28), None],
+        )
+
+    def test_xlsx_sheet_with_native_cells(self):
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['Origin Port', 'Destination Port', 'Container Type', 'Base Rate USD', 'Effective From',
+                      'Effective To', 'Distance Nautical Miles', 'Estimated Transit Days'])
+        # Fechas y números como celdas nativas, celdas vacías y una fila en blanco
+        sheet.append(['CLVAP', 'CLSAI', '40DRY', 1500.5, datetime.datetime(2025, 1, 1), datetime.date(2025, 6, 30), 60, 1])
+        sheet.append([None] * 8)
+        sheet.append(['CLVAP', 'CLSAI', 'Contenedor 40', 1600, datetime.datetime(2025, 7, 1), None, None, None])
+        sheet.append(['CLSAI', 'CLVAP', '40DRY', 'abc', datetime.datetime(2025, 1, 1), None, 60, 1])
+        upload = io.BytesIO()
+        workbook.save(upload)
+        upload.seek(0)
+
+        errors = []
+        stats = tariff_import.TariffImporter(on_error=errors.append).run(
+            tariff_import.read_rows(upload, 'Tarifas.XLSX')
+        )
+        self.assertEqual((stats['rows'], stats['created'], stats['routes_created']), (3, 2, 1))
+        self.assertEqual([error['row'] for error in errors], [5])
+        self.assertIn('base_rate_usd', errors[0]['errors'])
+        self.assertEqual(
+            list(BaseRate.objects.order_by('effective_from').values_list('base_rate_usd', 'effective_from', 'effective_to')),
+            [(Decimal('1500.50'), datetime.date(2025, 1, 1), datetime.date(2025, 6, 30)),
+             (Decimal('1600.00'), datetime.date(2025, 7, 1), None)],
+        )
+
+    def test_missing_columns_fail_before_importing(self):
+        with self.assertRaises(tariff_import.ImportFormatError):
+            list(tariff_import.read_rows(io.BytesIO(b'origin_port,destination_port\n'), 'tarifas.csv'))
+
+    def test_upload_endpoint_reports_progress(self):
+        client = APIClient()
+        upload = rate_sheet('CLVAP,CLSAI,40DRY,1500,2025-01-01,,60,1', 'CLVAP,CLSAI,40DRY,-1,2025-02-01,,,')
+        upload.name = 'tarifas.csv'
+        self.assertEqual(client.post('/api/v1/base-rates/import/', {'file': upload}).status_code, 403)
+
+        client.force_authenticate(User.objects.create_user('admin', is_staff=True))
+        upload.seek(0)
+        payload = client.post('/api/v1/base-rates/import/', {'file': upload, 'import_id': 'lote-1'}).json()
+        self.assertEqual((payload['status'], payload['created'], payload['errors']), ('completed', 1, 1))
+        self.assertEqual(payload['error_report'][0]['row'], 3)
+        status = client.get('/api/v1/base-rates/import/lote-1/').json()
+        self.assertEqual((status['id'], status['status']), ('lote-1', 'completed'))
+        self.assertEqual(client.get('/api/v1/base-rates/import/otro/').status_code, 404)
+
+
+class StreamingExportTests(TestCase):
+    def setUp(self):
+        self.ports, self.container_types, self.cargo_types = create_pricing_data(ports=2)
+        self.quotes = []
+        for status_ in ('DRAFT', 'SENT', 'SENT'):
+            quote = Quote.objects.create(**quote_data(self.ports[0], self.ports[1], status=status_))
+            for _ in range(2):
+                QuoteItem.objects.create(quote=quote, container_type=self.container_types[0],
+                                         cargo_type=self.cargo_types[0], weight_kg=Decimal('100'),
+                                         volume_cbm=Decimal('10'), base_rate=Decimal('1000'))
+            self.quotes.append(quote)
+
+    def export(self, url, queries_expected=1):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get(url)
+            self.assertTrue(response.streaming)
+            content = b''.join(response.streaming_content).decode()
+        self.assertEqual(len(queries), queries_expected)
+        return response, content
+
+    def test_csv_export_honors_filters(self):
+        response, content = self.export('/api/v1/quotes/export/?status=SENT')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment; filename="quote_', response['Content-Disposition'])
+        lines = content.splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'quote_number', 'status'])
+        self.assertEqual(len(lines), 3)
+        self.assertIn('origin_port_code', lines[0])
+
+    def test_ndjson_item_export_flattens_quote(self):
+        quote = self.quotes[0]
+        response, content = self.export(f'/api/v1/quote-items/export/?export_format=ndjson&quote={quote.pk}',
+                                        # django-filter valida la cotización del filtro
+                                        queries_expected=2)
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(rows), 2)
+        self.assertEqual((rows[0]['quote_quote_number'], rows[0]['quote_status']), (quote.quote_number, 'DRAFT'))
+        self.assertEqual(rows[0]['container_type_name'], self.container_types[0].name)
+        self.assertEqual(rows[0]['subtotal'], '1000.00')
+
+    def test_unknown_format_is_rejected(self):
+        self.assertEqual(APIClient().get('/api/v1/quotes/export/?export_format=xml').status_code, 400)
+
+
+class BenchmarkTests(TestCase):
+    def test_suite_reports_every_scenario(self):
+        create_pricing_data(ports=3)
+        rate_matrix.rebuild()
+        report = benchmarks.run(iterations=3, warmup=1, quote_items=(2,))
+        self.assertEqual(report['format'], benchmarks.FORMAT_VERSION)
+        self.assertIn('quote_serializer.create[2]', report['results'])
+        for name, result in report['results'].items():
+            self.assertEqual(result['calls'], 3, name)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        # Las creaciones se revierten
+        self.assertFalse(Quote.objects.filter(customer_email='benchmark@example.com').exists())
+
+    def test_compare_flags_regressions_above_threshold(self):
+        def report(**results):
+            return {'results': {name: {'p50_ms': p50, 'p95_ms': p50, 'queries_per_call': queries}
+                                for name, (p50, queries) in results.items()}}
+        baseline = report(slower=(10, 2), noisy=(0.1, 2), more_queries=(10, 2), removed=(10, 2))
+        current = report(slower=(13, 2), noisy=(0.3, 2), more_queries=(10, 3), added=(10, 2))
+        flagged = {(row['scenario'], row['metric'])
+                   for row in benchmarks.compare(baseline, current, threshold=0.2) if row['regression']}
+        self.assertEqual(flagged, {('slower', 'p50_ms'), ('slower', 'p95_ms'), ('more_queries', 'queries_per_call')})
+
+    def test_index_benchmark_refuses_non_test_database(self):
+        with mock.patch('quotes.management.commands.benchmark_indexes._base_descartable', return_value=False):
+            with self.assertRaisesMessage(CommandError, '--i-know'):
+                call_command('benchmark_indexes', '--ports', '5', '--routes', '5', '--quotes', '10', stdout=io.StringIO())
+        self.assertFalse(Port.objects.filter(code__startswith='BX').exists())
+
+    def test_index_benchmark_leaves_no_rows_or_index_changes(self):
+        with connection.cursor() as cursor:
+            indexes_before = connection.introspection.get_constraints(cursor, BaseRate._meta.db_table)
+        out = io.StringIO()
+        call_command('benchmark_indexes', '--ports', '5', '--routes', '10', '--rate-history', '2', '--quotes', '50',
+                     '--repeat', '2', stdout=out)
+        self.assertIn('calculate_quote.base_rate', out.getvalue())
+        self.assertFalse(Port.objects.filter(code__startswith='BX').exists())
+        self.assertFalse(Quote.objects.filter(quote_number__startswith='BX').exists())
+        with connection.cursor() as cursor:
+            indexes_after = connection.introspection.get_constraints(cursor, BaseRate._meta.db_table)
+        self.assertIn('baserate_lookup_idx', indexes_after)
+        self.assertEqual(indexes_after, indexes_before)
+
+
+@override_settings(SQL_INSTRUMENTATION_SAMPLE_RATE=1.0, SQL_REPEATED_QUERY_THRESHOLD=3)
+class SqlInstrumentationTests(TestCase):
+    def test_api_response_reports_query_count_and_time(self):
+        create_pricing_data(ports=3)
+        response = APIClient().get('/api/v1/quotes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(int(response[sql_instrumentation.QUERIES_HEADER]), 0)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertFalse(response.has_header(sql_instrumentation.REPEATED_HEADER))
+
+    def test_repeated_queries_are_logged_as_n_plus_one(self):
+        ports, _, _ = create_pricing_data(ports=3)
+
+        def view(request):
+            for port in ports:
+                list(Port.objects.filter(pk=port.pk))
+            return HttpResponse()
+
+        middleware = sql_instrumentation.SqlInstrumentationMiddleware(view)
+        with self.assertLogs('shipquote_backend.sql_instrumentation', 'WARNING') as logs:
+            response = middleware(RequestFactory().get('/api/v1/ports/'))
+        self.assertEqual(response[sql_instrumentation.QUERIES_HEADER], '3')
+        self.assertEqual(response[sql_instrumentation.REPEATED_HEADER], '1')
+        self.assertEqual(logs.records[0].repeated_queries[0]['count'], 3)
+
+    def test_shape_collapses_variable_parameter_lists(self):
+        self.assertEqual(sql_instrumentation.query_shape('SELECT 1 WHERE id IN (%s, %s, %s)'),
+                         sql_instrumentation.query_shape('SELECT 1 WHERE id IN (%s, %s)'))
+
+    @override_settings(SQL_INSTRUMENTATION_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_untouched(self):
+        response = APIClient().get('/api/v1/quotes/')
+        self.assertFalse(response.has_header(sql_instrumentation.QUERIES_HEADER))
+
+
+class StructuredLoggingTests(TestCase):
+    def test_queue_handler_writes_json_with_context(self):
+        stream = io.StringIO()
+        handler = structured_logging.QueueHandler(stream)
+        handler.setFormatter(structured_logging.JsonFormatter())
+        handler.addFilter(structured_logging.ContextFilter())
+        logger = logging.getLogger('shipquote_backend.tests.structured')
+        logger.addHandler(handler)
+        logger.propagate = False
+        self.addCleanup(logger.removeHandler, handler)
+        self.addCleanup(handler.close)
+
+        def log():
+            structured_logging.bind(request_id='req-1', quote_id=7)
+            logger.warning('Cotización %s', 'Q-1', extra={'db_time_ms': 1.5})
+        contextvars.copy_context().run(log)
+        handler.flush()
+
+        line = json.loads(stream.getvalue())
+        self.assertEqual((line['level'], line['message']), ('WARNING', 'Cotización Q-1'))
+        self.assertEqual((line['request_id'], line['quote_id'], line['db_time_ms']), ('req-1', 7, 1.5))
+        self.assertEqual(structured_logging.get_context(), {})
+
+    def test_full_queue_drops_records(self):
+        handler = structured_logging.QueueHandler(io.StringIO(), queue_size=1)
+        record = logging.makeLogRecord({'msg': 'x'})
+        handler.enqueue(record)
+        handler.enqueue(record)
+        self.assertEqual(handler.dropped, 1)
+        handler.close()
+
+    @override_settings(SLOW_QUERY_MS=0)
+    def test_slow_queries_are_tagged_with_request_and_quote(self):
+        create_pricing_data(ports=2)
+        quote = Quote.objects.first()
+        records = []
+        collector = logging.Handler()
+        collector.emit = records.append
+        collector.addFilter(structured_logging.ContextFilter())
+        logger = logging.getLogger('shipquote_backend.slow_queries')
+        logger.addHandler(collector)
+        self.addCleanup(logger.removeHandler, collector)
+
+        response = APIClient().get(f'/api/v1/quotes/{quote.pk}/', HTTP_X_REQUEST_ID='req-42')
+        self.assertEqual(response[structured_logging.REQUEST_ID_HEADER], 'req-42')
+        self.assertTrue(records)
+        tagged = [record for record in records if getattr(record, 'quote_id', None) == str(quote.pk)]
+        self.assertTrue(tagged)
+        self.assertEqual(tagged[0].request_id, 'req-42')
+        self.assertEqual(tagged[0].view, 'quotes.views.QuoteViewSet.retrieve')
+        self.assertIn('SELECT', tagged[0].sql)
+
+    def test_invalid_request_id_is_replaced(self):
+        response = APIClient().get('/api/v1/quotes/', HTTP_X_REQUEST_ID='no válido\n')
+        self.assertRegex(response[structured_logging.REQUEST_ID_HEADER], r'^[0-9a-f]{32}$')
+
+
+class AsyncQuoteTests(TransactionTestCase):
+    """La vista async responde lo mismo que calculate_quote, con o sin snapshot vigente."""
+
+    def setUp(self):
+        self.ports, self.container_types, cargo_types = create_pricing_data(ports=3)
+        self.payload = {
+            'origin_port_id': self.ports[0].pk, 'destination_port_id': self.ports[2].pk,
+            'container_type_id': self.container_types[1].pk, 'cargo_type_id': cargo_types[0].pk,
+            'quantity': 3, 'weight_kg': 12000, 'volume_cbm': 30,
+        }
+
+    def calculate(self, payload, path='/api/v1/async/calculate_quote/'):
+        if path.startswith('/api/v1/async/'):
+            response = async_to_sync(AsyncClient().post)(path, payload, content_type='application/json')
+        else:
+            response = APIClient().post(path, payload, format='json')
+        return response.status_code, json.loads(response.content)
+
+    def asgi(self, payload, headers=()):
+        """POST a la aplicación de asgi.py: (status, headers, cuerpo)."""
+        from shipquote_backend.asgi import application
+        body = json.dumps(payload).encode()
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+            'path': '/api/v1/async/calculate_quote/', 'raw_path': b'/api/v1/async/calculate_quote/',
+            'root_path': '', 'query_string': b'', 'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+            'headers': [(b'host', b'testserver'), (b'content-type', b'application/json'), *headers],
+        }
+        messages = [{'type': 'http.request', 'body': body[:10], 'more_body': True},
+                    {'type': 'http.request', 'body': body[10:], 'more_body': False}]
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await asyncio.Event().wait()
+
+        async def send(message):
+            sent.append(message)
+
+        async_to_sync(application)(scope, receive, send)
+        return (sent[0]['status'], {name.decode(): value.decode() for name, value in sent[0]['headers']},
+                json.loads(b''.join(message.get('body', b'') for message in sent[1:])))
+
+    def cold_start(self):
+        """Un proceso sin ningún snapshot, ni en memoria ni en archivo."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(PRICING_SNAPSHOT_PATH=os.path.join(directory.name, 'snapshot.bin'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        snapshot._state.update(token_signature=None, snapshot=None)
+
+    def test_matches_sync_response(self):
+        expected = self.calculate(self.payload, '/api/v1/calculate_quote/')
+        self.assertEqual(expected[0], 200)
+        self.assertEqual(self.calculate(self.payload), expected)
+
+    def test_asgi_application_skips_django_for_server_clients(self):
+        expected = self.calculate(self.payload, '/api/v1/calculate_quote/')
+        with mock.patch('django.core.handlers.asgi.ASGIHandler.__call__') as django_handler, \
+                self.assertNumQueries(0):
+            status, headers, body = self.asgi(self.payload, [(b'x-request-id', b'abc-123')])
+        django_handler.assert_not_called()
+        self.assertEqual((status, body), expected)
+        self.assertEqual((headers['x-request-id'], headers['x-content-type-options']), ('abc-123', 'nosniff'))
+        self.assertEqual(self.asgi({'quantity': 'x'})[0], 400)
+        with override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=50):
+            self.assertEqual(self.asgi(self.payload)[2], {'error': 'Request body too large.'})
+
+        # Un navegador (con Origin) pasa por Django, que agrega los headers de CORS
+        status, headers, body = self.asgi(self.payload, [(b'origin', b'http://localhost:3000')])
+        self.assertEqual((status, body), expected)
+        self.assertIn('access-control-allow-origin', headers)
+
+    def test_stale_snapshot_serves_the_previous_one_while_rebuilding(self):
+        before = self.calculate(self.payload, '/api/v1/calculate_quote/')
+        BaseRate.objects.filter(container_type=self.container_types[1]).update(base_rate_usd=Decimal('3000'))
+        snapshot.invalidate()
+        self.assertIsNone(snapshot.current_snapshot())
+        with mock.patch.object(async_views, 'schedule_rebuild') as schedule_rebuild, \
+                mock.patch.object(snapshot, 'compile_snapshot') as compile_snapshot:
+            self.assertEqual(self.calculate(self.payload), before)
+        self.assertEqual(schedule_rebuild.call_count, 1)
+        compile_snapshot.assert_not_called()
+
+        async_views.schedule_rebuild().result(timeout=30)
+        self.assertIsNotNone(snapshot.current_snapshot())
+        status, quote = self.calculate(self.payload)
+        self.assertEqual((status, quote['breakdown']['base_rate_per_container']), (200, 3000.0))
+
+    def test_cold_start_uses_database_lookups(self):
+        expected = self.calculate(self.payload, '/api/v1/calculate_quote/')
+        self.cold_start()
+        with mock.patch.object(async_views, 'schedule_rebuild'):
+            self.assertEqual(self.calculate(self.payload), expected)
+            self.assertEqual(self.calculate(dict(self.payload, container_type_id=0)), self.calculate(
+                dict(self.payload, container_type_id=0), '/api/v1/calculate_quote/'))
+
+    def test_errors_match_sync_view(self):
+        for payload in ({}, dict(self.payload, quantity='x'), dict(self.payload, origin_port_id=10 ** 9)):
+            self.assertEqual(self.calculate(payload), self.calculate(payload, '/api/v1/calculate_quote/'))
+
+    @override_settings(ASYNC_QUOTE_TIMEOUT=0.2)
+    def test_lookup_timeout(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        started = threading.Event()
+
+        def slow_rate(*args):
+            started.set()
+            release.wait(10)
+
+        self.cold_start()
+        with mock.patch.object(async_views, 'schedule_rebuild'), \
+                mock.patch.object(async_views, '_rate', async_views._in_thread(slow_rate)):
+            began = time.perf_counter()
+            response = self.calculate(self.payload)
+            elapsed = time.perf_counter() - began
+        self.assertTrue(started.is_set())
+        self.assertEqual(response, (504, {'error': 'Pricing data lookup timed out.'}))
+        # Responde al vencer ASYNC_QUOTE_TIMEOUT, sin esperar a la búsqueda colgada
+        self.assertLess(elapsed, 5)
+
+
+class QuoteExpiryTests(TestCase):
+    def setUp(self):
+        origin, destination = create_ports()
+        now = timezone.now()
+        self.quotes = {}
+        for status in ('DRAFT', 'SENT', 'ACCEPTED', 'REJECTED'):
+            for days in (-3, -1, 2):
+                quote = Quote.objects.create(**quote_data(origin, destination, status=status,
+                                                          valid_until=now + datetime.timedelta(days=days)))
+                self.quotes[status, days] = quote
+        Quote.objects.filter(pk=self.quotes['SENT', -3].pk).update(total_amount=Decimal('123.45'))
+
+    def statuses(self):
+        return {key: Quote.objects.get(pk=quote.pk).status for key, quote in self.quotes.items()}
+
+    def test_sweep_expires_only_overdue_open_quotes(self):
+        stats = expiry.sweep(batch_size=3, pause=0)
+        self.assertEqual((stats['expired'], stats['batches'], stats['complete']), (4, 2, True))
+        for (status, days), current in self.statuses().items():
+            expected = 'EXPIRED' if status in expiry.OPEN_STATUSES and days < 0 else status
+            self.assertEqual(current, expected, (status, days))
+        # Sin pasar por Quote.save(): los totales quedan como estaban
+        self.assertEqual(Quote.objects.get(pk=self.quotes['SENT', -3].pk).total_amount, Decimal('123.45'))
+
+    def test_interrupted_sweep_resumes(self):
+        first = expiry.sweep(batch_size=1, pause=0, max_batches=2)
+        self.assertEqual((first['expired'], first['complete']), (2, False))
+        second = expiry.sweep(batch_size=1, pause=0)
+        self.assertEqual((second['expired'], second['complete']), (2, True))
+        self.assertFalse(expiry.overdue().exists())
+
+    def test_batches_use_one_select_and_one_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            expiry.expire_batch(timezone.now(), batch_size=10)
+        statements = [query['sql'] for query in queries if not query['sql'].startswith('SAVEPOINT')
+                      and not query['sql'].startswith('RELEASE')]
+        # Las cotizaciones del lote, sus items (para los rollups) y el UPDATE
+        self.assertEqual([sql.split()[0] for sql in statements[:3]], ['SELECT', 'SELECT', 'UPDATE'])
+        # Después, en la misma transacción, solo las filas de rollup que se mueven
+        self.assertTrue(statements[3:])
+        self.assertTrue(all(sql.split()[0] in ('UPDATE', 'INSERT') and 'rollup"' in sql.split('(')[0]
+                            for sql in statements[3:]))
+
+    def test_command_reports_throughput(self):
+        out = io.StringIO()
+        call_command('expire_quotes', '--pause', '0', stdout=out)
+        self.assertIn('4 cotizaciones vencidas en 1 lotes', out.getvalue())
+        self.assertIn('filas/s', out.getvalue())
+
+
+class QuoteSearchTests(TestCase):
+    def setUp(self):
+        origin, destination = create_ports()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sydney = Port.objects.create(name='Puerto de Sídney', code='AUSYD', country=origin.country,
+                                              city='Sídney')
+            self.sydney_quote = Quote.objects.create(**quote_data(origin, self.sydney, customer_name='Ana Núñez'))
+            self.company_quote = Quote.objects.create(**quote_data(
+                origin, destination, customer_name='Pedro Soto', customer_company='Núñez Logística'))
+            self.other_quote = Quote.objects.create(**quote_data(
+                destination, origin, customer_name='Marta Díaz', customer_email='marta@example.com'))
+
+    def found(self, text):
+        queryset, _ = search.search(Quote.objects.all(), text)
+        return sorted(queryset.values_list('pk', flat=True))
+
+    def test_prefix_and_accent_insensitive(self):
+        for text in ('sid', 'SIDNEY', 'Sídn', 'ausyd'):
+            self.assertEqual(self.found(text), [self.sydney_quote.pk], text)
+        self.assertEqual(self.found(self.other_quote.quote_number.lower()), [self.other_quote.pk])
+        self.assertEqual(self.found('!!'), sorted(quote.pk for quote in Quote.objects.all()))
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(self.found('nunez'), sorted([self.sydney_quote.pk, self.company_quote.pk]))
+        self.assertEqual(self.found('nunez sid'), [self.sydney_quote.pk])
+        self.assertEqual(self.found('nunez marta'), [])
+
+    def test_api_orders_by_rank(self):
+        # Cliente (peso 4) antes que empresa (peso 3)
+        response = self.client.get('/api/v1/quotes/?search=Núñez')
+        self.assertEqual([quote['id'] for quote in response.json()['results']],
+                         [self.sydney_quote.pk, self.company_quote.pk])
+        page = self.client.get('/api/v1/quotes/?search=nunez&page_size=1').json()
+        self.assertEqual([quote['id'] for quote in page['results']], [self.sydney_quote.pk])
+        page = self.client.get(page['next']).json()
+        self.assertEqual([quote['id'] for quote in page['results']], [self.company_quote.pk])
+        response = self.client.get('/api/v1/quotes/?search=nu&ordering=created_at')
+        self.assertEqual([quote['id'] for quote in response.json()['results']],
+                         [self.sydney_quote.pk, self.company_quote.pk])
+        response = self.client.get('/api/v1/quotes/?search=')
+        self.assertEqual(len(response.json()['results']), 3)
+
+    def test_common_terms_keep_listing_order(self):
+        with mock.patch.object(search, 'COMMON_TERM_ROWS', 2):
+            queryset, ranked = search.search(Quote.objects.all(), 'puerto')
+            self.assertFalse(ranked)
+            self.assertEqual(queryset.count(), 3)
+            # Con un término raro el ranking vuelve aunque el otro sea común
+            self.assertTrue(search.search(Quote.objects.all(), 'puerto sid')[1])
+            response = self.client.get('/api/v1/quotes/?search=puerto')
+        self.assertEqual([quote['id'] for quote in response.json()['results']],
+                         [self.other_quote.pk, self.company_quote.pk, self.sydney_quote.pk])
+
+    def tokens(self, quote):
+        return dict(QuoteSearchToken.objects.filter(quote=quote).values_list('token', 'weight'))
+
+    def test_token_rows_keep_the_highest_field_weight(self):
+        tokens = self.tokens(self.company_quote)
+        # "nunez" solo está en la empresa (3); "puerto" en los dos puertos (2)
+        self.assertEqual((tokens['pedro'], tokens['nunez'], tokens['logistica'], tokens['puerto']), (4, 3, 3, 2))
+        for token in search.tokenize(self.company_quote.quote_number):
+            self.assertEqual(tokens[token], 8)
+        self.assertEqual(tokens['cliente'], 4)
+        self.assertTrue(all(token.isalnum() and token == token.lower() for token in tokens))
+
+        # Un UPDATE en bloque no pasa por save(): reindex() lo pone al día
+        Quote.objects.filter(pk=self.company_quote.pk).update(customer_company='Acme')
+        self.assertIn('logistica', self.tokens(self.company_quote))
+        self.assertEqual(search.reindex(Q(pk=self.company_quote.pk)), 1)
+        tokens = self.tokens(self.company_quote)
+        self.assertNotIn('logistica', tokens)
+        self.assertEqual(tokens['acme'], 3)
+
+        quote_id = self.company_quote.pk
+        self.company_quote.delete()
+        self.assertFalse(QuoteSearchToken.objects.filter(quote_id=quote_id).exists())
+
+    def test_index_follows_quote_and_port_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other_quote.customer_name = 'Marta Ibáñez'
+            self.other_quote.save()
+        self.assertEqual(self.found('ibanez'), [self.other_quote.pk])
+        self.assertEqual(self.found('diaz'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sydney.name = 'Puerto de Melbourne'
+            self.sydney.save()
+        self.assertEqual(self.found('melb'), [self.sydney_quote.pk])
+        self.assertEqual(self.found('sidney'), [])
+
+
+class DistanceMatrixTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(DISTANCE_MATRIX_PATH=os.path.join(directory.name, 'distances.bin'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        country = Country.objects.create(name='Chile', code='CHL', continent='América del Sur')
+        self.coordinates = {
+            'CLVAP': (-33.0472, -71.6127), 'BRSSZ': (-23.9608, -46.3333),
+            'DEHAM': (53.5488, 9.9872), 'CNSHA': (31.2304, 121.4737),
+        }
+        self.ports = {
+            code: Port.objects.create(name=f'Puerto {code}', code=code, country=country, city=code,
+                                      latitude=lat, longitude=lon)
+            for code, (lat, lon) in self.coordinates.items()
+        }
+
+    def great_circle(self, a, b):
+        return distances.great_circle_nm(self.coordinates[a], self.coordinates[b])
+
+    def assert_matrix(self):
+        matrix = distances.get_matrix()
+        for a in self.ports:
+            for b in self.ports:
+                self.assertAlmostEqual(matrix.great_circle(self.ports[a].pk, self.ports[b].pk),
+                                       self.great_circle(a, b), delta=0.01)
+
+    def test_vectorized_rows_match_great_circle(self):
+        rng = random.Random(3)
+        points = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(40)]
+        # Mismo punto, antípodas, polos y el antimeridiano
+        points += [(10.0, 20.0), (10.0, 20.0), (-10.0, -160.0), (90.0, 0.0), (-90.0, 0.0), (0.0, 179.9), (0.0, -179.9)]
+        latitudes = numpy.radians(numpy.array([lat for lat, _ in points]))
+        longitudes = numpy.radians(numpy.array([lon for _, lon in points]))
+        rows = list(range(0, len(points), 3))
+        values = distances._rows_numpy(latitudes, longitudes, numpy.asarray(rows), len(points))
+        self.assertEqual((values.shape, values.dtype), ((len(rows), len(points)), numpy.float32))
+        for i, row in enumerate(rows):
+            for column, point in enumerate(points):
+                self.assertAlmostEqual(float(values[i, column]), distances.great_circle_nm(points[row], point),
+                                       delta=0.05)
+
+    @mock.patch.object(distances, 'CHUNK_ROWS', 2)
+    def test_build_and_incremental_updates(self):
+        # Bloques de 2 filas: el armado completo y la actualización cruzan varios bloques
+        self.assertEqual(distances.build()['ports'], 4)
+        self.assert_matrix()
+        with self.captureOnCommitCallbacks(execute=True):
+            # Un puerto movido y dos nuevos: solo sus filas y columnas
+            self.coordinates['CLVAP'] = (-33.5933, -71.6217)
+            port = self.ports['CLVAP']
+            port.latitude, port.longitude = Decimal('-33.5933'), Decimal('-71.6217')
+            port.save()
+            for code, lat, lon in (('USNYC', '40.6892', '-74.0445'), ('SGSIN', '1.2644', '103.8220')):
+                self.coordinates[code] = (float(lat), float(lon))
+                self.ports[code] = Port.objects.create(
+                    name=f'Puerto {code}', code=code, country=port.country, city=code,
+                    latitude=Decimal(lat), longitude=Decimal(lon))
+        self.assertEqual(len(distances.get_matrix()), 6)
+        self.assert_matrix()
+
+    def test_cleared_coordinates_leave_the_matrix(self):
+        distances.build()
+        port = self.ports['CLVAP']
+        with self.captureOnCommitCallbacks(execute=True):
+            port.latitude = port.longitude = None
+            port.save()
+        matrix = distances.get_matrix()
+        self.assertNotIn(port.pk, matrix)
+        self.assertEqual(len(matrix), 3)
+        self.assertIsNone(matrix.great_circle(port.pk, self.ports['DEHAM'].pk))
+        self.assertIsNone(distances.route_estimate(port.pk, self.ports['DEHAM'].pk))
+        self.assertEqual(distances.route_estimate(self.ports['CNSHA'].pk, self.ports['DEHAM'].pk),
+                         distances.estimate(self.great_circle('CNSHA', 'DEHAM')))
+
+        # Con coordenadas otra vez vuelve a entrar, en una fila nueva
+        with self.captureOnCommitCallbacks(execute=True):
+            port.latitude, port.longitude = Decimal('-33.0472'), Decimal('-71.6127')
+            port.save()
+        self.assertEqual(len(distances.get_matrix()), 4)
+        self.assert_matrix()
+
+    def test_routes_created_through_the_api_get_estimates(self):
+        distances.build()
+        response = self.client.post('/api/v1/shipping-routes/', {
+            'origin_port_id': self.ports['DEHAM'].pk, 'destination_port_id': self.ports['BRSSZ'].pk,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        expected_distance, expected_days = distances.estimate(self.great_circle('DEHAM', 'BRSSZ'))
+        self.assertEqual(response.json()['distance_nautical_miles'], expected_distance)
+        self.assertEqual(response.json()['estimated_transit_days'], expected_days)
+
+        without_coordinates = Port.objects.create(name='Puerto sin datos', code='XXSIN',
+                                                  country=self.ports['DEHAM'].country, city='Sin datos')
+        response = self.client.post('/api/v1/shipping-routes/', {
+            'origin_port_id': self.ports['DEHAM'].pk, 'destination_port_id': without_coordinates.pk,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_validate_and_fix_routes(self):
+        distance, days = distances.estimate(self.great_circle('CLVAP', 'CNSHA'))
+        good = ShippingRoute.objects.create(origin_port=self.ports['CLVAP'], destination_port=self.ports['CNSHA'],
+                                            distance_nautical_miles=distance + 100, estimated_transit_days=days)
+        short = ShippingRoute.objects.create(origin_port=self.ports['CNSHA'], destination_port=self.ports['CLVAP'],
+                                             distance_nautical_miles=1000, estimated_transit_days=days)
+        fast = ShippingRoute.objects.create(origin_port=self.ports['CLVAP'], destination_port=self.ports['BRSSZ'],
+                                            distance_nautical_miles=round(self.great_circle('CLVAP', 'BRSSZ') * 1.3),
+                                            estimated_transit_days=1)
+        invalid = {route['route_id']: route['problems'] for route in distances.validate_routes()}
+        self.assertEqual(invalid, {short.pk: ['distance_below_great_circle'], fast.pk: ['transit_too_fast']})
+
+        out = io.StringIO()
+        call_command('distance_matrix', '--fix', stdout=out)
+        self.assertIn('2 rutas corregidas', out.getvalue())
+        self.assertEqual(distances.validate_routes(), [])
+        short.refresh_from_db()
+        self.assertEqual((short.distance_nautical_miles, short.estimated_transit_days), (distance, days))
+        good.refresh_from_db()
+        self.assertEqual(good.distance_nautical_miles, distance + 100)
+
+
+class QuoteRollupTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.ports, self.container_types, self.cargo_types = create_pricing_data(ports=3)
+
+    def stored(self):
+        quotes = {tuple(row[:4]): row[4:] for row in QuoteRollup.objects.values_list(
+            'origin_port', 'destination_port', 'day', 'status', 'quote_count', 'revenue') if any(row[4:])}
+        items = {tuple(row[:5]): row[5:] for row in QuoteItemRollup.objects.values_list(
+            'origin_port', 'destination_port', 'container_type', 'day', 'status', 'quote_count', 'container_count',
+            'revenue') if any(row[5:])}
+        return quotes, items
+
+    def assertRollupsMatchQuotes(self):
+        stored = self.stored()
+        rollups.rebuild()
+        self.assertEqual(stored, self.stored())
+        return stored
+
+    def add_item(self, quote, container_type, **extra):
+        values = {'quote': quote, 'container_type': container_type, 'cargo_type': self.cargo_types[0],
+                  'quantity': 2, 'weight_kg': 100, 'volume_cbm': 10, 'base_rate': Decimal('500')}
+        values.update(extra)
+        return QuoteItem.objects.create(**values)
+
+    def test_writes_apply_their_differences(self):
+        dry20, dry40 = self.container_types
+        response = self.client.post('/api/v1/quotes/', {
+            'customer_name': 'Cliente', 'customer_email': 'cliente@example.com',
+            'origin_port_id': self.ports[0].id, 'destination_port_id': self.ports[1].id,
+            'valid_until': '2030-01-01T00:00:00Z',
+            'items': [{
+                'container_type_id': container_type.id, 'cargo_type_id': self.cargo_types[0].id, 'quantity': 2,
+                'weight_kg': '10', 'volume_cbm': '1', 'base_rate': '100', 'documentation_fee': '25',
+            } for container_type in (dry20, dry20, dry40)],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        quote = Quote.objects.get(pk=response.json()['id'])
+        quotes, items = self.assertRollupsMatchQuotes()
+        key = (self.ports[0].id, self.ports[1].id, timezone.localdate(quote.created_at))
+        self.assertEqual(quotes[(*key, 'DRAFT')], (1, Decimal('625.00')))
+        self.assertEqual(items[(key[0], key[1], dry20.id, key[2], 'DRAFT')], (1, 4, Decimal('400.00')))
+
+        item = self.add_item(quote, dry40, documentation_fee=Decimal('40'))
+        self.assertRollupsMatchQuotes()
+        item = QuoteItem.objects.get(pk=item.pk)
+        item.quantity = 5
+        item.save()
+        self.assertRollupsMatchQuotes()
+        # Cambia de tipo: deja de ser el único 40' y pasa a sumar al 20'
+        item.container_type = dry20
+        item.save()
+        self.assertRollupsMatchQuotes()
+        item.delete()
+        # El único 40' que queda: la cotización deja de contar para ese tipo
+        QuoteItem.objects.get(quote=quote, container_type=dry40).delete()
+        _, items = self.assertRollupsMatchQuotes()
+        self.assertNotIn((key[0], key[1], dry40.id, key[2], 'DRAFT'), items)
+
+        response = self.client.patch(f'/api/v1/quotes/{quote.pk}/', {'status': 'ACCEPTED'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        quotes, _ = self.assertRollupsMatchQuotes()
+        self.assertNotIn((*key, 'DRAFT'), quotes)
+        self.assertEqual(quotes[(*key, 'ACCEPTED')], (1, Decimal('425.00')))
+
+        quote.destination_port = self.ports[2]
+        quote.save()
+        self.assertRollupsMatchQuotes()
+        Quote.objects.exclude(pk=quote.pk).first().delete()
+        self.assertRollupsMatchQuotes()
+
+    def test_expiry_moves_rollups(self):
+        quote = Quote.objects.create(**quote_data(self.ports[0], self.ports[1], status='SENT',
+                                                  valid_until=timezone.now() - datetime.timedelta(days=1)))
+        self.add_item(quote, self.container_types[0])
+        self.assertEqual(expiry.sweep(pause=0)['expired'], 1)
+        quotes, items = self.assertRollupsMatchQuotes()
+        key = (self.ports[0].id, self.ports[1].id, timezone.localdate(quote.created_at))
+        self.assertEqual(quotes[(*key, 'EXPIRED')], (1, Decimal('1000.00')))
+        self.assertNotIn((*key, 'SENT'), quotes)
+
+    def test_analytics_reads_only_rollups(self):
+        origin, destination = self.ports[0], self.ports[1]
+        for status in ('ACCEPTED', 'ACCEPTED', 'REJECTED', 'DRAFT'):
+            quote = Quote.objects.create(**quote_data(origin, destination, status=status))
+            self.add_item(quote, self.container_types[1], quantity=1)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/quotes/analytics/', {
+                'group_by': 'lane', 'origin_port': origin.id, 'destination_port': destination.id,
+            })
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertFalse([q['sql'] for q in queries if '"quotes_quote"' in q['sql']
+                          or '"quotes_quoteitem"' in q['sql']])
+        [lane] = response.json()['results']
+        self.assertEqual((lane['origin_port_code'], lane['destination_port_code']), (origin.code, destination.code))
+        self.assertEqual((lane['quote_count'], lane['accepted_count'], lane['closed_count']), (4, 2, 3))
+        self.assertEqual(lane['acceptance_rate'], round(2 / 3, 4))
+        self.assertEqual((lane['revenue'], lane['accepted_revenue']), ('2000.00', '1000.00'))
+
+        response = self.client.get('/api/v1/quotes/analytics/', {'group_by': 'container_type,month,status',
+                                                                 'status': 'ACCEPTED'})
+        [row] = response.json()['results']
+        self.assertEqual(row['container_type'], self.container_types[1].id)
+        self.assertEqual(row['month'], f'{timezone.localdate():%Y-%m}')
+        self.assertEqual((row['quote_count'], row['container_count'], row['revenue']), (2, 2, '1000.00'))
+
+        self.assertEqual(self.client.get('/api/v1/quotes/analytics/', {'group_by': 'customer'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/quotes/analytics/', {'date_from': 'ayer'}).status_code, 400)
+
+    def test_rebuild_command(self):
+        QuoteRollup.objects.all().delete()
+        out = io.StringIO()
+        call_command('rebuild_quote_rollups', '--since', f'{timezone.localdate():%Y-%m-%d}', stdout=out)
+        self.assertIn('3 filas por ruta', out.getvalue())
+        self.assertRollupsMatchQuotes()
+
+        # --days se resuelve en cada vuelta de --interval
+        QuoteRollup.objects.all().delete()
+        out = io.StringIO()
+        with mock.patch('quotes.management.commands.rebuild_quote_rollups.time.sleep',
+                        side_effect=[None, KeyboardInterrupt]):
+            with self.assertRaises(KeyboardInterrupt):
+                call_command('rebuild_quote_rollups', '--days', '1', '--interval', '60', stdout=out)
+        self.assertEqual(out.getvalue().count('3 filas por ruta'), 2)
+        self.assertRollupsMatchQuotes()
+
+    def test_bulk_and_cascaded_deletes_are_discounted_in_one_pass(self):
+        for i in range(6):
+            quote = Quote.objects.create(**quote_data(self.ports[i % 2], self.ports[2], status='SENT'))
+            self.add_item(quote, self.container_types[i % 2])
+
+        with mock.patch.object(rollups, 'contributions', wraps=rollups.contributions) as contributions:
+            _, deleted = Quote.objects.filter(status='SENT', origin_port=self.ports[0]).delete()
+            self.assertEqual((deleted['quotes.Quote'], contributions.call_count), (3, 1))
+            self.assertRollupsMatchQuotes()
+
+            # Las filas de rollup del puerto se borran con él: no hay nada que descontar
+            port_id = self.ports[1].pk
+            self.ports[1].delete()
+            self.assertEqual(contributions.call_count, 1)
+        self.assertFalse(Quote.objects.filter(origin_port_id=port_id).exists())
+        self.assertRollupsMatchQuotes()
+
+
+class QuoteRollupTransactionTests(TransactionTestCase):
+    """Fuera de una transacción, cada save() aplica los rollups junto con su escritura."""
+
+    def setUp(self):
+        self.ports, self.container_types, self.cargo_types = create_pricing_data(ports=2)
+
+    def test_a_failed_rollup_update_undoes_the_write(self):
+        quotes, items, rollup_rows = Quote.objects.count(), QuoteItem.objects.count(), QuoteRollup.objects.count()
+        with mock.patch.object(rollups, '_upsert', side_effect=OperationalError('deadlock')):
+            with self.assertRaises(OperationalError):
+                Quote.objects.create(**quote_data(self.ports[0], self.ports[1]))
+            quote = Quote.objects.first()
+            total = quote.total_amount
+            with self.assertRaises(OperationalError):
+                QuoteItem.objects.create(quote=quote, container_type=self.container_types[0],
+                                         cargo_type=self.cargo_types[0], quantity=1, weight_kg=1, volume_cbm=1,
+                                         base_rate=Decimal('100'))
+        self.assertEqual((Quote.objects.count(), QuoteItem.objects.count(), QuoteRollup.objects.count()),
+                         (quotes, items, rollup_rows))
+        quote.refresh_from_db()
+        self.assertEqual(quote.total_amount, total)
+
+        Quote.objects.create(**quote_data(self.ports[0], self.ports[1]))
+        fields = ('origin_port', 'destination_port', 'day', 'status', 'quote_count', 'revenue')
+        stored = list(QuoteRollup.objects.order_by(*fields).values_list(*fields))
+        rollups.rebuild()
+        self.assertEqual(stored, list(QuoteRollup.objects.order_by(*fields).values_list(*fields)))
@@ -0,0 +1,132 @@
+"""
+Totales de la cotización mantenidos a partir de sus items.
+
+Quote guarda la cantidad de items, el peso y el volumen totales, la tarifa
+de documentación y el monto total, así los reportes suman solo la tabla de
+cotizaciones. La tarifa de documentación se cobra una vez por cotización
+(la mayor de sus items) y no forma parte del subtotal de cada item:
+
+    total_amount = suma(subtotal) + documentation_fee
+
+Las cotizaciones anteriores a la migración 0005 conservan sus subtotales y
+su total_amount tal como se emitieron (la tarifa va dentro del subtotal de
+cada item) y quedaron con documentation_fee en 0.
+
+Cada alta o modificación de un item aplica su diferencia con un único UPDATE
+sobre la cotización. Las bajas y los cambios de tarifa de documentación (el
+máximo no se puede descontar) y las operaciones en bloque que no pasan por
+save() usan recompute(), que recalcula todo con una sentencia por lote.
+"""
+from decimal import Decimal
+
+from django.db.models import Case, Count, DecimalField, F, Max, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+# Campos del item que afectan a los totales (ver QuoteItem.from_db)
+TRACKED_FIELDS = ('quote_id', 'subtotal', 'weight_kg', 'volume_cbm', 'documentation_fee')
+
+ZERO = Decimal('0')
+
+
+def summarize(items):
+    """Totales de una lista de items en memoria (creaciones en bloque)."""
+    items = list(items)
+    documentation_fee = max((Decimal(str(item.documentation_fee)) for item in items), default=ZERO)
+    subtotal = sum((item.subtotal for item in items), ZERO)
+    return {
+        'item_count': len(items),
+        'total_weight_kg': sum((Decimal(str(item.weight_kg)) for item in items), ZERO),
+        'total_volume_cbm': sum((Decimal(str(item.volume_cbm)) for item in items), ZERO),
+        'documentation_fee': documentation_fee,
+        'total_amount': subtotal + documentation_fee,
+    }
+
+
+def _aggregate(expression, output_field):
+    """Subconsulta correlacionada con un agregado de los items de cada cotización."""
+    from .models import QuoteItem
+    subquery = QuoteItem.objects.filter(quote=OuterRef('pk')).order_by().values('quote').annotate(
+        value=expression
+    ).values('value')
+    return Coalesce(Subquery(subquery, output_field=output_field), Value(0), output_field=output_field)
+
+
+def recompute(quote_ids=None):
+    """
+    Recalcula los totales desde los items con un solo UPDATE. Sin quote_ids
+    recalcula todas las cotizaciones. Devuelve la cantidad de filas
+    actualizadas.
+    """
+    from .models import Quote
+
+    amount = DecimalField(max_digits=12, decimal_places=2)
+    measure = DecimalField(max_digits=14, decimal_places=2)
+    fee = DecimalField(max_digits=10, decimal_places=2)
+    documentation_fee = _aggregate(Max('documentation_fee'), fee)
+
+    queryset = Quote.objects.all()
+    if quote_ids is not None:
+        queryset = queryset.filter(pk__in=list(quote_ids))
+    return queryset.update(
+        item_count=_aggregate(Count('id'), Quote._meta.get_field('item_count')),
+        total_weight_kg=_aggregate(Sum('weight_kg'), measure),
+        total_volume_cbm=_aggregate(Sum('volume_cbm'), measure),
+        documentation_fee=documentation_fee,
+        total_amount=_aggregate(Sum('subtotal'), amount) + documentation_fee,
+    )
+
+
+def _tracked(item):
+    return {name: getattr(item, name) for name in TRACKED_FIELDS}
+
+
+def _apply(quote_id, count, subtotal, weight, volume, documentation_fee=None):
+    from .models import Quote
+    changes = {
+        'item_count': F('item_count') + count,
+        'total_weight_kg': F('total_weight_kg') + weight,
+        'total_volume_cbm': F('total_volume_cbm') + volume,
+        'total_amount': F('total_amount') + subtotal,
+    }
+    if documentation_fee:
+        # Solo puede subir: el UPDATE toma el mayor entre el actual y el del item
+        changes['documentation_fee'] = Case(
+            When(documentation_fee__lt=documentation_fee, then=Value(documentation_fee)),
+            default=F('documentation_fee'),
+        )
+        changes['total_amount'] = F('total_amount') + subtotal + Case(
+            When(documentation_fee__lt=documentation_fee, then=Value(documentation_fee) - F('documentation_fee')),
+            default=Value(ZERO),
+        )
+    Quote.objects.filter(pk=quote_id).update(**changes)
+
+
+def item_saved(item, created):
+    """Aplica el alta o la modificación de un item a los totales de su cotización."""
+    previous = getattr(item, '_tracked', None)
+    current = _tracked(item)
+    item._tracked = current
+
+    def value(values, name):
+        return Decimal(str(values[name]))
+
+    if created:
+        _apply(item.quote_id, 1, value(current, 'subtotal'), value(current, 'weight_kg'),
+               value(current, 'volume_cbm'), value(current, 'documentation_fee'))
+    elif previous is None or previous['quote_id'] != current['quote_id'] \
+            or value(previous, 'documentation_fee') != value(current, 'documentation_fee'):
+        recompute({current['quote_id'], (previous or current)['quote_id']})
+    elif previous != current:
+        _apply(item.quote_id, 0,
+               *(value(current, name) - value(previous, name) for name in ('subtotal', 'weight_kg', 'volume_cbm')))
+
+
+def item_deleted(item):
+    """Descuenta un item borrado de los totales de su cotización."""
+    # Valores tal como estaban en la base, aunque la instancia se haya modificado
+    values = {name: Decimal(str(value)) if name != 'quote_id' else value
+              for name, value in (getattr(item, '_tracked', None) or _tracked(item)).items()}
+    if values['documentation_fee']:
+        recompute([values['quote_id']])
+    else:
+        _apply(values['quote_id'], -1, -values['subtotal'], -values['weight_kg'], -values['volume_cbm'])
@@ -1,14 +1,19 @@
 from rest_framework.routers import DefaultRouter
 from django.urls import path
-from .views import ShippingRouteViewSet, BaseRateViewSet, QuoteViewSet, QuoteItemViewSet
+from . import async_views
+from .views import ShippingRouteViewSet, BaseRateViewSet, QuoteViewSet, QuoteItemViewSet, RateMatrixViewSet
 
 router = DefaultRouter()
 router.register(r'shipping-routes', ShippingRouteViewSet)
 router.register(r'base-rates', BaseRateViewSet)
 router.register(r'quotes', QuoteViewSet)
 router.register(r'quote-items', QuoteItemViewSet)
+router.register(r'rate-matrix', RateMatrixViewSet)
 
 urlpatterns = [
     path('calculate_quote/', QuoteViewSet.as_view({'post': 'calculate_quote'}), name='calculate_quote'),
+    path('calculate_quotes_batch/', QuoteViewSet.as_view({'post': 'calculate_quotes_batch'}), name='calculate_quotes_batch'),
+    path('async/calculate_quote/', async_views.calculate_quote, name='calculate_quote_async'),
+    path('calculate_itineraries/', QuoteViewSet.as_view({'post': 'calculate_itineraries'}), name='calculate_itineraries'),
 ]
 urlpatterns += router.urls
\ No newline at end of file
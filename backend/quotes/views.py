@@ -1,37 +1,118 @@
-from django.shortcuts import render
+import uuid
+
 from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from .models import ShippingRoute, BaseRate, Quote, QuoteItem, ContainerType, CargoType
-from .serializers import ShippingRouteSerializer, BaseRateSerializer, QuoteSerializer, QuoteItemSerializer, PortSerializer, ContainerTypeSerializer, CargoTypeSerializer
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser
+from .models import ShippingRoute, BaseRate, Quote, QuoteItem, RateMatrixEntry, ContainerType
+from .serializers import ShippingRouteSerializer, BaseRateSerializer, QuoteSerializer, QuoteItemSerializer, RateMatrixEntrySerializer
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
-from django.db.models import Q
-from datetime import date, timedelta
+from .pricing import MAX_BATCH_SIZE, QuoteError, quote_from_snapshot
+from .search import QuoteSearchFilter
+from .snapshot import get_snapshot
+from . import rate_matrix, rollups, routing, tariff_import
+from decimal import Decimal
+from django.db.models import Prefetch
+from django.utils.dateparse import parse_date
+from shipquote_backend.exports import StreamingExportMixin
+from shipquote_backend.pagination import KeysetPagination
+from shipquote_backend.http_cache import ConditionalCacheMixin
+from shipquote_backend.structured_logging import bind as bind_log_context
+from ports.models import Country, Port
 
-class ShippingRouteViewSet(viewsets.ModelViewSet):
-    queryset = ShippingRoute.objects.all()
+class ShippingRouteViewSet(ConditionalCacheMixin, viewsets.ModelViewSet):
+    cache_models = (ShippingRoute, Port, Country)
+    queryset = ShippingRoute.objects.select_related('origin_port__country', 'destination_port__country')
     serializer_class = ShippingRouteSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['origin_port', 'destination_port', 'is_active']
     search_fields = ['origin_port__name', 'destination_port__name', 'origin_port__code', 'destination_port__code']
     ordering_fields = ['origin_port__name', 'destination_port__name', 'estimated_transit_days']
 
-class BaseRateViewSet(viewsets.ModelViewSet):
-    queryset = BaseRate.objects.all()
+class BaseRateViewSet(ConditionalCacheMixin, viewsets.ModelViewSet):
+    cache_models = (BaseRate, ShippingRoute, Port, Country, ContainerType)
+    queryset = BaseRate.objects.select_related(
+        'route__origin_port__country', 'route__destination_port__country', 'container_type'
+    )
     serializer_class = BaseRateSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    pagination_class = KeysetPagination
     filterset_fields = ['route', 'container_type', 'is_active', 'effective_from', 'effective_to']
     search_fields = ['route__origin_port__name', 'route__destination_port__name', 'container_type__name']
     ordering_fields = ['effective_from', 'base_rate_usd']
 
-class QuoteViewSet(viewsets.ModelViewSet):
-    queryset = Quote.objects.all()
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser],
+            permission_classes=[IsAdminUser])
+    def import_rates(self, request):
+        """
+        Importa una planilla de tarifas CSV/XLSX (campo "file") con inserción o
+        actualización en bloque. Con "import_id" el progreso se puede consultar
+        en base-rates/import/<import_id>/ mientras corre; "supersede" cierra las
+        tarifas abiertas que la planilla reemplaza y "dry_run" solo valida.
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"error": "A rate sheet file is required."}, status=status.HTTP_400_BAD_REQUEST)
+        import_id = str(request.data.get('import_id') or uuid.uuid4().hex)[:64]
+        flags = {name: str(request.data.get(name, '')).lower() in ('1', 'true', 'yes')
+                 for name in ('supersede', 'dry_run')}
+
+        errors = []
+        def on_error(error):
+            if len(errors) < tariff_import.MAX_REPORTED_ERRORS:
+                errors.append(error)
+
+        importer = tariff_import.TariffImporter(
+            supersede=flags['supersede'], on_error=on_error,
+            on_progress=lambda stats: tariff_import.save_progress(import_id, status='running', **stats),
+        )
+        tariff_import.save_progress(import_id, status='running', file=upload.name, **importer.stats)
+        try:
+            stats = importer.run(tariff_import.read_rows(upload, upload.name), dry_run=flags['dry_run'])
+        except tariff_import.ImportFormatError as e:
+            tariff_import.save_progress(import_id, status='failed', error=str(e))
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            tariff_import.save_progress(import_id, status='failed', error=str(e))
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        report = tariff_import.save_progress(
+            import_id, status='validated' if flags['dry_run'] else 'completed', error_report=errors, **stats
+        )
+        return Response(report, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path=r'import/(?P<import_id>[\w-]+)', permission_classes=[IsAdminUser])
+    def import_status(self, request, import_id=None):
+        """Progreso (o reporte final) de una importación de tarifas."""
+        progress = tariff_import.get_progress(import_id)
+        if progress is None:
+            return Response({"error": "Import not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(progress, status=status.HTTP_200_OK)
+
+class QuoteViewSet(StreamingExportMixin, viewsets.ModelViewSet):
+    queryset = Quote.objects.select_related(
+        'origin_port__country', 'destination_port__country'
+    ).prefetch_related(
+        Prefetch('items', queryset=QuoteItem.objects.select_related('container_type', 'cargo_type'))
+    )
     serializer_class = QuoteSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    # Búsqueda sobre el índice de tokens (quotes/search.py), campos en search.FIELDS
+    filter_backends = [DjangoFilterBackend, QuoteSearchFilter, OrderingFilter]
+    pagination_class = KeysetPagination
     filterset_fields = ['status', 'origin_port', 'destination_port', 'customer_email', 'created_by']
-    search_fields = ['quote_number', 'customer_name', 'customer_email', 'origin_port__name', 'destination_port__name']
     ordering_fields = ['created_at', 'total_amount', 'valid_until']
+    export_fields = [
+        'id', 'quote_number', 'status', 'customer_name', 'customer_email', 'customer_company',
+        'origin_port__code', 'destination_port__code', 'item_count', 'total_weight_kg', 'total_volume_cbm',
+        'documentation_fee', 'total_amount', 'currency', 'valid_until', 'created_at', 'created_by__username',
+    ]
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if 'pk' in self.kwargs:
+            bind_log_context(quote_id=self.kwargs['pk'])
 
     def perform_create(self, serializer):
         
@@ -39,102 +120,178 @@ class QuoteViewSet(viewsets.ModelViewSet):
             serializer.save(created_by=self.request.user)
         else:
             serializer.save()
+        bind_log_context(quote_id=serializer.instance.pk, quote_number=serializer.instance.quote_number)
+        self._reload(serializer)
+
+    def perform_update(self, serializer):
+        serializer.save()
+        self._reload(serializer)
+
+    def _reload(self, serializer):
+        # Recargar con el mismo grafo de relaciones que las lecturas para no caer en N+1
+        serializer.instance = self.get_queryset().get(pk=serializer.instance.pk)
 
     @action(detail=False, methods=['post'])
     def calculate_quote(self, request):
         """
         Calcula una cotización basada en los parámetros de entrada.
         """
-        origin_port_id = request.data.get('origin_port_id')
-        destination_port_id = request.data.get('destination_port_id')
-        container_type_id = request.data.get('container_type_id')
-        cargo_type_id = request.data.get('cargo_type_id')
-        quantity = request.data.get('quantity', 1)
-        weight_kg = request.data.get('weight_kg')
-        volume_cbm = request.data.get('volume_cbm')
+        try:
+            calculated_quote = quote_from_snapshot(get_snapshot(), request.data)
+        except QuoteError as e:
+            return Response({"error": str(e)}, status=e.status_code)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        if not all([origin_port_id, destination_port_id, container_type_id, cargo_type_id, weight_kg, volume_cbm]):
-            return Response({"error": "Missing required parameters."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(calculated_quote, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'])
+    def calculate_quotes_batch(self, request):
+        """
+        Calcula varias cotizaciones en una sola solicitud.
+
+        Acepta una lista de solicitudes (o {"requests": [...]}) con el mismo
+        formato que calculate_quote y devuelve un resultado o un error por
+        fila, en el orden de entrada.
+        """
+        rows = request.data.get('requests') if isinstance(request.data, dict) else request.data
+        if not isinstance(rows, list):
+            return Response({"error": "Expected a list of quote requests."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > MAX_BATCH_SIZE:
+            return Response({"error": f"A batch can contain at most {MAX_BATCH_SIZE} requests."},
+                            status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            from decimal import Decimal
-            # 1. Encontrar la ruta
-            route = ShippingRoute.objects.get(
-                origin_port_id=origin_port_id,
-                destination_port_id=destination_port_id,
-                is_active=True
-            )
-
-            # 2. Encontrar la tarifa base activa para la ruta y tipo de contenedor
-            today = date.today()
-            base_rate_obj = BaseRate.objects.filter(
-                route=route,
-                container_type_id=container_type_id,
-                effective_from__lte=today,
-                is_active=True,
-            ).filter(
-                Q(effective_to__gte=today) | Q(effective_to__isnull=True)
-            ).first()
-
-            if not base_rate_obj:
-                return Response({"error": "No active base rate found for this route and container type."}, 
-                                status=status.HTTP_404_NOT_FOUND)
-
-            # 3. Obtener tipo de contenedor y carga
-            container_type = ContainerType.objects.get(id=container_type_id)
-            cargo_type = CargoType.objects.get(id=cargo_type_id)
-
-            # 4. Calcular el costo total usando Decimal
-            base_cost = Decimal(str(base_rate_obj.base_rate_usd))
-            fuel_surcharge_percentage = Decimal(str(base_rate_obj.fuel_surcharge_percentage))
-            quantity_dec = Decimal(str(quantity))
-            handling_fee = Decimal('50.00')
-            documentation_fee = Decimal('25.00')
-
-            fuel_surcharge_amount = base_cost * (fuel_surcharge_percentage / Decimal('100'))
-            insurance_fee = (base_cost + fuel_surcharge_amount) * Decimal('0.01')
-
-            total_item_cost = (base_cost + fuel_surcharge_amount + handling_fee + insurance_fee) * quantity_dec
-            total_quote_amount = total_item_cost + documentation_fee
-
-            # Preparar la respuesta
-            calculated_quote = {
-                "origin_port": PortSerializer(route.origin_port).data,
-                "destination_port": PortSerializer(route.destination_port).data,
-                "container_type": ContainerTypeSerializer(container_type).data,
-                "cargo_type": CargoTypeSerializer(cargo_type).data,
-                "quantity": quantity,
-                "weight_kg": weight_kg,
-                "volume_cbm": volume_cbm,
-                "estimated_transit_days": route.estimated_transit_days,
-                "breakdown": {
-                    "base_rate_per_container": float(base_cost),
-                    "fuel_surcharge_percentage": float(fuel_surcharge_percentage),
-                    "fuel_surcharge_amount_per_container": float(fuel_surcharge_amount),
-                    "handling_fee_per_container": float(handling_fee),
-                    "insurance_fee_per_container": float(insurance_fee),
-                    "documentation_fee_per_quote": float(documentation_fee),
-                },
-                "total_item_cost": float(total_item_cost),
-                "total_quote_amount": float(total_quote_amount),
-                "currency": "USD",
-                "valid_until": (today + timedelta(days=7)).isoformat()
-            }
-
-            return Response(calculated_quote, status=status.HTTP_200_OK)
-
-        except ShippingRoute.DoesNotExist:
-            return Response({"error": "Shipping route not found or inactive."}, status=status.HTTP_404_NOT_FOUND)
-        except ContainerType.DoesNotExist:
-            return Response({"error": "Container type not found."}, status=status.HTTP_404_NOT_FOUND)
-        except CargoType.DoesNotExist:
-            return Response({"error": "Cargo type not found."}, status=status.HTTP_404_NOT_FOUND)
+            snapshot = get_snapshot()
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class QuoteItemViewSet(viewsets.ModelViewSet):
-    queryset = QuoteItem.objects.all()
+        # Rutas, tarifas, tipos y recargos se resuelven una sola vez por lote
+        cache = {}
+        results = []
+        for index, row in enumerate(rows):
+            if not isinstance(row, dict):
+                results.append({"index": index, "status": status.HTTP_400_BAD_REQUEST,
+                                "error": "Invalid parameters."})
+                continue
+            try:
+                quote = quote_from_snapshot(snapshot, row, cache)
+            except QuoteError as e:
+                results.append({"index": index, "status": e.status_code, "error": str(e)})
+            else:
+                results.append({"index": index, "status": status.HTTP_200_OK, "quote": quote})
+
+        return Response({"count": len(results), "results": results}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def analytics(self, request):
+        """
+        Cotizaciones, tasa de aceptación y monto agrupados según group_by
+        (lane, origin, destination, container_type, month, status; por
+        defecto lane,month), leídos solo de los rollups (quotes/rollups.py).
+        Filtros opcionales: date_from, date_to (día de creación),
+        origin_port, destination_port, container_type y status.
+        """
+        params = request.query_params
+        group_by = [name.strip() for name in params.get('group_by', 'lane,month').split(',') if name.strip()]
+        if any(name not in rollups.GROUP_NAMES for name in group_by):
+            return Response({"error": f"group_by must be a list of: {', '.join(rollups.GROUP_NAMES)}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            dates = {}
+            for name in ('date_from', 'date_to'):
+                if params.get(name):
+                    dates[name] = parse_date(params[name])
+                    if dates[name] is None:
+                        raise ValueError(name)
+            filters = {f'{name}_id': int(params[name]) if params.get(name) else None
+                       for name in ('origin_port', 'destination_port', 'container_type')}
+            limit = min(int(params.get('limit', rollups.DEFAULT_LIMIT)), rollups.MAX_LIMIT)
+        except (TypeError, ValueError):
+            return Response({"error": "Missing or invalid parameters."}, status=status.HTTP_400_BAD_REQUEST)
+        if params.get('status') and params['status'] not in dict(Quote.STATUS_CHOICES):
+            return Response({"error": "Invalid status."}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({"error": "limit must be positive."}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = rollups.report(group_by, limit=limit, status=params.get('status') or None, **dates, **filters)
+        return Response({"group_by": group_by, "count": len(results), "results": results},
+                        status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'])
+    def calculate_itineraries(self, request):
+        """
+        Busca itinerarios con transbordo entre dos puertos: las k opciones más
+        baratas y las k más rápidas para un tipo de contenedor.
+        """
+        try:
+            origin_port_id = int(request.data['origin_port_id'])
+            destination_port_id = int(request.data['destination_port_id'])
+            container_type_id = int(request.data['container_type_id'])
+            quantity = Decimal(str(request.data.get('quantity', 1)))
+            if not quantity.is_finite():
+                raise ValueError(quantity)
+            k = min(int(request.data.get('k', routing.DEFAULT_ITINERARIES)), routing.MAX_ITINERARIES)
+            max_hops = min(int(request.data.get('max_hops', routing.DEFAULT_MAX_HOPS)), routing.MAX_HOPS)
+        except (KeyError, TypeError, ValueError, ArithmeticError):
+            return Response({"error": "Missing or invalid parameters."}, status=status.HTTP_400_BAD_REQUEST)
+        if k < 1 or max_hops < 1:
+            return Response({"error": "k and max_hops must be positive."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Puertos o tipos inexistentes no tienen caminos (404); otro error es un 500 real
+        graph, paths = routing.engine.itineraries(origin_port_id, destination_port_id, container_type_id, k, max_hops)
+        if not paths[routing.CHEAPEST]:
+            return Response({"error": "No itinerary found for this route and container type."},
+                            status=status.HTTP_404_NOT_FOUND)
+
+        # Precios y etiquetas del mismo grafo en que se buscaron los caminos
+        result = {
+            criterion: [graph.price(path, container_type_id, quantity) for path in criterion_paths]
+            for criterion, criterion_paths in paths.items()
+        }
+        snapshot = graph.snapshot
+        return Response({
+            "origin_port": snapshot.port(origin_port_id),
+            "destination_port": snapshot.port(destination_port_id),
+            "container_type": snapshot.container_type(container_type_id),
+            "quantity": request.data.get('quantity', 1),
+            "cheapest": result[routing.CHEAPEST],
+            "fastest": result[routing.FASTEST],
+            "currency": "USD",
+        }, status=status.HTTP_200_OK)
+
+class QuoteItemViewSet(StreamingExportMixin, viewsets.ModelViewSet):
+    queryset = QuoteItem.objects.select_related('container_type', 'cargo_type')
     serializer_class = QuoteItemSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    pagination_class = KeysetPagination
     filterset_fields = ['quote', 'container_type', 'cargo_type']
-    ordering_fields = ['id']
\ No newline at end of file
+    ordering_fields = ['id']
+    # Una fila por ítem con los datos de su cotización
+    export_fields = [
+        'id', 'quote_id', 'quote__quote_number', 'quote__status', 'quote__customer_name', 'quote__customer_email',
+        'quote__origin_port__code', 'quote__destination_port__code', 'quote__created_at',
+        'container_type__name', 'cargo_type__name', 'quantity', 'weight_kg', 'volume_cbm', 'base_rate',
+        'fuel_surcharge', 'handling_fee', 'documentation_fee', 'insurance_fee', 'subtotal',
+    ]
+
+class RateMatrixViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Grilla precalculada ruta × tipo de contenedor con el precio total por
+    contenedor vigente hoy. Se devuelve completa (sin paginación).
+    """
+    queryset = RateMatrixEntry.objects.all()
+    serializer_class = RateMatrixEntrySerializer
+    pagination_class = None
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_fields = ['origin_port', 'destination_port', 'container_type', 'origin_country',
+                        'origin_country_code', 'origin_continent']
+    ordering_fields = ['all_in_per_container', 'estimated_transit_days', 'origin_port_code']
+
+    def list(self, request, *args, **kwargs):
+        rate_matrix.ensure_current()
+        # Lectura directa con .values(): la grilla ya está desnormalizada
+        fields = [field.name for field in RateMatrixEntry._meta.concrete_fields
+                  if field.name not in ('as_of', 'updated_at')]
+        rows = self.filter_queryset(self.get_queryset()).values(*fields)
+        return Response(list(rows))
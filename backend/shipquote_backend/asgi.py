@@ -13,4 +13,13 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shipquote_backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from quotes import async_views  # noqa: E402  (requiere las apps cargadas)
+
+
+async def application(scope, receive, send):
+    # calculate_quote async sin el handler de Django (ver quotes/async_views.py)
+    if async_views.handles(scope):
+        return await async_views.asgi_calculate_quote(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,51 @@
+"""
+Compresión de respuestas negociada con Accept-Encoding: brotli si el cliente
+lo acepta, si no gzip (GZipMiddleware de Django). Las respuestas streaming solo se comprimen con gzip.
+"""
+import re
+
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # está en requirements.txt; sin el paquete queda gzip
+    brotli = None
+
+# Respuestas más chicas no ganan nada al comprimirse
+MIN_LENGTH = 200
+BROTLI_QUALITY = 5
+
+
+def accepts_encoding(request, encoding):
+    """True si Accept-Encoding incluye la codificación con q > 0."""
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = part.strip().partition(';')
+        if name.strip().lower() != encoding:
+            continue
+        match = re.search(r'q=([0-9.]+)', params)
+        return not match or float(match.group(1)) > 0
+    return False
+
+
+class CompressionMiddleware(GZipMiddleware):
+    def process_response(self, request, response):
+        if brotli is None or response.streaming or response.has_header('Content-Encoding') \
+                or len(response.content) < MIN_LENGTH:
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if not accepts_encoding(request, 'br'):
+            return super().process_response(request, response)
+
+        compressed = brotli.compress(response.content, quality=BROTLI_QUALITY)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = 'br'
+        # La representación cambió: el ETag pasa a ser débil, igual que con gzip
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
@@ -1,16 +1,248 @@
+"""
+Ruteo de lecturas a réplicas de solo lectura (DATABASE_REPLICAS).
+
+Las escrituras van siempre a 'default'. Las lecturas se reparten en
+round-robin entre las réplicas cuyo retraso de replicación está por debajo
+de REPLICA_MAX_LAG_SECONDS; si ninguna lo cumple se lee del primario.
+
+Lectura de las propias escrituras: dentro de un request (o de un bloque
+pinned_to_primary()) una escritura fija el resto de las lecturas al
+primario, y ReplicaRoutingMiddleware deja una cookie para que los requests
+siguientes del mismo cliente también lean del primario hasta que el retraso
+máximo permitido haya pasado. Las lecturas dentro de una transacción
+abierta en el primario tampoco salen de él.
+
+Cada decisión se registra en el logger de este módulo (DEBUG), se cuenta en
+routing_stats() y el middleware devuelve las bases leídas en el header
+X-Database-Reads.
+"""
+import contextvars
+import itertools
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PRIMARY = 'default'
+PIN_COOKIE = 'db_primary_until'
+READS_HEADER = 'X-Database-Reads'
+
+# Consulta de retraso (segundos) que se ejecuta en cada réplica, por motor
+LAG_QUERIES = {
+    # Tiempo de redo pendiente de la réplica secundaria de un Availability Group
+    'microsoft': (
+        "SELECT DATEDIFF(SECOND, last_redone_time, last_received_time) "
+        "FROM sys.dm_hadr_database_replica_states WHERE is_local = 1 AND database_id = DB_ID()"
+    ),
+    'postgresql': (
+        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+    ),
+}
+
+# Estado del request (o tarea async) en curso: escrituras hechas y bases leídas
+_scope = contextvars.ContextVar('database_routing_scope', default=None)
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def routing_stats():
+    """Decisiones tomadas por el router en este proceso: {(alias, motivo): cantidad}."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_routing_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+@contextmanager
+def routing_scope(pinned=False):
+    """Ámbito de lectura de las propias escrituras (un request, una tarea)."""
+    token = _scope.set({'pinned': pinned, 'wrote': False, 'reads': set()})
+    try:
+        yield _scope.get()
+    finally:
+        _scope.reset(token)
+
+
+@contextmanager
+def pinned_to_primary():
+    """Todas las lecturas del bloque van al primario (dentro del ámbito actual si hay uno)."""
+    scope = _scope.get()
+    if scope is None:
+        with routing_scope(pinned=True) as scope:
+            yield scope
+        return
+    previous = scope['pinned']
+    scope['pinned'] = True
+    try:
+        yield scope
+    finally:
+        scope['pinned'] = previous
+
+
+def read_your_writes_window():
+    """Segundos después de una escritura en los que una réplica todavía puede no tenerla."""
+    if not getattr(settings, 'DATABASE_REPLICAS', []):
+        return 0
+    # Margen de un intervalo de medición sobre el retraso máximo permitido
+    return getattr(settings, 'REPLICA_MAX_LAG_SECONDS', 5) + getattr(settings, 'REPLICA_LAG_CHECK_INTERVAL', 5)
+
+
+class ReplicaLagMonitor:
+    """Retraso de replicación por réplica, medido a lo sumo una vez por intervalo."""
+
+    def __init__(self, max_lag=None, interval=None):
+        self._max_lag = max_lag
+        self._interval = interval
+        self._lags = {}
+        self._lock = threading.Lock()
+
+    @property
+    def max_lag(self):
+        return self._max_lag if self._max_lag is not None else getattr(settings, 'REPLICA_MAX_LAG_SECONDS', 5)
+
+    @property
+    def interval(self):
+        return self._interval if self._interval is not None else getattr(settings, 'REPLICA_LAG_CHECK_INTERVAL', 5)
+
+    def measure(self, alias):
+        """Retraso en segundos; None si no se pudo medir (la réplica se considera caída)."""
+        connection = connections[alias]
+        query = LAG_QUERIES.get(connection.vendor)
+        if query is None:
+            return 0
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(query)
+                row = cursor.fetchone()
+        except DatabaseError:
+            logger.warning('No se pudo medir el retraso de la réplica %s', alias, exc_info=True)
+            return None
+        return float(row[0]) if row and row[0] is not None else 0
+
+    def lag(self, alias):
+        now = time.monotonic()
+        cached = self._lags.get(alias)
+        if cached is None or now - cached[1] >= self.interval:
+            with self._lock:
+                cached = self._lags.get(alias)
+                if cached is None or now - cached[1] >= self.interval:
+                    cached = (self.measure(alias), now)
+                    self._lags[alias] = cached
+        return cached[0]
+
+    def is_healthy(self, alias):
+        lag = self.lag(alias)
+        return lag is not None and lag <= self.max_lag
+
+
 class DatabaseRouter:
     """
-    Router para optimizar consultas en SQL Server
+    Router para optimizar consultas en SQL Server: lecturas en réplicas,
+    escrituras en el primario.
     """
-    
+
+    def __init__(self, replicas=None, monitor=None):
+        self._replicas = replicas
+        self.monitor = monitor or ReplicaLagMonitor()
+        self._next = itertools.count()
+
+    @property
+    def replicas(self):
+        return self._replicas if self._replicas is not None else getattr(settings, 'DATABASE_REPLICAS', [])
+
+    def _route(self, alias, reason, model):
+        with _stats_lock:
+            _stats[(alias, reason)] += 1
+        scope = _scope.get()
+        if scope is not None:
+            scope['reads'].add(alias)
+        logger.debug('Lectura de %s en %s (%s)', model._meta.label, alias, reason)
+        return alias
+
     def db_for_read(self, model, **hints):
         """Sugerir la base de datos para lecturas."""
-        return 'default'
-    
+        replicas = self.replicas
+        if not replicas:
+            return PRIMARY
+        scope = _scope.get()
+        if scope is not None and (scope['pinned'] or scope['wrote']):
+            return self._route(PRIMARY, 'read_your_writes', model)
+        if connections[PRIMARY].in_atomic_block:
+            return self._route(PRIMARY, 'transaction', model)
+
+        start = next(self._next)
+        for offset in range(len(replicas)):
+            alias = replicas[(start + offset) % len(replicas)]
+            if self.monitor.is_healthy(alias):
+                return self._route(alias, 'replica', model)
+        return self._route(PRIMARY, 'replica_lag', model)
+
     def db_for_write(self, model, **hints):
         """Sugerir la base de datos para escrituras."""
-        return 'default'
-    
+        scope = _scope.get()
+        if scope is not None:
+            scope['wrote'] = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Réplicas y primario tienen los mismos datos
+        return True
+
     def allow_migrate(self, db, app_label, model_name=None, **hints):
-        """Permitir migraciones."""
-        return True
\ No newline at end of file
+        """Permitir migraciones (solo en el primario; las réplicas las reciben replicadas)."""
+        return db not in self.replicas
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Abre un ámbito de ruteo por request. Después de una escritura deja una
+    cookie que fija las lecturas del cliente al primario mientras las
+    réplicas puedan no tenerla todavía.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _pinned(self, request):
+        try:
+            return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with routing_scope(pinned=self._pinned(request)) as scope:
+            response = self.get_response(request)
+        return self._finish(scope, response)
+
+    async def __acall__(self, request):
+        with routing_scope(pinned=self._pinned(request)) as scope:
+            response = await self.get_response(request)
+        return self._finish(scope, response)
+
+    def _finish(self, scope, response):
+        window = read_your_writes_window()
+        if scope['wrote'] and window:
+            response.set_cookie(PIN_COOKIE, f'{time.time() + window:.0f}', max_age=int(window) + 1,
+                                httponly=True, samesite='Lax')
+        if scope['reads']:
+            response[READS_HEADER] = ','.join(sorted(scope['reads']))
+        return response
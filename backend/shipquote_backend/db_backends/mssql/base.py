@@ -0,0 +1,7 @@
+from mssql.base import DatabaseWrapper as MssqlDatabaseWrapper
+
+from shipquote_backend.db_pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, MssqlDatabaseWrapper):
+    """Backend mssql-django con pool de conexiones (ver shipquote_backend/db_pool.py)."""
@@ -0,0 +1,24 @@
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+
+from shipquote_backend.db_pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, SQLiteDatabaseWrapper):
+    """
+    SQLite embebido con pool de conexiones, para el perfil local
+    (settings_local.py). En archivo usa WAL para que las lecturas no
+    esperen a las escrituras de otros hilos.
+    """
+
+    def get_new_connection(self, conn_params):
+        # Django nunca cierra una base en memoria (la de las pruebas): no puede devolverse al pool
+        if self.is_in_memory_db():
+            return self.create_connection(conn_params)
+        return super().get_new_connection(conn_params)
+
+    def create_connection(self, conn_params):
+        connection = super().create_connection(conn_params)
+        if not self.is_in_memory_db():
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
@@ -0,0 +1,200 @@
+"""
+Pool de conexiones por proceso para los backends de shipquote_backend/db_backends.
+
+Django abre una conexión por hilo y la cierra al terminar el request (o al
+vencer CONN_MAX_AGE). Con estos backends abrir y cerrar es tomar y devolver
+una conexión física de un pool compartido por los hilos del worker, así el
+handshake ODBC se paga una vez por conexión y no por request.
+
+Configuración por base en DATABASES[alias]['POOL']:
+
+    MAX_SIZE     conexiones físicas como máximo (en uso + libres)
+    TIMEOUT      segundos de espera por una conexión libre antes de fallar
+    RECYCLE      vida máxima de una conexión física, en segundos
+    PING_AFTER   segundos libre tras los cuales se verifica con SELECT 1
+
+pool_stats() devuelve el estado de los pools del proceso.
+"""
+import threading
+import time
+from collections import deque
+from functools import partial
+
+from django.db import OperationalError
+
+DEFAULTS = {
+    'MAX_SIZE': 10,
+    'TIMEOUT': 30,
+    'RECYCLE': 3600,
+    'PING_AFTER': 30,
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    def __init__(self, name, max_size=DEFAULTS['MAX_SIZE'], timeout=DEFAULTS['TIMEOUT'],
+                 recycle=DEFAULTS['RECYCLE'], ping_after=DEFAULTS['PING_AFTER']):
+        self.name = name
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self._idle = deque()
+        # id(conexión física) -> momento de creación
+        self._born = {}
+        self._in_use = 0
+        self._condition = threading.Condition()
+        self._counters = dict.fromkeys(('created', 'reused', 'discarded', 'waits', 'timeouts'), 0)
+
+    def _discard(self, raw):
+        self._born.pop(id(raw), None)
+        self._counters['discarded'] += 1
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _ping(self, raw):
+        try:
+            cursor = raw.cursor()
+            try:
+                cursor.execute('SELECT 1')
+                cursor.fetchall()
+            finally:
+                cursor.close()
+        except Exception:
+            return False
+        return True
+
+    def acquire(self, create):
+        """Conexión física libre (verificada si estuvo inactiva) o una nueva con create()."""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            raw = None
+            with self._condition:
+                while True:
+                    now = time.monotonic()
+                    while self._idle:
+                        candidate, released_at = self._idle.pop()
+                        if now - self._born[id(candidate)] > self.recycle:
+                            self._discard(candidate)
+                            continue
+                        raw, idle_for = candidate, now - released_at
+                        break
+                    if raw is not None or self._in_use + len(self._idle) < self.max_size:
+                        self._in_use += 1
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._counters['timeouts'] += 1
+                        raise OperationalError(
+                            f'Connection pool "{self.name}" exhausted ({self.max_size} connections in use).'
+                        )
+                    self._counters['waits'] += 1
+                    self._condition.wait(remaining)
+
+            if raw is None:
+                try:
+                    raw = create()
+                except Exception:
+                    self._give_back()
+                    raise
+                with self._condition:
+                    self._born[id(raw)] = time.monotonic()
+                    self._counters['created'] += 1
+                return raw
+
+            if idle_for < self.ping_after or self._ping(raw):
+                with self._condition:
+                    self._counters['reused'] += 1
+                return raw
+            # Conexión rota mientras estaba libre: se descarta y se vuelve a intentar
+            with self._condition:
+                self._discard(raw)
+            self._give_back()
+
+    def _give_back(self):
+        with self._condition:
+            self._in_use -= 1
+            self._condition.notify()
+
+    def release(self, raw, discard=False):
+        """Devuelve una conexión al pool, sin transacción abierta."""
+        if not discard:
+            try:
+                raw.rollback()
+            except Exception:
+                discard = True
+        with self._condition:
+            self._in_use -= 1
+            born = self._born.get(id(raw))
+            if discard or born is None or time.monotonic() - born > self.recycle:
+                self._discard(raw)
+            else:
+                self._idle.append((raw, time.monotonic()))
+            self._condition.notify()
+
+    def close_idle(self):
+        with self._condition:
+            while self._idle:
+                self._discard(self._idle.pop()[0])
+
+    def stats(self):
+        with self._condition:
+            return {
+                'max_size': self.max_size,
+                'size': self._in_use + len(self._idle),
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                **self._counters,
+            }
+
+
+def get_pool(alias, settings_dict):
+    """Pool del proceso para una base (se separa por nombre y host: los tests cambian NAME)."""
+    key = (alias, str(settings_dict['NAME']), settings_dict.get('HOST', ''))
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                options = {**DEFAULTS, **(settings_dict.get('POOL') or {})}
+                pool = ConnectionPool(
+                    name=alias, max_size=options['MAX_SIZE'], timeout=options['TIMEOUT'],
+                    recycle=options['RECYCLE'], ping_after=options['PING_AFTER'],
+                )
+                _pools[key] = pool
+    return pool
+
+
+def pool_stats():
+    """Estado de los pools del proceso: {alias: {...}} (con la base si hay más de uno por alias)."""
+    with _pools_lock:
+        pools = list(_pools.items())
+    stats = {}
+    for (alias, name, _), pool in pools:
+        key = alias if alias not in stats else f'{alias}:{name}'
+        stats[key] = pool.stats()
+    return stats
+
+
+class PooledDatabaseWrapperMixin:
+    """Toma y devuelve las conexiones físicas del pool en lugar de abrirlas y cerrarlas."""
+
+    @property
+    def pool(self):
+        return get_pool(self.alias, self.settings_dict)
+
+    def create_connection(self, conn_params):
+        """Conexión física nueva, sin pasar por el pool."""
+        return super().get_new_connection(conn_params)
+
+    def get_new_connection(self, conn_params):
+        return self.pool.acquire(partial(self.create_connection, conn_params))
+
+    def _close(self):
+        if self.connection is not None:
+            # Con errores pendientes Django ya verificó que la conexión no es usable
+            self.pool.release(self.connection, discard=self.errors_occurred)
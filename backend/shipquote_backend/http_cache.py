@@ -0,0 +1,124 @@
+"""
+GET condicional y caché de respuestas para los endpoints de datos de referencia.
+
+Cada tabla tiene una versión de cambios en el caché compartido (CACHES
+'default'); las señales de guardado/borrado la renuevan y las operaciones en
+bloque que no disparan señales deben llamar a bump(). El ETag de una
+respuesta combina las versiones de las tablas de las que depende con la URL
+y el formato, así que un request con If-None-Match vigente devuelve 304 sin
+consultar la base, y la respuesta renderizada se guarda en caché con ese
+mismo ETag: una escritura cambia la versión y la entrada vieja deja de usarse.
+
+Mientras una versión es más nueva que la ventana de retraso de las réplicas
+las lecturas se hacen en el primario, para no guardar con la versión nueva
+datos que la réplica todavía no tiene.
+"""
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from .database_router import pinned_to_primary, read_your_writes_window
+
+VERSION_KEY = 'http_cache:version:{}'
+RESPONSE_KEY = 'http_cache:response:{}'
+
+
+def _cache():
+    return caches[getattr(settings, 'HTTP_CACHE_ALIAS', 'default')]
+
+
+def _label(model):
+    return model._meta.label_lower
+
+
+def _new_version():
+    return {'token': uuid.uuid4().hex, 'modified': time.time()}
+
+
+def bump(*models):
+    """Renueva la versión de cambios de las tablas."""
+    _cache().set_many({VERSION_KEY.format(_label(model)): _new_version() for model in models}, timeout=None)
+
+
+def bump_on_commit(*models):
+    """
+    Renueva la versión ya (los tests y lectores dentro de la transacción) y de
+    nuevo después del commit, para descartar lo cacheado en el medio.
+    """
+    bump(*models)
+    transaction.on_commit(lambda: bump(*models))
+
+
+def table_versions(models):
+    """Versiones de las tablas, creando las que falten."""
+    cache = _cache()
+    keys = [VERSION_KEY.format(_label(model)) for model in models]
+    versions = cache.get_many(keys)
+    missing = {key: _new_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+class ConditionalCacheMixin:
+    """
+    Para ViewSets de solo datos de referencia: list y retrieve con ETag,
+    Last-Modified, 304 y caché de la respuesta renderizada. cache_models son
+    las tablas que aparecen en la respuesta (incluidas las anidadas).
+    """
+    cache_models = ()
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._conditional(request, super().retrieve, *args, **kwargs)
+
+    def _conditional(self, request, handler, *args, **kwargs):
+        versions = table_versions(self.cache_models)
+        key = '|'.join([request.get_full_path(), request.accepted_renderer.format]
+                       + [version['token'] for version in versions])
+        etag = f'"{hashlib.md5(key.encode()).hexdigest()}"'
+        modified = max(version['modified'] for version in versions)
+
+        response = get_conditional_response(request, etag=etag, last_modified=int(modified))
+        if response is None:
+            cached = _cache().get(RESPONSE_KEY.format(etag))
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+        if response is not None:
+            return self._add_validators(response, etag, modified)
+
+        self._http_cache = (etag, modified)
+        if time.time() - modified < read_your_writes_window():
+            with pinned_to_primary():
+                return handler(request, *args, **kwargs)
+        return handler(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        http_cache = getattr(self, '_http_cache', None)
+        if http_cache is not None and response.status_code == 200:
+            etag, modified = http_cache
+            response.render()
+            _cache().set(RESPONSE_KEY.format(etag), (response.content, response['Content-Type']),
+                         timeout=getattr(settings, 'HTTP_CACHE_TIMEOUT', 300))
+            self._add_validators(response, etag, modified)
+        return response
+
+    def _add_validators(self, response, etag, modified):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modified)
+        # El cliente puede guardar la respuesta pero debe revalidarla siempre
+        patch_cache_control(response, public=True, no_cache=True)
+        patch_vary_headers(response, ('Accept',))
+        return response
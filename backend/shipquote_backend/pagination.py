@@ -0,0 +1,216 @@
+import datetime
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connections, models
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# Máximo de filas que se cuentan cuando el listado está filtrado
+COUNT_LIMIT = 10000
+
+
+def estimated_row_count(model, using='default'):
+    """
+    Cantidad aproximada de filas de la tabla según las estadísticas del motor,
+    sin recorrer la tabla. Devuelve None si el motor no las expone.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'microsoft':
+            cursor.execute(
+                "SELECT SUM(row_count) FROM sys.dm_db_partition_stats "
+                "WHERE object_id = OBJECT_ID(%s) AND index_id IN (0, 1)",
+                [table]
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None and row[0] >= 0 else None
+
+
+def _cursor_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _position_value(instance, field_name):
+    value = instance
+    for part in field_name.split('__'):
+        value = value[part] if isinstance(value, dict) else getattr(value, part)
+    return value.pk if isinstance(value, models.Model) else value
+
+
+def _ordering_field(queryset, field_name):
+    """Campo del modelo (o de la anotación) por el que ordena field_name."""
+    if field_name in queryset.query.annotations:
+        return queryset.query.annotations[field_name].output_field
+    model, field = queryset.model, None
+    for part in field_name.split('__'):
+        field = model._meta.pk if part == 'pk' else model._meta.get_field(part)
+        if field.is_relation:
+            model = field.related_model
+    return field
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Paginación por cursor sobre el ordering de la vista (o del modelo), con la
+    clave primaria como desempate. No ejecuta COUNT(*) ni OFFSET.
+
+    A diferencia de CursorPagination de DRF, que guarda solo el primer campo
+    del orden y resuelve los empates con un offset, el cursor guarda la tupla
+    completa (campos del orden, pk) de la última fila y la página siguiente
+    se lee con una comparación de tuplas, aunque miles de filas compartan el
+    mismo valor. Los campos del orden no deben admitir NULL.
+
+    Con ?count=true se agrega un total: estimado con las estadísticas de la
+    tabla si el listado no está filtrado, o contado hasta COUNT_LIMIT filas.
+    """
+    page_size = settings.REST_FRAMEWORK.get('PAGE_SIZE', 20)
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    count_query_param = 'count'
+
+    def get_ordering(self, request, queryset, view):
+        self.ordering = tuple(getattr(view, 'ordering', None) or queryset.model._meta.ordering or ('-pk',))
+        ordering = tuple(super().get_ordering(request, queryset, view))
+        pk_name = queryset.model._meta.pk.name
+        if not any(field.lstrip('-') in (pk_name, 'pk') for field in ordering):
+            ordering += (('-' if ordering[0].startswith('-') else '') + pk_name,)
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        self.count_is_estimate = False
+        if request.query_params.get(self.count_query_param) in ('1', 'true', 'True'):
+            self.count, self.count_is_estimate = self._approximate_count(queryset)
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        position, reverse = self.decode_cursor(request)
+        if position is not None:
+            position = self._parse_position(queryset, position)
+
+        ordering = [field[1:] if field.startswith('-') else '-' + field for field in self.ordering] \
+            if reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(ordering, position))
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_previous, self.has_next = has_more, position is not None
+        else:
+            self.has_previous, self.has_next = position is not None, has_more
+        # Bordes de la página; una página vacía conserva la posición del cursor
+        self.previous_position = self._position(self.page[0]) if self.page else position
+        self.next_position = self._position(self.page[-1]) if self.page else position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def _after(self, ordering, position):
+        """
+        Filas posteriores a position en ordering: (a, b, pk) > (va, vb, vpk)
+        expandido en OR de igualdades y una comparación estricta. El primer
+        campo se repite como rango (<= / >=) para que la base use el índice.
+        """
+        fields = [(field.lstrip('-'), 'lt' if field.startswith('-') else 'gt') for field in ordering]
+        condition = Q()
+        for index, (field, lookup) in enumerate(fields):
+            equal = {name: value for (name, _), value in zip(fields[:index], position)}
+            condition |= Q(**equal, **{f'{field}__{lookup}': position[index]})
+        first, lookup = fields[0]
+        return Q(**{f'{first}__{lookup}e': position[0]}) & condition
+
+    def _position(self, instance):
+        return [_cursor_value(_position_value(instance, field.lstrip('-'))) for field in self.ordering]
+
+    def _parse_position(self, queryset, position):
+        """Convierte los valores del cursor al tipo de cada campo del orden."""
+        if len(position) != len(self.ordering) or None in position:
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            return [
+                _ordering_field(queryset, field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def decode_cursor(self, request):
+        """Devuelve (posición, reverse) del cursor de la solicitud, o (None, False)."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            position, reverse = cursor['p'], bool(cursor.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def encode_cursor(self, position, reverse=False):
+        cursor = {'p': position}
+        if reverse:
+            cursor['r'] = 1
+        encoded = urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode()).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.next_position)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(self.previous_position, reverse=True)
+
+    def _approximate_count(self, queryset):
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None:
+                return estimate, True
+        count = queryset.order_by()[:COUNT_LIMIT].count()
+        return count, count >= COUNT_LIMIT
+
+    def get_paginated_response(self, data):
+        payload = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+        }
+        if self.count is not None:
+            payload['count'] = self.count
+            payload['count_is_estimate'] = self.count_is_estimate
+        payload['results'] = data
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count'] = {'type': 'integer', 'nullable': True}
+        response_schema['properties']['count_is_estimate'] = {'type': 'boolean'}
+        return response_schema
@@ -1,5 +1,6 @@
+import copy
 import os
-from decouple import config
+from decouple import config, Csv
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -36,8 +37,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'shipquote_backend.structured_logging.RequestContextMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'shipquote_backend.compression.CompressionMiddleware',
+    'shipquote_backend.sql_instrumentation.SqlInstrumentationMiddleware',
+    'shipquote_backend.database_router.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -69,7 +74,8 @@ WSGI_APPLICATION = 'shipquote_backend.wsgi.application'
 # Database - SQL Server Configuration
 DATABASES = {
     'default': {
-        'ENGINE': 'mssql',
+        # mssql-django con pool de conexiones por worker (ver shipquote_backend/db_pool.py)
+        'ENGINE': 'shipquote_backend.db_backends.mssql',
         'NAME': config('DB_NAME', default='shipquote_db'),
         'USER': config('DB_USER', default='sa'),
         'PASSWORD': config('DB_PASSWORD', default='YourStrong@Passw0rd'),
@@ -79,6 +85,15 @@ DATABASES = {
             'driver': 'ODBC Driver 18 for SQL Server',
             'extra_params': 'TrustServerCertificate=yes',
         },
+        # Al cerrar, la conexión vuelve al pool; > 0 además la retiene en el hilo
+        'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=0, cast=int),
+        'CONN_HEALTH_CHECKS': True,
+        'POOL': {
+            'MAX_SIZE': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+            'TIMEOUT': config('DB_POOL_TIMEOUT', default=30, cast=float),
+            'RECYCLE': config('DB_POOL_RECYCLE', default=3600, cast=float),
+            'PING_AFTER': config('DB_POOL_PING_AFTER', default=30, cast=float),
+        },
     }
 }
 
@@ -127,6 +142,30 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Snapshot compilado de precios compartido por los workers (mmap)
+PRICING_SNAPSHOT_PATH = config('PRICING_SNAPSHOT_PATH', default=os.path.join(BASE_DIR, 'var', 'pricing_snapshot.bin'))
+
+# Matriz de distancias entre puertos compartida por los workers (mmap, ver quotes/distances.py)
+DISTANCE_MATRIX_PATH = config('DISTANCE_MATRIX_PATH', default=os.path.join(BASE_DIR, 'var', 'distance_matrix.bin'))
+
+# calculate_quote asíncrono (quotes/async_views.py): consultas simultáneas por proceso y timeout en segundos
+ASYNC_QUOTE_DB_CONCURRENCY = config('ASYNC_QUOTE_DB_CONCURRENCY', default=8, cast=int)
+ASYNC_QUOTE_TIMEOUT = config('ASYNC_QUOTE_TIMEOUT', default=5, cast=float)
+
+# Caché compartido por los workers (versiones de tablas y respuestas de referencia)
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': config('CACHE_LOCATION', default=os.path.join(BASE_DIR, 'var', 'cache')),
+    }
+}
+
+# Segundos que se guarda una respuesta de datos de referencia (se invalida antes al cambiar la tabla)
+HTTP_CACHE_TIMEOUT = config('HTTP_CACHE_TIMEOUT', default=300, cast=int)
+
+# Números de cotización que cada worker reserva por vez
+QUOTE_NUMBER_BLOCK_SIZE = config('QUOTE_NUMBER_BLOCK_SIZE', default=20, cast=int)
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -165,23 +204,65 @@ SPECTACULAR_SETTINGS = {
     'SERVE_INCLUDE_SCHEMA': False,
 }
 
-# Logging configuration for SQL Server debugging
+# Logging estructurado (JSON) y asíncrono: ver structured_logging.py
+LOG_FORMAT = config('LOG_FORMAT', default='text' if DEBUG else 'json')
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'context': {
+            '()': 'shipquote_backend.structured_logging.ContextFilter',
+        },
+    },
+    'formatters': {
+        'json': {
+            '()': 'shipquote_backend.structured_logging.JsonFormatter',
+        },
+        'text': {
+            'format': '%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s',
+        },
+    },
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
+            'class': 'shipquote_backend.structured_logging.QueueHandler',
+            'formatter': LOG_FORMAT,
+            'filters': ['context'],
+            'queue_size': config('LOG_QUEUE_SIZE', default=10000, cast=int),
         },
     },
     'loggers': {
+        # Cada consulta completa solo a pedido (SQL_LOG_QUERIES); en general alcanza con SLOW_QUERY_MS
         'django.db.backends': {
             'handlers': ['console'],
-            'level': 'DEBUG' if DEBUG else 'INFO',
+            'level': 'DEBUG' if DEBUG and config('SQL_LOG_QUERIES', default=False, cast=bool) else 'INFO',
+            'propagate': False,
+        },
+        'shipquote_backend': {
+            'handlers': ['console'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+        'shipquote_backend.sql_instrumentation': {
+            'level': config('SQL_INSTRUMENTATION_LOG_LEVEL', default=LOG_LEVEL),
+        },
+        **{
+            app: {'handlers': ['console'], 'level': LOG_LEVEL, 'propagate': False}
+            for app in ('quotes', 'ports', 'containers', 'users')
         },
     },
 }
 
+# Consultas de esta duración o más se registran (fracción SLOW_QUERY_SAMPLE_RATE); vacío desactiva
+SLOW_QUERY_MS = config('SLOW_QUERY_MS', default='200', cast=lambda value: float(value) if value else None)
+SLOW_QUERY_SAMPLE_RATE = config('SLOW_QUERY_SAMPLE_RATE', default=1.0, cast=float)
+
+# Fracción de requests con conteo de consultas y detección de N+1 (ver sql_instrumentation.py)
+SQL_INSTRUMENTATION_SAMPLE_RATE = config('SQL_INSTRUMENTATION_SAMPLE_RATE', default=1.0 if DEBUG else 0.05, cast=float)
+# Repeticiones de una misma forma de consulta en un request que se reportan como N+1
+SQL_REPEATED_QUERY_THRESHOLD = config('SQL_REPEATED_QUERY_THRESHOLD', default=5, cast=int)
+
 # Database Router
 DATABASE_ROUTERS = ['shipquote_backend.database_router.DatabaseRouter']
 
@@ -192,3 +273,19 @@ if 'mssql' in DATABASES['default']['ENGINE']:
         'isolation_level': 'read committed',
         'autocommit': True,
     })
+
+# Réplicas de solo lectura (hosts separados por coma): copian la configuración
+# de default y en los tests apuntan a default
+DATABASE_REPLICAS = []
+for number, host in enumerate(config('DB_REPLICA_HOSTS', default='', cast=Csv()), start=1):
+    alias = f'replica_{number}'
+    DATABASES[alias] = copy.deepcopy(DATABASES['default'])
+    DATABASES[alias].update({'HOST': host, 'TEST': {'MIRROR': 'default'}})
+    if 'mssql' in DATABASES[alias]['ENGINE']:
+        # Conexión a la secundaria legible del Availability Group
+        DATABASES[alias]['OPTIONS']['extra_params'] += ';ApplicationIntent=ReadOnly'
+    DATABASE_REPLICAS.append(alias)
+
+# Retraso máximo de una réplica para leer de ella, y cada cuánto se mide (segundos)
+REPLICA_MAX_LAG_SECONDS = config('REPLICA_MAX_LAG_SECONDS', default=5, cast=float)
+REPLICA_LAG_CHECK_INTERVAL = config('REPLICA_LAG_CHECK_INTERVAL', default=5, cast=float)
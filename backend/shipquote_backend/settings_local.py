@@ -0,0 +1,40 @@
+"""
+Perfil local sin SQL Server: SQLite embebido (en archivo, con WAL) y el mismo
+pool de conexiones que en producción. Sirve para correr migraciones, el
+comando data, la API y los benchmarks en cualquier máquina:
+
+    DJANGO_SETTINGS_MODULE=shipquote_backend.settings_local python manage.py migrate
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, LOGGING, config, os
+
+# Sin DEBUG por defecto: DEBUG guarda y registra cada consulta, lo que distorsiona los benchmarks
+DEBUG = config('LOCAL_DEBUG', default=False, cast=bool)
+LOGGING['loggers']['django.db.backends']['level'] = (
+    'DEBUG' if DEBUG and config('SQL_LOG_QUERIES', default=False, cast=bool) else 'INFO'
+)
+SQL_INSTRUMENTATION_SAMPLE_RATE = config('SQL_INSTRUMENTATION_SAMPLE_RATE', default=1.0 if DEBUG else 0.05, cast=float)
+
+LOCAL_DB_PATH = config('LOCAL_DB_PATH', default=os.path.join(BASE_DIR, 'var', 'shipquote_local.sqlite3'))
+os.makedirs(os.path.dirname(os.path.abspath(LOCAL_DB_PATH)), exist_ok=True)
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'shipquote_backend.db_backends.sqlite3',
+        'NAME': LOCAL_DB_PATH,
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {
+            # Segundos de espera por el bloqueo de escritura entre hilos
+            'timeout': 30,
+        },
+        'POOL': {
+            'MAX_SIZE': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+            'TIMEOUT': config('DB_POOL_TIMEOUT', default=30, cast=float),
+            'RECYCLE': config('DB_POOL_RECYCLE', default=3600, cast=float),
+            'PING_AFTER': config('DB_POOL_PING_AFTER', default=30, cast=float),
+        },
+    }
+}
+
+# Sin réplicas en local
+DATABASE_REPLICAS = []
@@ -0,0 +1,127 @@
+"""
+Instrumentación de SQL por request, muestreada (SQL_INSTRUMENTATION_SAMPLE_RATE).
+
+En los requests muestreados cada consulta pasa por un execute_wrapper de las
+conexiones, que cuenta consultas, suma el tiempo en la base y agrupa por
+forma (el SQL con parámetros, con las listas IN y VALUES de largo variable
+colapsadas). No depende de DEBUG ni guarda el texto de cada consulta.
+
+La respuesta lleva X-DB-Queries, X-DB-Time-Ms y Server-Timing, y el logger de
+este módulo registra el resumen con campos estructurados (extra). Una forma
+repetida SQL_REPEATED_QUERY_THRESHOLD veces o más en un mismo request es la
+firma de un N+1: se registra como warning con la vista y acción responsables.
+"""
+import functools
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+QUERIES_HEADER = 'X-DB-Queries'
+TIME_HEADER = 'X-DB-Time-Ms'
+REPEATED_HEADER = 'X-DB-Repeated-Queries'
+# Largo máximo de la forma de una consulta en los logs
+SHAPE_LOG_LENGTH = 500
+
+_IN_LIST = re.compile(r'\((?:%s, )+%s\)')
+_VALUES = re.compile(r'(\((?:%s, )*%s\))(?:, \1)+')
+
+
+@functools.lru_cache(maxsize=2048)
+def query_shape(sql):
+    """El SQL sin la cantidad variable de parámetros de IN (...) y VALUES (...), (...)."""
+    return _IN_LIST.sub('(%s, ...)', _VALUES.sub(r'\1, ...', sql))
+
+
+class QueryRecorder:
+    """execute_wrapper que cuenta consultas, tiempo y repeticiones por forma."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.shapes[query_shape(sql)] += 1
+
+    def repeated(self, threshold):
+        """Formas ejecutadas threshold veces o más, de la más repetida a la menos."""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+
+def view_name(view_func, method):
+    """"modulo.ViewSet.accion" para vistas de DRF, o el nombre de la función."""
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    if view_class is None:
+        return f'{view_func.__module__}.{getattr(view_func, "__qualname__", view_func.__class__.__name__)}'
+    name = f'{view_class.__module__}.{view_class.__name__}'
+    action = (getattr(view_func, 'actions', None) or {}).get(method.lower())
+    return f'{name}.{action}' if action else name
+
+
+class SqlInstrumentationMiddleware:
+    """
+    Mide las consultas de una fracción de los requests (ver el docstring del
+    módulo). Bajo ASGI las consultas corren en otros hilos: no mide nada.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.get_response(request)
+        if random.random() >= getattr(settings, 'SQL_INSTRUMENTATION_SAMPLE_RATE', 0):
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+
+        duration_ms = recorder.duration * 1000
+        response[QUERIES_HEADER] = str(recorder.count)
+        response[TIME_HEADER] = f'{duration_ms:.1f}'
+        server_timing = f'db;dur={duration_ms:.1f};desc="{recorder.count} queries"'
+        if response.has_header('Server-Timing'):
+            server_timing = f"{response['Server-Timing']}, {server_timing}"
+        response['Server-Timing'] = server_timing
+
+        view = getattr(request, '_sql_view_name', None)
+        fields = {
+            'method': request.method, 'path': request.path, 'status': response.status_code, 'view': view,
+            'db_queries': recorder.count, 'db_time_ms': round(duration_ms, 2),
+        }
+        repeated = recorder.repeated(getattr(settings, 'SQL_REPEATED_QUERY_THRESHOLD', 5))
+        if repeated:
+            response[REPEATED_HEADER] = str(len(repeated))
+            fields['repeated_queries'] = [
+                {'count': count, 'sql': shape[:SHAPE_LOG_LENGTH]} for shape, count in repeated
+            ]
+            logger.warning('Consultas repetidas (posible N+1) en %s: %s', view or request.path,
+                           ', '.join(f'{count}x' for _, count in repeated), extra=fields)
+        logger.info('%s %s: %d consultas en %.1fms', request.method, request.path, recorder.count, duration_ms,
+                    extra=fields)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._sql_view_name = view_name(view_func, request.method)
@@ -0,0 +1,243 @@
+"""
+Logging estructurado y asíncrono (ver LOGGING en settings.py).
+
+El handler QueueHandler deja en el hilo del request solo lo mínimo: agregar el
+contexto (request_id, vista, quote_id, ...) con ContextFilter, resolver el
+mensaje y encolar el registro. Un hilo aparte (QueueListener) lo formatea,
+como JSON con JsonFormatter, y lo escribe. Con la cola llena los registros se
+descartan y se cuentan en lugar de frenar el request.
+
+RequestContextMiddleware asigna el request_id (X-Request-ID) y, en vez del
+log síncrono de cada consulta de django.db.backends, registra solo las que
+tardan SLOW_QUERY_MS o más, muestreadas con SLOW_QUERY_SAMPLE_RATE.
+"""
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+from .sql_instrumentation import SHAPE_LOG_LENGTH, query_shape, view_name
+
+slow_query_logger = logging.getLogger('shipquote_backend.slow_queries')
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+# Un X-Request-ID recibido se respeta solo si tiene esta forma
+_VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+DEFAULT_QUEUE_SIZE = 10000
+
+# Atributos propios de LogRecord: el resto son campos de extra o del contexto
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_context = contextvars.ContextVar('log_context', default={})
+
+
+def bind(**fields):
+    """Agrega campos al contexto de log del request (o de la tarea) en curso."""
+    _context.set({**_context.get(), **fields})
+
+
+def get_context():
+    return _context.get()
+
+
+@contextmanager
+def log_context(**fields):
+    """Contexto de log propio del bloque (por ejemplo, un request que no pasa por el middleware)."""
+    token = _context.set(fields)
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def request_id_from(received):
+    """El X-Request-ID recibido si tiene una forma válida; si no, uno nuevo."""
+    return received if received and _VALID_REQUEST_ID.match(received) else uuid.uuid4().hex
+
+
+class ContextFilter(logging.Filter):
+    """Copia el contexto actual al registro, sin pisar los campos de extra."""
+
+    def filter(self, record):
+        for key, value in _context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        if not hasattr(record, 'request_id'):
+            # El formato de texto lo usa siempre
+            record.request_id = '-'
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro: campos fijos más los de extra y el contexto."""
+
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        if record.stack_info:
+            data['stack'] = record.stack_info
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Encola los registros para un StreamHandler que escribe en otro hilo. El
+    formatter configurado se aplica allí, no en el hilo que registra. El hilo
+    se arranca con el primer registro de cada proceso (sobrevive a los fork
+    de los workers).
+    """
+
+    def __init__(self, stream=None, queue_size=DEFAULT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        super().__init__(queue.Queue(queue_size))
+        self.target = logging.StreamHandler(stream)
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # Proceso hijo: la cola y el hilo del padre no sirven acá
+                self.queue = queue.Queue(self.queue_size)
+            self._listener = logging.handlers.QueueListener(self.queue, self.target)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def emit(self, record):
+        self._ensure_started()
+        super().emit(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Los argumentos pueden cambiar después; la excepción se resuelve a texto acá
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def flush(self):
+        """Espera a que el hilo escriba lo encolado."""
+        if self._pid == os.getpid():
+            with self._start_lock:
+                self._listener.stop()
+                self._listener.start()
+        self.target.flush()
+
+    def close(self):
+        if self._pid == os.getpid():
+            self._listener.stop()
+            self._pid = None
+        self.target.close()
+        super().close()
+
+
+class SlowQueryLogger:
+    """execute_wrapper que registra las consultas lentas (una fracción de ellas)."""
+
+    def __init__(self, threshold_ms, sample_rate=1.0):
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            if duration_ms >= self.threshold_ms and random.random() < self.sample_rate:
+                slow_query_logger.warning('Consulta lenta: %.1fms', duration_ms, extra={
+                    'db_time_ms': round(duration_ms, 2), 'db_alias': context['connection'].alias,
+                    'many': many, 'sql': query_shape(sql)[:SHAPE_LOG_LENGTH],
+                })
+
+
+class RequestContextMiddleware:
+    """
+    Contexto de log por request y registro de consultas lentas (ver el
+    docstring del módulo). Bajo ASGI las consultas corren en otros hilos y
+    solo se asigna el contexto.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _request_id(self, request):
+        request.request_id = request_id_from(request.headers.get(REQUEST_ID_HEADER, ''))
+        return request.request_id
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request_id = self._request_id(request)
+        token = _context.set({'request_id': request_id})
+        try:
+            with ExitStack() as stack:
+                threshold = getattr(settings, 'SLOW_QUERY_MS', None)
+                if threshold is not None:
+                    wrapper = SlowQueryLogger(threshold, getattr(settings, 'SLOW_QUERY_SAMPLE_RATE', 1.0))
+                    for connection in connections.all():
+                        stack.enter_context(connection.execute_wrapper(wrapper))
+                response = self.get_response(request)
+        finally:
+            _context.reset(token)
+        response[REQUEST_ID_HEADER] = request_id
+        return response
+
+    async def __acall__(self, request):
+        request_id = self._request_id(request)
+        token = _context.set({'request_id': request_id})
+        try:
+            response = await self.get_response(request)
+        finally:
+            _context.reset(token)
+        response[REQUEST_ID_HEADER] = request_id
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        bind(view=view_name(view_func, request.method))
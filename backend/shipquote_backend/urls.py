@@ -2,11 +2,14 @@ from django.contrib import admin
 from django.urls import path, include
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
+from .views import database_stats
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/', include('ports.urls')),
     path('api/v1/', include('containers.urls')),
     path('api/v1/', include('quotes.urls')),
+    path('api/v1/database-stats/', database_stats, name='database-stats'),
     
     
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
@@ -0,0 +1,19 @@
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from .database_router import routing_stats
+from .db_pool import pool_stats
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def database_stats(request):
+    """Estado de los pools de conexiones y decisiones de ruteo de este worker."""
+    return Response({
+        'pools': pool_stats(),
+        'routing': [
+            {'alias': alias, 'reason': reason, 'count': count}
+            for (alias, reason), count in sorted(routing_stats().items())
+        ],
+    })
@@ -7,6 +7,7 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shipquote_backend.settings')
 django.setup()
 
 from django.db import connection
+from shipquote_backend.db_pool import pool_stats
 
 def test_database_connection():
     try:
@@ -15,13 +16,14 @@ def test_database_connection():
             cursor.execute("SELECT 1")
             result = cursor.fetchone()
             
-        print("✅ Conexión a SQL Server exitosa!")
+        print(f"✅ Conexión a {connection.display_name} exitosa!")
         print(f"Resultado de prueba: {result}")
         
         # Mostrar información de la base de datos
         print(f"Base de datos: {settings.DATABASES['default']['NAME']}")
-        print(f"Servidor: {settings.DATABASES['default']['HOST']}")
-        print(f"Usuario: {settings.DATABASES['default']['USER']}")
+        print(f"Servidor: {settings.DATABASES['default'].get('HOST') or '(local)'}")
+        print(f"Usuario: {settings.DATABASES['default'].get('USER') or '(local)'}")
+        print(f"Pool de conexiones: {pool_stats()}")
         
     except Exception as e:
         print(f"❌ Error de conexión: {e}")